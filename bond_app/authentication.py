@@ -1,6 +1,7 @@
 import hashlib
 import logging
 from .sam_api import SamKeys
+from .single_flight import SingleFlight
 from werkzeug import exceptions
 
 
@@ -23,20 +24,35 @@ class UserInfo:
         return not self.__eq__(other)
 
 
+# Key of the entry cached in place of Sam user info when Sam rejects a token. Its value is the reason for rejection.
+SAM_LOOKUP_FAILURE_KEY = "bondSamLookupFailure"
+
+
 class AuthenticationConfig:
-    def __init__(self, max_token_life):
+    def __init__(self, max_token_life, negative_token_life=30):
+        """
+        :param max_token_life: Seconds to cache Sam user info for a token.
+        :param negative_token_life: Seconds to remember that Sam rejected a token (unauthorized, unregistered or
+        disabled user). 0 disables caching of rejections.
+        """
         self.max_token_life = max_token_life
+        self.negative_token_life = negative_token_life
 
 
 class Authentication:
-    def __init__(self, config, cache_api, sam_api):
+    def __init__(self, config, cache_api, sam_api, sam_lookup_lease=None):
         """
         :param config: An AuthenticationConfig instance.
         :param cache_api: A CacheApi instance.
+        :param sam_lookup_lease: An optional CacheLease in a cache shared across processes. If set, only one process at
+        a time looks up a token with Sam and the others wait for its result in cache_api.
         """
         self.config = config
         self.cache_api = cache_api
         self.sam_api = sam_api
+        self.sam_lookup_lease = sam_lookup_lease
+        # Concurrent cache misses for the same token within this process share one Sam lookup.
+        self.sam_lookups = SingleFlight()
 
     def auth_user(self, request_state):
         """
@@ -58,16 +74,65 @@ class Authentication:
         cache_key = hashlib.sha256(str.encode(token)).hexdigest()
 
         # First check cache for Sam user info.
-        sam_user_info = self.cache_api.get(namespace="SamUserInfo", key=cache_key)
+        sam_user_info = self._get_cached_sam_user_info(cache_key)
 
         # If cache lookup failed, call Sam.
         # Note this will raise Unauthorized errors as appropriate.
         if sam_user_info is None:
+            sam_user_info = self.sam_lookups.do(cache_key, lambda: self._lookup_sam_user_info(token, cache_key))
+
+        if SAM_LOOKUP_FAILURE_KEY in sam_user_info:
+            raise exceptions.Unauthorized(sam_user_info[SAM_LOOKUP_FAILURE_KEY])
+        return sam_user_info[SamKeys.USER_ID_KEY]
+
+    def _lookup_sam_user_info(self, token, cache_key):
+        """
+        Look up a token with Sam and cache the result, unless another process holds the lookup lease for the token, in
+        which case wait for that process to cache the result instead.
+        """
+        if self.sam_lookup_lease is None:
+            return self._fetch_sam_user_info(token, cache_key)
+
+        lease_token = self.sam_lookup_lease.acquire(cache_key)
+        if lease_token is None:
+            sam_user_info = self.sam_lookup_lease.wait_for(cache_key, lambda: self._get_cached_sam_user_info(cache_key))
+            if sam_user_info is not None:
+                return sam_user_info
+            # The leaseholder did not cache a result in time, so look it up ourselves.
+            return self._fetch_sam_user_info(token, cache_key)
+        try:
+            return self._fetch_sam_user_info(token, cache_key)
+        finally:
+            self.sam_lookup_lease.release(cache_key, lease_token)
+
+    def _fetch_sam_user_info(self, token, cache_key):
+        """
+        Look up a token with Sam and cache the result. If Sam rejects the token, the rejection is cached for a shorter
+        time so that clients retrying a bad token do not each reach Sam.
+        :return: Sam user info, or a dict with SAM_LOOKUP_FAILURE_KEY if Sam rejected the token.
+        """
+        try:
             sam_user_info = self.sam_api.user_info(token)
-            # cache successful Sam responses for 10 minutes.
-            cache_result = self.cache_api.add(namespace="SamUserInfo", key=cache_key,
-                                              value=sam_user_info, expires_in=self.config.max_token_life)
+        except exceptions.Unauthorized as e:
+            return self._cache_sam_lookup_failure(cache_key, e.description)
+        if sam_user_info is None:
+            return self._cache_sam_lookup_failure(cache_key, 'User is not registered in Sam.')
+
+        # cache successful Sam responses for 10 minutes.
+        cache_result = self.cache_api.add(namespace="SamUserInfo", key=cache_key,
+                                          value=sam_user_info, expires_in=self.config.max_token_life)
+        if not cache_result:
+            logging.warning('Unable to cache Sam lookup for user info: {}'.format(sam_user_info))
+        return sam_user_info
+
+    def _cache_sam_lookup_failure(self, cache_key, reason):
+        sam_lookup_failure = {SAM_LOOKUP_FAILURE_KEY: reason}
+        if self.config.negative_token_life > 0:
+            cache_result = self.cache_api.add(namespace="SamUserInfo", key=cache_key, value=sam_lookup_failure,
+                                              expires_in=self.config.negative_token_life)
             if not cache_result:
-                logging.warning('Unable to cache Sam lookup for user info: {}'.format(sam_user_info))
+                logging.warning('Unable to cache Sam lookup failure: {}'.format(reason))
+        return sam_lookup_failure
 
-        return sam_user_info[SamKeys.USER_ID_KEY]
+    def _get_cached_sam_user_info(self, cache_key):
+        return self.cache_api.get(namespace="SamUserInfo", key=cache_key)
@@ -0,0 +1,74 @@
+import contextlib
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundExecutor:
+    """
+    Runs functions on a small pool of daemon threads fed by a bounded queue, so that work can be done off the request
+    path without letting a backlog grow without bound.
+
+    Threads are started on the first submit in each process, so an executor created before a server forks its
+    workers still works in each of them.
+    """
+
+    def __init__(self, max_workers=2, max_queue_size=1000, context_factory=None):
+        """
+        :param max_workers: The number of threads to run functions on.
+        :param max_queue_size: The most functions to hold waiting for a thread. Submits beyond this are dropped.
+        :param context_factory: An optional function returning a context manager to run each function in, e.g. an ndb
+        client's context method, since background threads do not inherit the request's context.
+        """
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.context_factory = context_factory
+        self._queue = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) to run on a background thread. Exceptions it raises are logged.
+        :return: True if queued, False if the queue was full and fn was dropped.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Background queue is full, dropping {}".format(getattr(fn, '__name__', fn)))
+            return False
+
+    def join(self):
+        """Wait until every queued function has run."""
+        if self._queue is not None:
+            self._queue.join()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.max_queue_size)
+            for _ in range(self.max_workers):
+                threading.Thread(target=self._work, args=(self._queue,), daemon=True).start()
+
+    def _work(self, work_queue):
+        while True:
+            fn, args, kwargs = work_queue.get()
+            try:
+                with self._context():
+                    fn(*args, **kwargs)
+            except Exception:
+                logger.exception("Error running {} in the background".format(getattr(fn, '__name__', fn)))
+            finally:
+                work_queue.task_done()
+
+    def _context(self):
+        return self.context_factory() if self.context_factory else contextlib.nullcontext()
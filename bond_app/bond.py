@@ -1,4 +1,5 @@
 import base64
+import hashlib
 import json
 from datetime import datetime
 import logging
@@ -7,7 +8,13 @@ from .jwt_token import JwtToken
 from werkzeug import exceptions
 from dataclasses import dataclass
 
+from . import cache_codec
 from .oauth2_state_store import OAuth2StateStore
+from .single_flight import SingleFlight
+
+# How long to remember that a link was removed, so that access tokens generated from it concurrently are not cached.
+# This must be longer than a call to refresh an access token can take.
+_REVOKED_LINK_LIFETIME = 600
 
 
 class Bond:
@@ -20,7 +27,15 @@ class Bond:
                  fence_tvm,
                  provider_name,
                  user_name_path_expr,
-                 extra_authz_url_params):
+                 extra_authz_url_params,
+                 refresh_lease=None,
+                 refresh_ahead_scheduler=None):
+        """
+        :param refresh_lease: An optional CacheLease in a cache shared across processes. If set, only one process at a
+        time refreshes a user's access token and the others wait for it to be cached.
+        :param refresh_ahead_scheduler: An optional RefreshAheadScheduler. If set, access tokens that are requested are
+        refreshed in the background shortly before their cache entries expire.
+        """
 
         self.oauth_adapter = oauth_adapter
         self.fence_api = fence_api
@@ -31,6 +46,10 @@ class Bond:
         self.provider_name = provider_name
         self.user_name_path_expr = user_name_path_expr
         self.extra_authz_url_params = extra_authz_url_params
+        self.refresh_lease = refresh_lease
+        self.refresh_ahead_scheduler = refresh_ahead_scheduler
+        # Concurrent cache misses for the same user within this process share one refresh.
+        self.access_token_refreshes = SingleFlight()
 
     def build_authz_url(self, scopes, redirect_uri, sam_user_id, provider, state=None):
         """
@@ -112,46 +131,132 @@ class Bond:
         Given a user, lookup their refresh token and use it to retrieve an access token from their OAuth
         provider.
         If an access token was already generated for the user, 
-        and that token has greater than `refresh_threshold` seconds before expiration, return that token. 
+        and that token has greater than `refresh_threshold` seconds before expiration, return that token
+        without looking up the refresh token.
         Otherwise, generate a new token.
         
         If a refresh token cannot be found for the sam_user_id provided, a NotFound will be raised.
         :param sam_user_id: Id stored in Sam for user who initiated request
         :return: Two values: An Access Token string, datetime when that token expires
         """
+        access_token: FenceAccessToken = self._get_cached_access_token(sam_user_id)
+        if access_token:
+            logging.debug(
+                "Retrieved access token from cache. " +
+                f"Access token will expire at {access_token.expires_at}. " +
+                f"SAM user ID: {sam_user_id}. Provider: {self.provider_name}"
+            )
+        else:
+            access_token = self.access_token_refreshes.do(
+                sam_user_id, lambda: self._refresh_access_token(sam_user_id, refresh_threshold))
+            if access_token is None:
+                # This joined a background refresh that left the token to the process holding the refresh lease.
+                access_token = self._refresh_access_token(sam_user_id, refresh_threshold)
+        if self.refresh_ahead_scheduler is not None:
+            self.refresh_ahead_scheduler.track(self, sam_user_id, access_token.expires_at, refresh_threshold)
+        return access_token.value, access_token.expires_at
+
+    def refresh_access_token(self, sam_user_id, refresh_threshold: int = 600, refreshed_after: datetime = None):
+        """
+        Generate and cache a new access token for the user even if a cached one is still valid, e.g. to refresh it
+        before it expires. Does nothing if another process holds the refresh lease for the user, since that process is
+        already caching a new token.
+        If a refresh token cannot be found for the sam_user_id provided, a NotFound will be raised.
+        :param sam_user_id: Id stored in Sam for user who initiated request
+        :param refreshed_after: Optional datetime. If the cached access token expires after it, e.g. because another
+        process has already refreshed the token, the cached token is returned instead of generating a new one.
+        :return: The new or already refreshed FenceAccessToken, or None if another process is refreshing it
+        """
+        return self.access_token_refreshes.do(
+            sam_user_id, lambda: self._refresh_access_token(sam_user_id, refresh_threshold,
+                                                            refreshed_after=refreshed_after, wait=False))
+
+    def _refresh_access_token(self, sam_user_id, refresh_threshold, refreshed_after=datetime.min, wait=True):
+        """
+        Generate and cache a new access token, holding the refresh lease for the user if there is one.
+        :param refreshed_after: A cached access token expiring after this datetime is returned instead of generating a
+        new one, e.g. one cached by another process. None to always generate a new one.
+        :param wait: What to do if another process holds the refresh lease: True to wait for it to cache a token, and
+        generate one if it does not in time, False to return None.
+        :return: A FenceAccessToken, or None if wait is False and another process holds the refresh lease
+        """
+        def get_refreshed_access_token():
+            if refreshed_after is None:
+                return None
+            access_token = self._get_cached_access_token(sam_user_id)
+            if access_token is not None and access_token.expires_at > refreshed_after:
+                return access_token
+            return None
+
+        access_token = get_refreshed_access_token()
+        if access_token is not None:
+            return access_token
+        if self.refresh_lease is None:
+            return self._generate_and_cache_access_token(sam_user_id, refresh_threshold)
+
+        lease_token = self.refresh_lease.acquire(sam_user_id)
+        if lease_token is None:
+            if not wait:
+                return None
+            access_token = self.refresh_lease.wait_for(sam_user_id, get_refreshed_access_token)
+            if access_token is not None:
+                return access_token
+            # The leaseholder did not cache a token in time, so generate one ourselves.
+            return self._generate_and_cache_access_token(sam_user_id, refresh_threshold)
+        try:
+            # The previous leaseholder may have cached a token just before we took the lease.
+            access_token = get_refreshed_access_token()
+            if access_token is not None:
+                return access_token
+            return self._generate_and_cache_access_token(sam_user_id, refresh_threshold)
+        finally:
+            self.refresh_lease.release(sam_user_id, lease_token)
+
+    def _generate_and_cache_access_token(self, sam_user_id, refresh_threshold):
         refresh_token = self.refresh_token_store.lookup(sam_user_id, self.provider_name)
         if refresh_token is not None:
-            access_token: FenceAccessToken = self.cache_api.get(
-                namespace=f"{self.provider_name}:AccessTokens", 
-                key=sam_user_id,
+            access_token_value, expires_at = self.generate_access_token(sam_user_id, refresh_token=refresh_token)
+            logging.debug(
+                "Generated new access token. " +
+                f"Access token will expire at {expires_at} seconds. " +
+                f"SAM user ID: {sam_user_id}. Provider: {self.provider_name}"
             )
-            if access_token:
-                expires_at = access_token.expires_at
-                access_token_value = access_token.value
-                logging.debug(
-                    "Retrieved access token from cache. " +
-                    f"Access token will expire at {expires_at}. " +
-                    f"SAM user ID: {sam_user_id}. Provider: {self.provider_name}"
-                )
-            else:
-                access_token_value, expires_at = self.generate_access_token(sam_user_id, refresh_token=refresh_token)
-                logging.debug(
-                    "Generated new access token. " +
-                    f"Access token will expire at {expires_at} seconds. " +
-                    f"SAM user ID: {sam_user_id}. Provider: {self.provider_name}"
-                )
-                self.cache_api.add(
-                    namespace=f"{self.provider_name}:AccessTokens", 
-                    key=sam_user_id, 
-                    value=FenceAccessToken(value=access_token_value, expires_at=expires_at),
-                    expires_in=(expires_at - datetime.now()).total_seconds() - refresh_threshold,
-                )
-            return access_token_value, expires_at
+            access_token = FenceAccessToken(value=access_token_value, expires_at=expires_at,
+                                            link_version=self._link_version(refresh_token))
+            self._cache_access_token(sam_user_id, access_token, refresh_threshold)
+            return access_token
         else:
             raise exceptions.NotFound(
                 "Could not find refresh token for sam_user_id: {} provider_name: {}\nConsider relinking your account to Bond.".format(
                     sam_user_id, self.provider_name))
-            
+
+    def _get_cached_access_token(self, sam_user_id):
+        return self.cache_api.get(namespace=self._access_tokens_namespace(), key=sam_user_id)
+
+    def _cache_access_token(self, sam_user_id, access_token, refresh_threshold):
+        """
+        Cache an access token until `refresh_threshold` seconds before it expires, unless the link it was generated
+        from has been removed in the meantime.
+
+        unlink_account records the removed link's version before deleting the cached token, and this adds the token
+        before checking for that record, so one of the two always sees the other and a token from a removed link is
+        never left in the cache.
+        """
+        expires_in = (access_token.expires_at - datetime.now()).total_seconds() - refresh_threshold
+        if expires_in <= 0:
+            return
+        self.cache_api.add(
+            namespace=self._access_tokens_namespace(),
+            key=sam_user_id,
+            value=access_token,
+            expires_in=expires_in,
+        )
+        revoked_link_version = self.cache_api.get(namespace=self._revoked_links_namespace(), key=sam_user_id)
+        if revoked_link_version == access_token.link_version:
+            logging.info(f"Link was removed while generating an access token, not caching it. "
+                         f"SAM user ID: {sam_user_id}. Provider: {self.provider_name}")
+            self.cache_api.delete(namespace=self._access_tokens_namespace(), key=sam_user_id)
+
     def unlink_account(self, sam_user_id):
         """
         Revokes user's refresh token and deletes the linkage from the system
@@ -160,10 +265,18 @@ class Bond:
         """
         refresh_token = self.refresh_token_store.lookup(sam_user_id, self.provider_name)
         if refresh_token:
-            self.fence_tvm.remove_service_account(sam_user_id)
+            # When the vending machine shares our cache, its cached tokens are deleted in one call with ours.
+            shares_cache = self.fence_tvm.cache_api is self.cache_api
+            self.fence_tvm.remove_service_account(sam_user_id, delete_cached_tokens=not shares_cache)
             self.oauth_adapter.revoke_refresh_token(refresh_token.token)
             self.refresh_token_store.delete(sam_user_id, self.provider_name)
-            self.cache_api.delete(key=sam_user_id, namespace=f"{self.provider_name}:AccessTokens")
+            # Record the removed link before deleting its cached access token. See _cache_access_token.
+            self.cache_api.add(namespace=self._revoked_links_namespace(), key=sam_user_id,
+                               value=self._link_version(refresh_token), expires_in=_REVOKED_LINK_LIFETIME)
+            cache_keys = [(sam_user_id, self._access_tokens_namespace())]
+            if shares_cache:
+                cache_keys += self.fence_tvm.cached_token_keys(sam_user_id)
+            self.cache_api.delete_multi(cache_keys)
         else:
             logging.warning(
                 "Tried to remove user refresh token, but none was found: sam_user_id: {}, provider_name: {}".format(sam_user_id,
@@ -177,6 +290,17 @@ class Bond:
         """
         return self.refresh_token_store.lookup(sam_user_id, self.provider_name)
 
+    def _access_tokens_namespace(self):
+        return f"{self.provider_name}:AccessTokens"
+
+    def _revoked_links_namespace(self):
+        return f"{self.provider_name}:RevokedLinks"
+
+    @staticmethod
+    def _link_version(refresh_token):
+        """Identifies one link of a user's account, so that relinking can be told apart from the link it replaced."""
+        return hashlib.sha256(str.encode(refresh_token.token)).hexdigest()
+
 
 class FenceKeys:
     """
@@ -190,6 +314,7 @@ class FenceKeys:
     TOKEN_TYPE = 'token_type'
 
 
+@cache_codec.register("FenceAccessToken")
 @dataclass
 class FenceAccessToken:
     """
@@ -197,4 +322,7 @@ class FenceAccessToken:
     """
     value: str
     expires_at: datetime
+    # Version of the link the token was generated from, see Bond._link_version. None for tokens cached before
+    # versions were recorded.
+    link_version: str = None
 
@@ -27,3 +27,55 @@ class CacheApi:
         :return: None if entry at key was deleted or not found
         """
         raise NotImplementedError
+
+    def get_multi(self, keys, namespace=None):
+        """
+        Retrieves the values stored by 'add' for several keys, in as few round trips as the implementation allows.
+        :param keys: An iterable of string keys, or (key, namespace) tuples to read entries from several namespaces.
+        :param namespace: The namespace for keys given as plain strings, if any.
+        :return: A dict from each key as it was given to its value, only for the keys that were found.
+        """
+        values = {}
+        for cache_key in keys:
+            key, key_namespace = split_cache_key(cache_key, namespace)
+            value = self.get(key, namespace=key_namespace)
+            if value is not None:
+                values[cache_key] = value
+        return values
+
+    def add_multi(self, mapping, expires_in=0, namespace=None):
+        """
+        Adds several (key, value) pairs to the cache, in as few round trips as the implementation allows.
+        :param mapping: A dict from string keys, or (key, namespace) tuples, to the values to store.
+        :param expires_in: The number of seconds to keep the entries before expiration. If zero, never expire.
+        :param namespace: The namespace for keys given as plain strings, if any.
+        :return: True if all were added, False if any failed.
+        """
+        results = []
+        for cache_key, value in mapping.items():
+            key, key_namespace = split_cache_key(cache_key, namespace)
+            results.append(self.add(key, value, expires_in=expires_in, namespace=key_namespace))
+        return all(results)
+
+    def delete_multi(self, keys, namespace=None):
+        """
+        Deletes the values specified by several keys, in as few round trips as the implementation allows.
+        :param keys: An iterable of string keys, or (key, namespace) tuples.
+        :param namespace: The namespace for keys given as plain strings, if any.
+        :return: None whether or not the entries were found
+        """
+        for cache_key in keys:
+            key, key_namespace = split_cache_key(cache_key, namespace)
+            self.delete(key, namespace=key_namespace)
+
+
+def split_cache_key(cache_key, namespace=None):
+    """
+    Split a key passed to a CacheApi *_multi method into its key and namespace.
+    :param cache_key: A string key, or a (key, namespace) tuple.
+    :param namespace: The namespace of a string key.
+    :return: (key, namespace)
+    """
+    if isinstance(cache_key, tuple):
+        return cache_key
+    return cache_key, namespace
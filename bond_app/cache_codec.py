@@ -0,0 +1,159 @@
+import base64
+import dataclasses
+import datetime
+import json
+import zlib
+
+# The first byte of every encoded value is the version of the format, so that the format can change without
+# misreading entries written by older versions of Bond.
+_FORMAT_VERSION = 1
+# Flags in the second byte.
+_FLAG_ZLIB = 0x01
+
+# The key marking a JSON object as a tagged value rather than a plain dict.
+_TAG = "__t"
+
+# Dict from type tag to (dataclass, schema version, upgrade function) for the dataclasses registered with register.
+_registered_types_by_tag = {}
+# Dict from dataclass to its type tag.
+_registered_tags_by_type = {}
+
+
+class CacheCodecError(Exception):
+    """Raised when a value cannot be encoded, or encoded bytes cannot be decoded."""
+    pass
+
+
+def register(tag, version=1, upgrade=None):
+    """
+    Class decorator registering a dataclass so that it can be encoded by JsonCacheCodec.
+
+    Instances are stored as their fields, tagged with `tag` and `version`. Bump `version` whenever the fields change
+    incompatibly and pass `upgrade` to convert the fields of entries written with older versions.
+    :param tag: The name stored with encoded instances. Must not change when the class is renamed or moved.
+    :param version: The schema version of the class's fields.
+    :param upgrade: Optional function (fields dict, stored version) -> fields dict for the current version.
+    """
+    def decorator(cls):
+        if tag in _registered_types_by_tag and _registered_types_by_tag[tag][0] is not cls:
+            raise ValueError("Cache codec tag {} is already registered to {}".format(
+                tag, _registered_types_by_tag[tag][0].__name__))
+        _registered_types_by_tag[tag] = (cls, version, upgrade)
+        _registered_tags_by_type[cls] = tag
+        return cls
+
+    return decorator
+
+
+class CacheCodec:
+    """Converts cached values to and from bytes."""
+
+    def encode(self, value):
+        """
+        :param value: The value to store.
+        :return: bytes
+        :raises CacheCodecError: if the value cannot be encoded.
+        """
+        raise NotImplementedError
+
+    def decode(self, data):
+        """
+        :param data: bytes returned by encode.
+        :return: The value that was encoded.
+        :raises CacheCodecError: if the bytes cannot be decoded.
+        """
+        raise NotImplementedError
+
+
+class JsonCacheCodec(CacheCodec):
+    """
+    Encodes values as compact JSON behind a two byte header: the format version and flags.
+
+    Besides JSON's own types it supports tuples, bytes, datetimes, dicts with non-string keys and dataclasses
+    registered with `register`, which are stored as tagged JSON objects. Encoded values larger than
+    `compression_threshold` bytes are compressed with zlib.
+    """
+
+    def __init__(self, compression_threshold=1024, compression_level=6):
+        """
+        :param compression_threshold: Compress encoded values larger than this many bytes. None disables compression.
+        :param compression_level: The zlib compression level.
+        """
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+
+    def encode(self, value):
+        try:
+            payload = json.dumps(_to_json(value), separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        except (TypeError, ValueError) as e:
+            raise CacheCodecError("Cannot encode value of type {}: {}".format(type(value).__name__, e)) from e
+        flags = 0
+        if self.compression_threshold is not None and len(payload) > self.compression_threshold:
+            compressed = zlib.compress(payload, self.compression_level)
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= _FLAG_ZLIB
+        return bytes((_FORMAT_VERSION, flags)) + payload
+
+    def decode(self, data):
+        if len(data) < 2:
+            raise CacheCodecError("Encoded value is too short")
+        version, flags = data[0], data[1]
+        if version != _FORMAT_VERSION:
+            raise CacheCodecError("Unknown cache format version {}".format(version))
+        payload = data[2:]
+        try:
+            if flags & _FLAG_ZLIB:
+                payload = zlib.decompress(payload)
+            return json.loads(payload.decode('utf-8'), object_hook=_from_json_object)
+        except (zlib.error, UnicodeDecodeError, ValueError, TypeError, KeyError) as e:
+            raise CacheCodecError("Cannot decode value: {}".format(e)) from e
+
+
+def _to_json(value):
+    """Convert a value to JSON types, tagging the types that JSON does not have."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [_to_json(item) for item in value]
+    if isinstance(value, dict):
+        if _TAG not in value and all(isinstance(key, str) for key in value):
+            return {key: _to_json(item) for key, item in value.items()}
+        return {_TAG: "dict", "v": [[_to_json(key), _to_json(item)] for key, item in value.items()]}
+    if isinstance(value, tuple):
+        return {_TAG: "tuple", "v": [_to_json(item) for item in value]}
+    if isinstance(value, bytes):
+        return {_TAG: "bytes", "v": base64.b64encode(value).decode('ascii')}
+    if isinstance(value, datetime.datetime):
+        return {_TAG: "datetime", "v": value.isoformat()}
+    tag = _registered_tags_by_type.get(type(value))
+    if tag is not None:
+        version = _registered_types_by_tag[tag][1]
+        fields = {field.name: _to_json(getattr(value, field.name)) for field in dataclasses.fields(value)}
+        return {_TAG: tag, "s": version, "v": fields}
+    raise TypeError("type {} is not registered with the cache codec".format(type(value).__name__))
+
+
+def _from_json_object(value):
+    """Convert a JSON object written by _to_json back to the original value. Its contents are already converted."""
+    tag = value.get(_TAG)
+    if tag is None:
+        return value
+    if tag == "dict":
+        return {key: item for key, item in value["v"]}
+    if tag == "tuple":
+        return tuple(value["v"])
+    if tag == "bytes":
+        return base64.b64decode(value["v"])
+    if tag == "datetime":
+        return datetime.datetime.fromisoformat(value["v"])
+    if tag not in _registered_types_by_tag:
+        raise ValueError("unknown type tag {}".format(tag))
+    cls, version, upgrade = _registered_types_by_tag[tag]
+    fields = value["v"]
+    stored_version = value["s"]
+    if stored_version != version:
+        if upgrade is None or stored_version > version:
+            raise ValueError("cannot read version {} of {}, expected version {}".format(stored_version, tag, version))
+        fields = upgrade(fields, stored_version)
+    return cls(**fields)
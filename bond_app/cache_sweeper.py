@@ -0,0 +1,118 @@
+import argparse
+import datetime
+import logging
+import time
+from dataclasses import dataclass
+
+from google.cloud import ndb
+
+from .datastore_cache_api import CacheEntry
+from .util import create_ndb_client
+
+logger = logging.getLogger(__name__)
+
+# The id of the single CacheSweepCheckpoint.
+_CHECKPOINT_ID = "CacheEntry"
+
+
+class CacheSweepCheckpoint(ndb.Model):
+    """Datastore model recording how far an unfinished sweep of expired CacheEntries got, so the next run resumes."""
+    # The urlsafe cursor after the last batch deleted.
+    cursor = ndb.TextProperty()
+    # The expiration cutoff of the sweep. The cursor is only valid for the query with this cutoff.
+    expired_before = ndb.DateTimeProperty(indexed=False)
+    # When the sweep started.
+    started_at = ndb.DateTimeProperty(indexed=False)
+
+
+@dataclass
+class SweepResult:
+    """Counts for one run of CacheSweeper.sweep."""
+    deleted: int
+    batches: int
+    # True if every entry expired before the sweep's cutoff has been deleted, False if the next run will resume.
+    complete: bool
+
+
+class CacheSweeper:
+    """
+    Deletes expired CacheEntries from Datastore, which DatastoreCacheApi does not do on its own.
+
+    Each run pages through a keys-only query on expires_at and deletes each page with one delete_multi, stopping
+    once `time_budget` seconds have passed. An unfinished sweep saves its cursor in a CacheSweepCheckpoint so that the
+    next run picks up where it stopped instead of scanning from the start, so any number of expired entries are
+    eventually deleted by runs that each fit inside a request.
+    """
+
+    def __init__(self, batch_size=500, time_budget=30, clock=time.monotonic):
+        """
+        :param batch_size: The number of entries to delete per delete_multi. Datastore allows at most 500.
+        :param time_budget: Seconds after which a run stops starting new batches. At least one batch always runs.
+        :param clock: Function returning the current time in seconds, for measuring the time budget.
+        """
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self.clock = clock
+
+    def sweep(self):
+        """
+        Delete expired CacheEntries until they are all gone or the time budget runs out.
+        :return: SweepResult
+        """
+        deadline = self.clock() + self.time_budget
+        checkpoint_key = ndb.Key(CacheSweepCheckpoint, _CHECKPOINT_ID)
+        checkpoint = checkpoint_key.get()
+        if checkpoint is None:
+            now = datetime.datetime.now()
+            checkpoint = CacheSweepCheckpoint(key=checkpoint_key, expired_before=now, started_at=now)
+        else:
+            logger.info("Resuming sweep of cache entries expired before {} started at {}".format(
+                checkpoint.expired_before, checkpoint.started_at))
+        cursor = ndb.Cursor(urlsafe=checkpoint.cursor) if checkpoint.cursor else None
+        query = CacheEntry.query(CacheEntry.expires_at < checkpoint.expired_before)
+
+        deleted = 0
+        batches = 0
+        more = True
+        while more and (batches == 0 or self.clock() < deadline):
+            keys, cursor, more = query.fetch_page(self.batch_size, start_cursor=cursor, keys_only=True)
+            if keys:
+                ndb.delete_multi(keys)
+                deleted += len(keys)
+            batches += 1
+            more = more and cursor is not None
+
+        if more:
+            checkpoint.cursor = cursor.urlsafe().decode('ascii')
+            checkpoint.put()
+        elif checkpoint.cursor is not None:
+            # The resumed sweep is finished.
+            checkpoint_key.delete()
+        result = SweepResult(deleted=deleted, batches=batches, complete=not more)
+        logger.info("Deleted {} expired cache entries in {} batches, {}".format(
+            deleted, batches, "sweep complete" if result.complete else "resuming next run"))
+        return result
+
+
+def main(argv=None):
+    """Sweep expired cache entries from the command line, running until the sweep is complete."""
+    parser = argparse.ArgumentParser(description="Delete expired Bond cache entries from Datastore.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Entries to delete per batch.")
+    parser.add_argument("--time-budget", type=float, default=30,
+                        help="Seconds per run before checkpointing. The sweep runs until complete either way.")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    sweeper = CacheSweeper(batch_size=args.batch_size, time_budget=args.time_budget)
+    total_deleted = 0
+    with create_ndb_client().context():
+        while True:
+            result = sweeper.sweep()
+            total_deleted += result.deleted
+            if result.complete:
+                break
+    print("Deleted {} expired cache entries".format(total_deleted))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,22 @@
 import datetime
+import logging
+from urllib.parse import quote
+
 from google.cloud import ndb
 from google.api_core.exceptions import InvalidArgument
-from .cache_api import CacheApi
+
+from .cache_api import CacheApi, split_cache_key
+from .cache_codec import CacheCodecError, JsonCacheCodec
 
 _NO_EXPIRATION_DATETIME = datetime.datetime(year=3000, month=1, day=1)
 
 
 class CacheEntry(ndb.Model):
     """Datastore model for cache values and expirations."""
-    # The value stored in the cache.
+    # The value stored in the cache, encoded by the DatastoreCacheApi's CacheCodec.
+    encoded_value = ndb.BlobProperty()
+    # The pickled value stored in the cache by older versions of Bond, and by this one for values the codec cannot
+    # encode. Only read if encoded_value is not set.
     value = ndb.PickleProperty()
     # The datetime when to expire the cache entry, or _NO_EXPIRATION_DATETIME for no expiration.
     # Datastore docs warn against doing this at high write rates.
@@ -21,39 +29,137 @@ class DatastoreCacheApi(CacheApi):
     A CacheApi backed by Datastore.
 
     N.B. expiration does not happen automatically. In appengine we use a cron.yml to ensure that we periodically
-    delete expired entries.
+    delete expired entries, by calling /api/link/v1/clear-expired-cache-datastore-entries which runs a CacheSweeper.
+
+    Values are encoded with a CacheCodec, JsonCacheCodec by default. Entries pickled by older versions of Bond are still
+    read.
+
+    Entries are root entities whose names combine the namespace and key, so that each entry is its own entity group.
+    Older versions of Bond put every entry of a namespace under one "cache namespace" ancestor. Entries in that layout
+    are only read, and deleted along with the new ones, if read_legacy_keys is True, which looks up a second key on
+    every read.
     """
 
+    def __init__(self, codec=None, read_legacy_keys=False):
+        """
+        :param codec: The CacheCodec to encode values with.
+        :param read_legacy_keys: Whether to also look for entries under the keys used by older versions of Bond, e.g.
+        while upgrading from one. Without it their entries are misses, and are replaced under the new keys.
+        """
+        self.codec = codec or JsonCacheCodec()
+        self.read_legacy_keys = read_legacy_keys
+
     def add(self, key, value, expires_in=0, namespace=None):
         try:
-            CacheEntry(key=DatastoreCacheApi._build_cache_key(key, namespace), value=value,
-                       expires_at=DatastoreCacheApi._calculate_expiration(expires_in)).put()
+            self._create_entry(DatastoreCacheApi._build_cache_key(key, namespace), value,
+                               DatastoreCacheApi._calculate_expiration(expires_in)).put()
             return True
         except InvalidArgument:
             return False
 
     def get(self, key, namespace=None):
         try:
-            entry = DatastoreCacheApi._build_cache_key(key, namespace).get()
-            if entry and entry.expires_at >= datetime.datetime.now():
-                return entry.value
-            return None
+            # Both layouts are read in one round trip.
+            entries = ndb.get_multi(self._lookup_keys(key, namespace))
         except InvalidArgument:
             return None
+        return self._first_value(entries, datetime.datetime.now())
 
     def delete(self, key, namespace=None):
         try:
-            DatastoreCacheApi._build_cache_key(key, namespace).delete()
+            ndb.delete_multi(self._lookup_keys(key, namespace))
         except InvalidArgument:
             pass
 
+    def get_multi(self, keys, namespace=None):
+        keys = list(keys)
+        lookup_keys = [self._lookup_keys(*split_cache_key(cache_key, namespace)) for cache_key in keys]
+        try:
+            entries = ndb.get_multi([lookup_key for key_lookup_keys in lookup_keys for lookup_key in key_lookup_keys])
+        except InvalidArgument:
+            # Some key is invalid, e.g. too long. Fall back to one lookup per key so that the valid keys still hit.
+            return super().get_multi(keys, namespace=namespace)
+        now = datetime.datetime.now()
+        values = {}
+        for cache_key, key_lookup_keys in zip(keys, lookup_keys):
+            value = self._first_value(entries[:len(key_lookup_keys)], now)
+            entries = entries[len(key_lookup_keys):]
+            if value is not None:
+                values[cache_key] = value
+        return values
+
+    def add_multi(self, mapping, expires_in=0, namespace=None):
+        expires_at = DatastoreCacheApi._calculate_expiration(expires_in)
+        try:
+            ndb.put_multi([self._create_entry(self._build_cache_key(*split_cache_key(cache_key, namespace)), value,
+                                              expires_at)
+                           for cache_key, value in mapping.items()])
+            return True
+        except InvalidArgument:
+            # Add the valid entries one by one, returning False for the invalid ones.
+            return super().add_multi(mapping, expires_in=expires_in, namespace=namespace)
+
+    def delete_multi(self, keys, namespace=None):
+        keys = list(keys)
+        try:
+            ndb.delete_multi([lookup_key for cache_key in keys
+                              for lookup_key in self._lookup_keys(*split_cache_key(cache_key, namespace))])
+        except InvalidArgument:
+            super().delete_multi(keys, namespace=namespace)
+
+    def _lookup_keys(self, key, namespace):
+        """The ndb Keys an entry for the key and namespace may be stored under, the current layout first."""
+        # A legacy key without a namespace that looks like a current key is one, so is not looked up as legacy.
+        if self.read_legacy_keys and (namespace is not None or not key.startswith(("k:", "n:"))):
+            return [DatastoreCacheApi._build_cache_key(key, namespace),
+                    DatastoreCacheApi._build_legacy_cache_key(key, namespace)]
+        return [DatastoreCacheApi._build_cache_key(key, namespace)]
+
+    def _first_value(self, entries, now):
+        """Return the value of the first of the entries that has one, or None."""
+        for entry in entries:
+            value = self._entry_value(entry, now)
+            if value is not None:
+                return value
+        return None
+
+    def _create_entry(self, key, value, expires_at):
+        """Create a CacheEntry holding the encoded value, or the pickled value if the codec cannot encode it."""
+        try:
+            return CacheEntry(key=key, encoded_value=self.codec.encode(value), expires_at=expires_at)
+        except CacheCodecError:
+            logging.warning("Pickling cache value the codec cannot encode", exc_info=True)
+            return CacheEntry(key=key, value=value, expires_at=expires_at)
+
+    def _entry_value(self, entry, now):
+        """Return the value of the entry, or None if there is no entry, it has expired or it cannot be decoded."""
+        if entry is None or entry.expires_at < now:
+            return None
+        if entry.encoded_value is None:
+            return entry.value
+        try:
+            return self.codec.decode(entry.encoded_value)
+        except CacheCodecError:
+            # Treat it as a miss so that it is replaced, e.g. after a rollback to a version with an older format.
+            logging.warning("Could not decode cache entry {}".format(entry.key), exc_info=True)
+            return None
+
     @staticmethod
     def _build_cache_key(key, namespace):
         """
         Create an ndb Key for the key and namespace.
         Raises InvalidArgument if the cache key is invalid. Note Datastore string cache keys
-        must be at most 1500 bytes.
+        must be at most 1500 bytes, including the namespace.
         """
+        if namespace is not None:
+            # The namespace is quoted so that it cannot contain the separator.
+            return ndb.Key(CacheEntry, "n:{}:{}".format(quote(namespace, safe=''), key))
+        else:
+            return ndb.Key(CacheEntry, "k:{}".format(key))
+
+    @staticmethod
+    def _build_legacy_cache_key(key, namespace):
+        """Create the ndb Key older versions of Bond stored the entry for the key and namespace under."""
         if namespace is not None:
             return ndb.Key("cache namespace", namespace, CacheEntry, key)
         else:
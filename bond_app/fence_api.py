@@ -1,13 +1,19 @@
 from werkzeug import exceptions
-import requests
 import logging
 import json
 
+from .http_client import HttpClient
+
 logger = logging.getLogger(__name__)
 
 
 class FenceApi:
-    def __init__(self, base_url):
+    def __init__(self, base_url, http_client=None):
+        """
+        :param base_url: The base url of the fence.
+        :param http_client: The HttpClient to call the fence with. A new one is created if None.
+        """
+        self.http_client = http_client or HttpClient()
         self.credentials_google_url = base_url + "/user/credentials/google"
         self.revoke_url = base_url + "/user/oauth2/revoke"
         self.delete_service_account_url = base_url + "/user/credentials/google/"
@@ -20,7 +26,7 @@ class FenceApi:
         :return: service account key json
         """
         headers = {'Authorization': 'Bearer ' + access_token}
-        result = requests.post(url=self.credentials_google_url, headers=headers)
+        result = self.http_client.post(url=self.credentials_google_url, headers=headers)
         logger.debug("Getting new Service Account JSON Key from Fence via - request: POST {} - status code: {} - "
                      .format(self.credentials_google_url, result.status_code))
         if result.status_code // 100 == 2:
@@ -58,7 +64,7 @@ class FenceApi:
         :return: service account key json
         """
         headers = {'Authorization': 'Bearer ' + access_token}
-        result = requests.delete(url=self.delete_service_account_url + key_id, headers=headers)
+        result = self.http_client.delete(url=self.delete_service_account_url + key_id, headers=headers)
         logger.info("request: DELETE {} - status code: {}".format(self.delete_service_account_url, result.status_code))
         # Sometimes Fence returns a 4xx error like when it cannot find the key_id that we are trying to delete. From
         # our perspective, that's fine, we wanted to delete that key anyways, so if Fence has already deleted it and no
@@ -67,7 +73,7 @@ class FenceApi:
             raise exceptions.InternalServerError("fence status code {}, error body {}".format(result.status_code, result.content))
 
     def revoke_refresh_token(self, refresh_token):
-        result = requests.post(url=self.revoke_url, data=refresh_token)
+        result = self.http_client.post(url=self.revoke_url, data=refresh_token)
         if result.status_code // 100 != 2:
             if result.status_code != 400:
                 raise exceptions.InternalServerError("fence status code {}, error body {}"
@@ -79,7 +85,7 @@ class FenceApi:
         :return: 2 values: boolean ok or not, status message if not ok
         """
         try:
-            result = requests.get(url=self.status_url)
+            result = self.http_client.get(url=self.status_url)
             if result.status_code // 100 != 2:
                 return False, "fence status code {}, error body {}".format(result.status_code, result.content)
             else:
@@ -1,10 +1,16 @@
 import datetime
+import random
+import threading
 import time
 import logging
+import uuid
 from dataclasses import dataclass
 
 from google.cloud import ndb
 
+from .lock_provider import LockProvider
+from .single_flight import SingleFlight
+
 logger = logging.getLogger(__name__)
 
 # How long to keep a fence service account key before expiring it.
@@ -25,8 +31,11 @@ class FenceServiceAccount(ndb.Model):
     # The datetime when to expire the service account key. Only set when the key_json is not None.
     expires_at = ndb.DateTimeProperty()
     # The datetime of when the current lock on updating this model expires. The model should only be updated by
-    # a service that holds a lock. Only set when the key_json is not set or has expired.
+    # a service that holds a lock. Only set when the key_json is not set, has expired, or is being rotated ahead of
+    # expiring. Only used by DatastoreLockProvider.
     update_lock_timeout = ndb.DateTimeProperty()
+    # The token of the current lock holder. Only set along with update_lock_timeout.
+    update_lock_token = ndb.StringProperty()
 
 
 class ServiceAccountNotUpdatedException(Exception):
@@ -34,6 +43,11 @@ class ServiceAccountNotUpdatedException(Exception):
     pass
 
 
+class ServiceAccountUpdateInProgressException(Exception):
+    """An exception for when a fence service account is being updated by another request and the caller asked not to wait."""
+    pass
+
+
 class FenceTokenStorage:
     """
     Stores service account tokens retrieved from fences and manages distributed concurrent updates so that only one access
@@ -46,6 +60,46 @@ class FenceTokenStorage:
     This is abstracted as its own class so that we can stub out the Datastore dependency in tests.
     """
 
+    def __init__(self, executor=None, rotation_window=datetime.timedelta(0), wait_initial_interval=0.05,
+                 wait_max_interval=1.0, wait_deadline=30, lock_provider=None, lock_lease_seconds=30,
+                 max_lock_retries=2):
+        """
+        :param executor: An optional BackgroundExecutor to rotate keys on. Keys are only rotated ahead of expiration if
+        this is set.
+        :param rotation_window: How long before a stored key expires to start fetching its replacement in the
+        background. The stored key keeps being returned until its replacement is stored, so requests for active users
+        do not wait on fence.
+        :param wait_initial_interval: Seconds to wait before the first re-read of a key that another process is
+        updating. The wait doubles, with jitter, after each read.
+        :param wait_max_interval: The longest wait in seconds between re-reads of a key being updated.
+        :param wait_deadline: The most seconds to wait for another process to update a key.
+        :param lock_provider: The LockProvider for updating keys. Defaults to a DatastoreLockProvider.
+        :param lock_lease_seconds: The lease on the update lock. The holder extends it every third of the lease while
+        fetching from fence, so it only runs out if the holder dies.
+        :param max_lock_retries: How many more times a waiter tries to take the lock itself when the lock is released
+        without an update, within wait_deadline.
+        """
+        self.lock_provider = lock_provider or DatastoreLockProvider()
+        self.executor = executor
+        self.rotation_window = rotation_window
+        # Concurrent fetches of the same ProviderUser's key in this process share one attempt at the update lock.
+        self._fetches = SingleFlight()
+        # ProviderUsers whose keys are being rotated by this process.
+        self._rotating = set()
+        self._rotating_lock = threading.Lock()
+        self.wait_initial_interval = wait_initial_interval
+        self.wait_max_interval = wait_max_interval
+        self.wait_deadline = wait_deadline
+        # Notified whenever this process finishes updating a key, so that local waiters re-read it right away.
+        self._updated = threading.Condition()
+        # Counts updates finished in this process, so that a waiter does not miss one that finishes before it waits.
+        self._update_count = 0
+        self.lock_lease_seconds = lock_lease_seconds
+        self.max_lock_retries = max_lock_retries
+        self._counts = {"lease_extensions": 0, "lease_extension_failures": 0, "lock_retries": 0,
+                        "lost_lock_discards": 0}
+        self._counts_lock = threading.Lock()
+
     def delete(self, provider_user):
         """
         Delete the stored fence service account info for the ProviderUser.
@@ -58,7 +112,7 @@ class FenceTokenStorage:
             fsa_key.delete()
         return fence_service_account.key_json if fence_service_account else None
 
-    def retrieve(self, provider_user, prep_key_fn, fence_fetch_fn):
+    def retrieve(self, provider_user, prep_key_fn, fence_fetch_fn, wait=True):
         """
         Retrieve the stored fence service account json key for provider_user, waiting as needed, or create, store, and
         return the fence service accoutn json key for the provider_user.
@@ -70,6 +124,8 @@ class FenceTokenStorage:
         :param fence_fetch_fn: The function to fetch the credentials from the fence. This function will ensure that
         fence_fetch_fn is not called multiple times concurrently. Arguments should work as
         fence_fetch_fn(prep_key_fn(key)) -> returns the string fence account credentials.
+        :param wait: If False, raise ServiceAccountUpdateInProgressException instead of waiting when another request is
+        fetching the key.
         :return returns the fence service account json key and the expiration time for that value.
         """
         fence_service_account = self._build_fence_service_account_key(provider_user).get()
@@ -77,72 +133,200 @@ class FenceTokenStorage:
         if fence_service_account is None or \
                 fence_service_account.expires_at is None or \
                 fence_service_account.expires_at < now:
-            fence_service_account = self._fetch_and_cache_service_account(provider_user, prep_key_fn, fence_fetch_fn)
+            if wait:
+                fence_service_account = self._fetches.do(
+                    provider_user,
+                    lambda: self._fetch_and_cache_service_account(provider_user, prep_key_fn, fence_fetch_fn))
+            elif self._fetches.in_flight(provider_user):
+                raise ServiceAccountUpdateInProgressException(
+                    "key for {} is being fetched in this process".format(provider_user))
+            else:
+                fence_service_account = self._fetch_and_cache_service_account(provider_user, prep_key_fn,
+                                                                              fence_fetch_fn, wait=False)
+        elif fence_service_account.expires_at - self.rotation_window < now:
+            self._rotate_in_background(provider_user, prep_key_fn, fence_fetch_fn)
 
         return (fence_service_account.key_json, fence_service_account.expires_at)
 
-    def _fetch_and_cache_service_account(self, provider_user, prep_key_fn, fence_fetch_fn):
+    def _fetch_and_cache_service_account(self, provider_user, prep_key_fn, fence_fetch_fn, wait=True):
         """
         Fetch a new service account from fence. We must be careful that concurrent requests result in only one
         key request to fence so the service account does not run out of keys (google limits to 10).
+        If wait is False, raise ServiceAccountUpdateInProgressException if someone else holds the lock.
         """
+        fsa_key = self._build_fence_service_account_key(provider_user)
+        if not wait and self.lock_provider.is_locked(provider_user):
+            # Fail before prepping the key, which may call out to fence, since the caller will not wait for the lock.
+            raise ServiceAccountUpdateInProgressException("lock on key {} is held".format(fsa_key))
         # Prep key before acquiring lock to keep lock duration as small as possible.
         prepped_key = prep_key_fn(provider_user)
-        fsa_key = self._build_fence_service_account_key(provider_user)
+        deadline = time.time() + self.wait_deadline
+
+        for attempt in range(self.max_lock_retries + 1):
+            if attempt > 0:
+                # The lock was released, or its lease ran out, without an update. Try to take it ourselves.
+                logger.info("Retrying lock on FenceServiceAccount: {}".format(fsa_key))
+                self._count("lock_retries")
+            lock_token = self.lock_provider.acquire(provider_user, self.lock_lease_seconds)
+            if lock_token is not None:
+                return self._fetch_and_store_service_account(provider_user, lock_token, prepped_key, fence_fetch_fn)
+            if not wait:
+                raise ServiceAccountUpdateInProgressException("lock on key {} is held".format(fsa_key))
 
-        if self._acquire_lock(fsa_key):
-            key_json = fence_fetch_fn(prepped_key)
+            fence_service_account = self._wait_for_update(provider_user, deadline)
+            logger.info("Lock expired on FenceServiceAccount: {}".format(fence_service_account))
+            if fence_service_account is not None and fence_service_account.expires_at and \
+                    fence_service_account.expires_at > datetime.datetime.now():
+                return fence_service_account
+            if time.time() >= deadline:
+                break
+
+        # We waited for a fence service account update since someone else was holding the lock, but the
+        # lock expired, or we gave up waiting, without a valid update.
+        failure_str = "lock on key {} expired but value was not updated".format(fsa_key)
+        logger.warning(failure_str)
+        raise ServiceAccountNotUpdatedException(failure_str)
+
+    def stats(self):
+        """
+        :return: dict of counts since this FenceTokenStorage was created: "lease_extensions" and
+        "lease_extension_failures" of the update lock while fetching from fence, "lost_lock_discards" of keys fetched
+        after the lock was lost, and "lock_retries" by waiters after the lock was released without an update.
+        """
+        with self._counts_lock:
+            return dict(self._counts)
+
+    def _count(self, name):
+        with self._counts_lock:
+            self._counts[name] += 1
+
+    def _rotate_in_background(self, provider_user, prep_key_fn, fence_fetch_fn):
+        """Queue a rotation of provider_user's key unless rotation is off or this process is already rotating it."""
+        if self.executor is None:
+            return
+        with self._rotating_lock:
+            if provider_user in self._rotating:
+                return
+            self._rotating.add(provider_user)
+        if not self.executor.submit(self._rotate, provider_user, prep_key_fn, fence_fetch_fn):
+            with self._rotating_lock:
+                self._rotating.discard(provider_user)
+
+    def _rotate(self, provider_user, prep_key_fn, fence_fetch_fn):
+        """
+        Fetch and store a new key for provider_user ahead of the stored key's expiration. Does nothing if another
+        process holds the update lock, since it is already fetching a new key.
+        """
+        try:
+            fsa_key = self._build_fence_service_account_key(provider_user)
+            fence_service_account = fsa_key.get()
+            if fence_service_account is None or fence_service_account.expires_at is None or \
+                    fence_service_account.expires_at - self.rotation_window >= datetime.datetime.now():
+                # The key was removed, or another process already rotated it.
+                return
+            if self.lock_provider.is_locked(provider_user):
+                # Another process is rotating it, so do not prep a key, which may call out to fence, just to find out.
+                return
+            prepped_key = prep_key_fn(provider_user)
+            lock_token = self.lock_provider.acquire(provider_user, self.lock_lease_seconds)
+            if lock_token is not None:
+                logger.info("Rotating FenceServiceAccount key for {}".format(provider_user))
+                self._fetch_and_store_service_account(provider_user, lock_token, prepped_key, fence_fetch_fn)
+        finally:
+            with self._rotating_lock:
+                self._rotating.discard(provider_user)
+
+    def _fetch_and_store_service_account(self, provider_user, lock_token, prepped_key, fence_fetch_fn):
+        """Fetch a new key from fence and store it, then release the update lock held with lock_token."""
+        try:
+            key_json = self._fetch_with_heartbeat(provider_user, lock_token, prepped_key, fence_fetch_fn)
             fence_service_account = FenceServiceAccount(key_json=key_json,
                                                         expires_at=datetime.datetime.now() + _FSA_KEY_LIFETIME,
                                                         update_lock_timeout=None,
-                                                        key=fsa_key)
+                                                        update_lock_token=None,
+                                                        key=self._build_fence_service_account_key(provider_user))
             fence_service_account.put()
+            return fence_service_account
+        finally:
+            try:
+                self.lock_provider.release(provider_user, lock_token)
+            except Exception:
+                logger.info("Could not release lock on {}, it will expire on its own".format(provider_user),
+                            exc_info=True)
+            with self._updated:
+                self._update_count += 1
+                self._updated.notify_all()
 
-        else:
-            fence_service_account = self._wait_for_update(fsa_key)
-            logger.info("Lock expired on FenceServiceAccount: {}".format(fence_service_account))
-            if not fence_service_account.expires_at or fence_service_account.expires_at < datetime.datetime.now():
-                # We waited for a fence service account update since someone else was holding the lock, but the
-                # lock expired without a valid update.
-                # we could recursively call _fetch_service_account_json at this point but let's start with failure
-                failure_str = "lock on key {} expired but value was not updated".format(fsa_key)
-                logger.warning(failure_str)
-                raise ServiceAccountNotUpdatedException(failure_str)
-
-        return fence_service_account
-
-    def _acquire_lock(self, fsa_key):
+    def _fetch_with_heartbeat(self, provider_user, lock_token, prepped_key, fence_fetch_fn):
         """
-        This thing can return FALSE for 2 different reasons!  And those "FALSE" responses might mean two very different
-        things.  Either we were unable to successfully lock the FenceServiceAccount record because it is already locked,
-        OR something else happened.  In the latter case, the transaction may have been successful, but the call to grab
-        the lock still threw an Exception for some reason.
-        :param fsa_key:
-        :return: True if the lock was acquired, False otherwise
+        Call fence_fetch_fn(prepped_key) on another thread, extending the lease on the update lock from this one until
+        it returns, so that a slow fence does not let the lock lapse and another process fetch a second key.
+        If an extension failed, the lock may have passed to another process that is fetching a key of its own, so the
+        fetched key is only returned if the lock is still held.
+        :raises ServiceAccountNotUpdatedException: if the lock was lost while fetching.
         """
+        done = threading.Event()
+        outcome = {}
+
+        def fetch():
+            try:
+                outcome["key_json"] = fence_fetch_fn(prepped_key)
+            except Exception as e:
+                outcome["error"] = e
+            finally:
+                done.set()
+
+        threading.Thread(target=fetch, daemon=True).start()
+        extension_failed = False
+        while not done.wait(self.lock_lease_seconds / 3):
+            if self._extend_lock(provider_user, lock_token):
+                self._count("lease_extensions")
+            else:
+                logger.warning("Could not extend lock on {} while fetching its key from fence".format(provider_user))
+                self._count("lease_extension_failures")
+                extension_failed = True
+        if "error" in outcome:
+            raise outcome["error"]
+        if extension_failed and not self._extend_lock(provider_user, lock_token):
+            # Storing the key would overwrite the one the new lock holder stores, so the key fetched here is orphaned.
+            self._count("lost_lock_discards")
+            failure_str = "lost lock on {} while fetching its key from fence, discarding the fetched key".format(
+                provider_user)
+            logger.warning(failure_str)
+            raise ServiceAccountNotUpdatedException(failure_str)
+        return outcome["key_json"]
+
+    def _extend_lock(self, provider_user, lock_token):
+        """:return: True if the lease on the update lock was extended, False if lock_token no longer holds it."""
         try:
-            return self._lock_fence_service_account(fsa_key)
-        # We expect a transaction failure or timeout when someone else acquires the lock instead of us. That's fine,
-        # it's just a different way we could fail to acquire the lock. Unfortunately, docs indicate it is possible to
-        # receive an exception even when a transaction completes. In that case, we'll have acquired the lock but
-        # will not update it and the lock will eventually time out.
-        # https://cloud.google.com/appengine/docs/standard/python/datastore/transactions#using_transactions
-        except:
-            logger.info("An exception was thrown while trying to lock the FenceServiceAccount entry", exc_info=True)
+            return self.lock_provider.extend(provider_user, lock_token, self.lock_lease_seconds)
+        except Exception:
+            logger.info("Error extending lock on {}".format(provider_user), exc_info=True)
             return False
 
-    def _wait_for_update(self, fsa_key):
+    def _wait_for_update(self, provider_user, deadline):
         """
-        wait for new fence service account, exit conditions are the lock goes away or expires
-        :param fsa_key:
-        :return: updated fence service account
+        wait for new fence service account, exit conditions are the lock goes away or expires, or wait_deadline passes.
+        Checks of the lock back off exponentially with jitter, and are made early when an update in this process
+        finishes.
+        :param provider_user:
+        :param deadline: time.time() after which to stop waiting.
+        :return: updated fence service account, or None if there is none
         """
-        # need to be sure to get the fence_service_account in a new transaction every time so that we get a fresh copy
-        fence_service_account = self._get_fence_service_account_in_new_txn(fsa_key)
-        while fence_service_account.update_lock_timeout and fence_service_account.update_lock_timeout > datetime.datetime.now():
-            time.sleep(1)
-            fence_service_account = self._get_fence_service_account_in_new_txn(fsa_key)
-        return fence_service_account
+        interval = self.wait_initial_interval
+        update_count = self._update_count
+        while self.lock_provider.is_locked(provider_user):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                logger.info("Gave up waiting for update of {}".format(provider_user))
+                break
+            with self._updated:
+                self._updated.wait_for(lambda: self._update_count != update_count,
+                                       timeout=min(random.uniform(interval / 2, interval), remaining))
+                update_count = self._update_count
+            interval = min(interval * 2, self.wait_max_interval)
+        # need to be sure to get the fence_service_account in a new transaction so that we get a fresh copy
+        return self._get_fence_service_account_in_new_txn(self._build_fence_service_account_key(provider_user))
 
     @staticmethod
     def _build_fence_service_account_key(provider_user):
@@ -157,8 +341,51 @@ class FenceTokenStorage:
     def _get_fence_service_account_in_new_txn(fsa_key):
         return fsa_key.get()
 
+
+class DatastoreLockProvider(LockProvider):
+    """
+    A LockProvider that stores the lock in the update_lock_timeout and update_lock_token of the ProviderUser's
+    FenceServiceAccount entity, taken and released in Datastore transactions.
+    """
+
+    def acquire(self, provider_user, lease_seconds):
+        """
+        This thing can return None for 2 different reasons!  And those None responses might mean two very different
+        things.  Either we were unable to successfully lock the FenceServiceAccount record because it is already locked,
+        OR something else happened.  In the latter case, the transaction may have been successful, but the call to grab
+        the lock still threw an Exception for some reason.
+        """
+        token = str(uuid.uuid4())
+        try:
+            if self._lock_fence_service_account(FenceTokenStorage._build_fence_service_account_key(provider_user),
+                                                lease_seconds, token):
+                return token
+            return None
+        # We expect a transaction failure or timeout when someone else acquires the lock instead of us. That's fine,
+        # it's just a different way we could fail to acquire the lock. Unfortunately, docs indicate it is possible to
+        # receive an exception even when a transaction completes. In that case, we'll have acquired the lock but
+        # will not update it and the lock will eventually time out.
+        # https://cloud.google.com/appengine/docs/standard/python/datastore/transactions#using_transactions
+        except:
+            logger.info("An exception was thrown while trying to lock the FenceServiceAccount entry", exc_info=True)
+            return None
+
+    def release(self, provider_user, token):
+        return self._update_lock(FenceTokenStorage._build_fence_service_account_key(provider_user), token, None)
+
+    def extend(self, provider_user, token, lease_seconds):
+        return self._update_lock(FenceTokenStorage._build_fence_service_account_key(provider_user), token,
+                                 datetime.datetime.now() + datetime.timedelta(seconds=lease_seconds))
+
+    def is_locked(self, provider_user):
+        fence_service_account = FenceTokenStorage._get_fence_service_account_in_new_txn(
+            FenceTokenStorage._build_fence_service_account_key(provider_user))
+        return fence_service_account is not None and fence_service_account.update_lock_timeout is not None and \
+            fence_service_account.update_lock_timeout > datetime.datetime.now()
+
+    @staticmethod
     @ndb.transactional(retries=0)
-    def _lock_fence_service_account(self, fsa_key):
+    def _lock_fence_service_account(fsa_key, lease_seconds, token):
         """
         within a transaction set the update_lock_timeout. There are 3 cases to consider:
         1) the key does not exist => create it and set update_lock_timeout
@@ -169,15 +396,35 @@ class FenceTokenStorage:
         :param fsa_key:
         :return True if lock was successful, false otherwise.
         """
-        update_lock_timeout = datetime.datetime.now() + datetime.timedelta(seconds=30)
+        update_lock_timeout = datetime.datetime.now() + datetime.timedelta(seconds=lease_seconds)
         fence_service_account = fsa_key.get()
         if fence_service_account is None:
-            fence_service_account = FenceServiceAccount(key=fsa_key, update_lock_timeout=update_lock_timeout)
+            fence_service_account = FenceServiceAccount(key=fsa_key, update_lock_timeout=update_lock_timeout,
+                                                        update_lock_token=token)
         elif fence_service_account.update_lock_timeout and fence_service_account.update_lock_timeout > datetime.datetime.now():
             logger.debug("Could not obtain lock on {} because it is already locked".format(fence_service_account))
             return False
         else:
             fence_service_account.update_lock_timeout = update_lock_timeout
+            fence_service_account.update_lock_token = token
         fence_service_account.put()
         logger.debug("Successfully locked FenceServiceAccount Record: {}".format(fence_service_account))
         return True
+
+    @staticmethod
+    @ndb.transactional(retries=0)
+    def _update_lock(fsa_key, token, update_lock_timeout):
+        """
+        within a transaction, set the update_lock_timeout if the lock is still held with token, or clear the lock if
+        update_lock_timeout is None.
+        :return True if the lock was held with token, false otherwise.
+        """
+        fence_service_account = fsa_key.get()
+        if fence_service_account is None or fence_service_account.update_lock_token != token or \
+                not fence_service_account.update_lock_timeout or \
+                fence_service_account.update_lock_timeout < datetime.datetime.now():
+            return False
+        fence_service_account.update_lock_timeout = update_lock_timeout
+        fence_service_account.update_lock_token = token if update_lock_timeout else None
+        fence_service_account.put()
+        return True
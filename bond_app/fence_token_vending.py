@@ -1,28 +1,58 @@
+import datetime
+import hashlib
 import json
+import threading
 
+import cachetools
 from werkzeug import exceptions
+from . import cache_codec
 from .bond import FenceKeys
-from .fence_token_storage import ProviderUser
+from .fence_token_storage import ProviderUser, ServiceAccountUpdateInProgressException
+from .http_client import HttpClient
+from google.auth import jwt
 from google.oauth2 import service_account
 import google.auth.transport.requests
 import logging
+from dataclasses import dataclass
 
 logger = logging.getLogger(__name__)
 
+# How many seconds before a service account access token expires to stop handing it out of the cache.
+_SERVICE_ACCOUNT_TOKEN_REFRESH_THRESHOLD = 300
+# Seconds a caller that asked not to wait is told to wait before retrying while a key is being fetched.
+_SERVICE_ACCOUNT_KEY_RETRY_AFTER = 5
+
 
 class FenceTokenVendingMachine:
     def __init__(self, fence_api, cache_api, refresh_token_store, fence_oauth_adapter, provider_name,
-                 fence_token_storage):
+                 fence_token_storage, http_client=None, credentials_cache_size=256):
+        """
+        :param credentials_cache_size: The most parsed service account credentials to keep in memory, so that a key
+        is not parsed again for every new access token.
+        """
         self.fence_api = fence_api
         self.cache_api = cache_api
         self.refresh_token_store = refresh_token_store
         self.fence_oauth_adapter = fence_oauth_adapter
         self.provider_name = provider_name
         self.fence_token_storage = fence_token_storage
+        # Used to call Google's token endpoint.
+        self.http_client = http_client or HttpClient()
+        # LRU cache from the sha256 of a service account key json to unscoped credentials parsed from it.
+        self._credentials_cache = cachetools.LRUCache(maxsize=credentials_cache_size)
+        self._credentials_cache_lock = threading.Lock()
 
-    def remove_service_account(self, user_id):
+    def remove_service_account(self, user_id, delete_cached_tokens=True):
+        """
+        Delete the user's service account key, with fence and in storage.
+        :param user_id: Id stored in Sam for the user.
+        :param delete_cached_tokens: Whether to also delete the user's cached service account access tokens. Callers
+        that pass False must delete the entries of cached_token_keys themselves, e.g. together with their own.
+        """
         provider_user = ProviderUser(provider_name=self.provider_name, user_id=user_id)
         key_json = self.fence_token_storage.delete(provider_user)
+        if delete_cached_tokens:
+            self.cache_api.delete_multi(self.cached_token_keys(user_id))
         if key_json:
             try:
                 access_token = self._get_oauth_access_token(provider_user)
@@ -33,37 +63,118 @@ class FenceTokenVendingMachine:
                     "Error removing service account for {}. Key will not be deleted with provider {}:\n{}"
                     .format(user_id, self.provider_name, e))
 
-    def get_service_account_access_token(self, sam_user_id, scopes=None):
+    def cached_token_keys(self, user_id):
+        """:return: The (key, namespace) of each of cache_api's entries holding the user's access tokens."""
+        return [(user_id, self._service_account_access_tokens_namespace())]
+
+    def get_service_account_access_token(self, sam_user_id, scopes=None, audience=None, wait=True):
         """
-        Get a service account access token to access objects protected by fence
+        Get a service account access token to access objects protected by fence. Tokens are cached per user and set of
+        scopes, or audience, until shortly before they expire.
+
+        If an audience is given, a JWT for that audience is signed with the service account key in process instead of
+        exchanging the key for an access token with Google, for APIs that accept self-signed JWTs. If signing fails, an
+        access token for the scopes is returned instead.
 
         :param sam_user_id: Id stored in Sam for user who initiated request
-        :param scopes: scopes to request token, defaults to ["email", "profile"]
+        :param scopes: scopes to request token, defaults to ["email", "profile"]. Unused for a self-signed JWT.
+        :param audience: optional audience, e.g. "https://storage.googleapis.com/", to sign a JWT for
+        :param wait: If False, raise ServiceUnavailable instead of waiting when another request is fetching the key.
         :return: access token for service account
         """
+        key_json = None
+        if audience:
+            token_key = "audience=" + audience
+            cached_token = self._get_cached_service_account_access_token(sam_user_id, token_key)
+            if cached_token is not None:
+                return cached_token
+            key_json = self.get_service_account_key_json(sam_user_id, wait)
+            try:
+                credentials = jwt.Credentials.from_signing_credentials(self._get_credentials(key_json), audience)
+                credentials.refresh(None)
+                self._cache_service_account_access_token(sam_user_id, token_key, credentials)
+                return credentials.token
+            except Exception as e:
+                logger.warning("Error signing service account JWT, falling back to an access token:\n{}".format(str(e)))
+
         if scopes is None or len(scopes) == 0:
             scopes = ["email", "profile"]
-        key_json = self.get_service_account_key_json(sam_user_id)
-        credentials = service_account.Credentials.from_service_account_info(json.loads(key_json), scopes=scopes)
+        scopes_key = " ".join(sorted(set(scopes)))
+        cached_token = self._get_cached_service_account_access_token(sam_user_id, scopes_key)
+        if cached_token is not None:
+            return cached_token
+
+        key_json = key_json or self.get_service_account_key_json(sam_user_id, wait)
+        credentials = self._get_credentials(key_json).with_scopes(scopes)
         try:
-            credentials.refresh(google.auth.transport.requests.Request())
+            credentials.refresh(google.auth.transport.requests.Request(session=self.http_client.session))
         except Exception as e:
             logger.warning("Error refreshing service account credentials:\n%s".format(str(e)))
             raise exceptions.InternalServerError(
                 description="Unable to refresh service account credentials. Consider relinking your account.\n%s".format(str(e)),
                 original_exception=e)
+        self._cache_service_account_access_token(sam_user_id, scopes_key, credentials)
         return credentials.token
 
-    def get_service_account_key_json(self, sam_user_id):
+    def _get_credentials(self, key_json):
+        """Get unscoped credentials for a service account key json, parsing the key only if it is not in memory."""
+        key_json_hash = hashlib.sha256(str.encode(key_json)).hexdigest()
+        with self._credentials_cache_lock:
+            credentials = self._credentials_cache.get(key_json_hash)
+        if credentials is None:
+            credentials = service_account.Credentials.from_service_account_info(json.loads(key_json))
+            with self._credentials_cache_lock:
+                self._credentials_cache[key_json_hash] = credentials
+        return credentials
+
+    def _get_cached_service_account_access_token(self, sam_user_id, token_key):
+        """:return: The user's cached token for token_key if it is not about to expire, else None."""
+        cached_tokens = self.cache_api.get(key=sam_user_id, namespace=self._service_account_access_tokens_namespace())
+        cached_token = (cached_tokens or {}).get(token_key)
+        if cached_token is not None and cached_token.expires_at > datetime.datetime.utcnow() + \
+                datetime.timedelta(seconds=_SERVICE_ACCOUNT_TOKEN_REFRESH_THRESHOLD):
+            return cached_token.value
+        return None
+
+    def _cache_service_account_access_token(self, sam_user_id, token_key, credentials):
+        """
+        Add a refreshed service account access token to the user's cached tokens, which are stored in one cache entry
+        so that they can all be removed with the service account.
+        """
+        if credentials.expiry is None:
+            return
+        namespace = self._service_account_access_tokens_namespace()
+        now = datetime.datetime.utcnow()
+        cached_tokens = {cached_token_key: token for cached_token_key, token
+                         in (self.cache_api.get(key=sam_user_id, namespace=namespace) or {}).items()
+                         if token.expires_at > now}
+        cached_tokens[token_key] = ServiceAccountAccessToken(value=credentials.token, expires_at=credentials.expiry)
+        expires_in = max((token.expires_at - now).total_seconds() for token in cached_tokens.values()) - \
+            _SERVICE_ACCOUNT_TOKEN_REFRESH_THRESHOLD
+        if expires_in > 0:
+            self.cache_api.add(key=sam_user_id, value=cached_tokens, expires_in=expires_in, namespace=namespace)
+
+    def _service_account_access_tokens_namespace(self):
+        return f"{self.provider_name}:ServiceAccountAccessTokens"
+
+    def get_service_account_key_json(self, sam_user_id, wait=True):
         """
         Get a service account key json to access objects protected by fence, using the cache as possible.
         :param sam_user_id: Id stored in Sam for user who initiated request
+        :param wait: If False, raise ServiceUnavailable with a Retry-After instead of waiting when another request is
+        fetching the key.
         :return: fence service account key_json
         """
         provider_user = ProviderUser(provider_name=self.provider_name, user_id=sam_user_id)
-        (key_json, expiration_datetime) = self.fence_token_storage.retrieve(
-            provider_user, prep_key_fn=self._get_oauth_access_token,
-            fence_fetch_fn=self.fence_api.get_credentials_google)
+        try:
+            (key_json, expiration_datetime) = self.fence_token_storage.retrieve(
+                provider_user, prep_key_fn=self._get_oauth_access_token,
+                fence_fetch_fn=self.fence_api.get_credentials_google, wait=wait)
+        except ServiceAccountUpdateInProgressException as e:
+            logger.info("Not waiting for service account key: {}".format(e))
+            raise exceptions.ServiceUnavailable(
+                description="The service account key is being fetched by another request. Try again later.",
+                retry_after=_SERVICE_ACCOUNT_KEY_RETRY_AFTER)
         return key_json
 
     def _get_oauth_access_token(self, provider_user):
@@ -73,3 +184,14 @@ class FenceTokenVendingMachine:
         logger.info("Using Refresh Token to generate Access Token for User: {}".format(provider_user))
         access_token = self.fence_oauth_adapter.refresh_access_token(refresh_token.token).get(FenceKeys.ACCESS_TOKEN)
         return access_token
+
+
+@cache_codec.register("ServiceAccountAccessToken")
+@dataclass
+class ServiceAccountAccessToken:
+    """
+    Simple data class for representing a cached service account access token.
+    """
+    value: str
+    # Naive UTC datetime when the token expires, as set on google.auth credentials.
+    expires_at: datetime.datetime
@@ -0,0 +1,118 @@
+import random
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class HttpClientConfig:
+    def __init__(self, pool_size=10, connect_timeout=5.0, read_timeout=30.0, max_retries=2, backoff_factor=0.2):
+        """
+        :param pool_size: The number of keep-alive connections to hold open to each host.
+        :param connect_timeout: Seconds to wait to establish a connection.
+        :param read_timeout: Seconds to wait between bytes of a response.
+        :param max_retries: The most times to retry one request after a connection error, or after a read error or a
+        502, 503 or 504 response to an idempotent request. Non-idempotent requests (e.g. POST) are only retried when the
+        connection could not be established, since the server never saw them.
+        :param backoff_factor: Scale of the exponential backoff between retries, in seconds. Each sleep is drawn at
+        random between 0 and backoff_factor * 2 ** (retry number - 1).
+        """
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+    @staticmethod
+    def from_config(config, section_name):
+        """
+        Reads the optional HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES and
+        HTTP_BACKOFF_FACTOR options from a config.ini section, using the defaults for any that are missing.
+        """
+        defaults = HttpClientConfig()
+        return HttpClientConfig(
+            pool_size=config.getint(section_name, 'HTTP_POOL_SIZE', fallback=defaults.pool_size),
+            connect_timeout=config.getfloat(section_name, 'HTTP_CONNECT_TIMEOUT', fallback=defaults.connect_timeout),
+            read_timeout=config.getfloat(section_name, 'HTTP_READ_TIMEOUT', fallback=defaults.read_timeout),
+            max_retries=config.getint(section_name, 'HTTP_MAX_RETRIES', fallback=defaults.max_retries),
+            backoff_factor=config.getfloat(section_name, 'HTTP_BACKOFF_FACTOR', fallback=defaults.backoff_factor))
+
+
+class _JitteredRetry(Retry):
+    """A urllib3 Retry that sleeps a random fraction of the exponential backoff, so that retries do not synchronize."""
+
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+
+class _RejectAllCookiePolicy(DefaultCookiePolicy):
+    """A cookie policy that stores no cookies, since one session makes the upstream calls of every user."""
+
+    def set_ok(self, cookie, request):
+        return False
+
+
+class _TimeoutHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter that applies a default timeout to requests that do not set one."""
+
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=timeout if timeout is not None else self.timeout, **kwargs)
+
+
+class HttpClient:
+    """
+    Makes HTTP calls to upstream services over pooled keep-alive connections, with timeouts and a bounded number of
+    retries. Share one HttpClient between everything that calls the same upstream so that calls reuse connections
+    instead of each paying for a new TCP and TLS handshake.
+    """
+
+    def __init__(self, config=None):
+        """
+        :param config: An HttpClientConfig. Defaults are used if None.
+        """
+        self.config = config or HttpClientConfig()
+        retry = _JitteredRetry(total=self.config.max_retries,
+                               connect=self.config.max_retries,
+                               read=self.config.max_retries,
+                               status=self.config.max_retries,
+                               status_forcelist=(502, 503, 504),
+                               backoff_factor=self.config.backoff_factor,
+                               respect_retry_after_header=False,
+                               raise_on_status=False)
+        self.adapter = _TimeoutHTTPAdapter(timeout=(self.config.connect_timeout, self.config.read_timeout),
+                                           pool_connections=self.config.pool_size,
+                                           pool_maxsize=self.config.pool_size,
+                                           max_retries=retry)
+        self.session = requests.Session()
+        # Otherwise cookies set by an upstream, e.g. for load balancer affinity, would be sent with other users' calls.
+        self.session.cookies.set_policy(_RejectAllCookiePolicy())
+        self.mount(self.session)
+
+    def mount(self, session):
+        """
+        Make a requests.Session, e.g. an OAuth2Session, send its requests through this client's connection pools.
+        Do not close a session after mounting; closing it would close the shared pools.
+        """
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+
+    def preconnect(self, url):
+        """
+        Open a keep-alive connection to the host of the url, so that the next call to it skips the TCP and TLS
+        handshakes. Sends a HEAD request to the url and ignores the response status.
+        """
+        self.session.head(url, allow_redirects=False)
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.session.delete(url, **kwargs)
@@ -27,6 +27,10 @@ class JsonExceptionHandler(object):
         if isinstance(error, exceptions.HTTPException):
             response = jsonify(error=self.json_dict(error.code, error.description))
             response.status_code = error.code
+            # Keep headers the error carries, e.g. Retry-After, but not its HTML Content-Type.
+            for name, value in error.get_headers():
+                if name.lower() != 'content-type':
+                    response.headers[name] = value
         else:
             response = jsonify(error=str(error))
             response.status_code = 500
@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .cache_api import CacheApi
+
+
+class LocalCacheApi(CacheApi):
+    """
+    A bounded, in-process CacheApi.
+
+    Entries live in the memory of a single worker, so this is only suitable as a short lived tier in front of a shared
+    cache (see TieredCacheApi). Every entry expires after at most `max_expires_in` seconds, even if it was added with
+    no expiration, so that deletes made by other workers are observed within that bound. When the cache is full, the
+    least recently used entry is evicted.
+    """
+
+    def __init__(self, max_size=1024, max_expires_in=60):
+        """
+        :param max_size: The maximum number of entries to hold before evicting the least recently used.
+        :param max_expires_in: The maximum number of seconds to keep any entry.
+        """
+        if max_size <= 0:
+            raise ValueError("max_size must be positive, was {}".format(max_size))
+        if max_expires_in <= 0:
+            raise ValueError("max_expires_in must be positive, was {}".format(max_expires_in))
+        self.max_size = max_size
+        self.max_expires_in = max_expires_in
+        # Ordered dict from (namespace, key) to (value, expiration time in seconds since the epoch), least recently
+        # used first.
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key, value, expires_in=0, namespace=None):
+        if expires_in == 0 or expires_in > self.max_expires_in:
+            expires_in = self.max_expires_in
+        cache_key = (namespace, key)
+        with self._lock:
+            self._entries[cache_key] = (value, time.time() + expires_in)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return True
+
+    def get(self, key, namespace=None):
+        cache_key = (namespace, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            value, expiration_time = entry
+            if time.time() >= expiration_time:
+                del self._entries[cache_key]
+                return None
+            self._entries.move_to_end(cache_key)
+            return value
+
+    def delete(self, key, namespace=None):
+        with self._lock:
+            self._entries.pop((namespace, key), None)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,89 @@
+import uuid
+from urllib.parse import quote
+
+# Deletes the lock only if it is still held with the caller's token.
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Resets the lock's lease to ARGV[2] milliseconds only if it is still held with the caller's token.
+_EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class LockProvider:
+    """
+    Leased locks on a ProviderUser, shared between every process of Bond, used by FenceTokenStorage so that only one
+    process at a time fetches a user's key from a fence.
+    """
+
+    def acquire(self, provider_user, lease_seconds):
+        """
+        Try to take the lock for provider_user without waiting.
+        :param provider_user: The ProviderUser to lock.
+        :param lease_seconds: The number of seconds until the lock is released on its own.
+        :return: A lock token to pass to release and extend if the lock was taken, else None.
+        """
+        raise NotImplementedError
+
+    def release(self, provider_user, token):
+        """
+        Release the lock for provider_user if token still holds it.
+        :return: True if the lock was released, False if token no longer held it.
+        """
+        raise NotImplementedError
+
+    def extend(self, provider_user, token, lease_seconds):
+        """
+        Reset the lease on the lock for provider_user to lease_seconds from now if token still holds it.
+        :return: True if the lease was extended, False if token no longer held the lock.
+        """
+        raise NotImplementedError
+
+    def is_locked(self, provider_user):
+        """:return: True if anyone holds the lock for provider_user."""
+        raise NotImplementedError
+
+
+class RedisLockProvider(LockProvider):
+    """
+    A LockProvider using Redis SET NX PX, with release and extend checked against the lock token in Lua scripts so
+    that a process can never release or extend a lock that expired and was taken by another process.
+    """
+
+    def __init__(self, redis_client, prefix="bond:fence_key_lock"):
+        """
+        :param redis_client: A redis.Redis client.
+        :param prefix: Prefix for the Redis keys of locks.
+        """
+        self.redis_client = redis_client
+        self.prefix = prefix
+        self._release_script = redis_client.register_script(_RELEASE_SCRIPT)
+        self._extend_script = redis_client.register_script(_EXTEND_SCRIPT)
+
+    def acquire(self, provider_user, lease_seconds):
+        token = str(uuid.uuid4())
+        if self.redis_client.set(self._lock_key(provider_user), token, nx=True, px=int(lease_seconds * 1000)):
+            return token
+        return None
+
+    def release(self, provider_user, token):
+        return self._release_script(keys=[self._lock_key(provider_user)], args=[token]) == 1
+
+    def extend(self, provider_user, token, lease_seconds):
+        return self._extend_script(keys=[self._lock_key(provider_user)],
+                                   args=[token, int(lease_seconds * 1000)]) == 1
+
+    def is_locked(self, provider_user):
+        return self.redis_client.exists(self._lock_key(provider_user)) == 1
+
+    def _lock_key(self, provider_user):
+        return "{}:{}:{}".format(self.prefix, quote(provider_user.provider_name, safe=''),
+                                 quote(provider_user.user_id, safe=''))
@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import math
+import time
+from urllib.parse import quote
+
+from pymemcache.client.hash import HashClient
+
+from .cache_api import CacheApi, split_cache_key
+from .cache_codec import CacheCodecError, JsonCacheCodec
+
+# memcached reads expirations longer than 30 days as a unix timestamp rather than a number of seconds.
+_MAX_RELATIVE_EXPIRATION = 60 * 60 * 24 * 30
+
+
+class MemcacheCacheApi(CacheApi):
+    """
+    A CacheApi backed by memcached.
+
+    Namespaces are folded into the key, which is hashed so that any key fits memcached's 250 byte key limit and
+    character restrictions. Values are encoded with a CacheCodec, JsonCacheCodec by default, never pickled, so that
+    whoever can write to memcached cannot run code in Bond. Values that cannot be decoded are read as misses. The
+    client should store bytes as they are, as clients from create_client do.
+    """
+
+    def __init__(self, client, prefix="bond", codec=None):
+        """
+        :param client: A pymemcache client, e.g. from MemcacheCacheApi.create_client.
+        :param prefix: Prefix for the memcached keys of cache entries.
+        :param codec: The CacheCodec to encode values with.
+        """
+        self.client = client
+        self.prefix = prefix
+        self.codec = codec or JsonCacheCodec()
+
+    @staticmethod
+    def create_client(servers, max_pool_size=None, connect_timeout=None, timeout=None):
+        """
+        Create a HashClient that spreads keys across memcached servers, with a pool of connections to each. The client
+        stores and returns bytes, without a serde, so it can never unpickle what it reads.
+        :param servers: A list of (host, port) tuples.
+        :param max_pool_size: The most connections to keep open to each server.
+        :param connect_timeout: Seconds to wait to connect to a server.
+        :param timeout: Seconds to wait for a reply from a server.
+        """
+        return HashClient(servers, use_pooling=True, max_pool_size=max_pool_size, connect_timeout=connect_timeout,
+                          timeout=timeout)
+
+    def add(self, key, value, expires_in=0, namespace=None):
+        cache_key = self._build_cache_key(key, namespace)
+        if expires_in < 0:
+            # Already expired, as DatastoreCacheApi would treat it.
+            self.client.delete(cache_key, noreply=False)
+            return True
+        try:
+            encoded_value = self.codec.encode(value)
+        except CacheCodecError:
+            logging.warning("Not caching value the codec cannot encode", exc_info=True)
+            return False
+        return bool(self.client.set(cache_key, encoded_value, expire=self._expire(expires_in), noreply=False))
+
+    def get(self, key, namespace=None):
+        cache_key = self._build_cache_key(key, namespace)
+        return self._decode(cache_key, self.client.get(cache_key))
+
+    def delete(self, key, namespace=None):
+        self.client.delete(self._build_cache_key(key, namespace), noreply=False)
+
+    def get_multi(self, keys, namespace=None):
+        cache_keys = {self._build_cache_key(*split_cache_key(cache_key, namespace)): cache_key for cache_key in keys}
+        if not cache_keys:
+            return {}
+        values = {cache_keys[memcache_key]: self._decode(memcache_key, value)
+                  for memcache_key, value in self.client.get_many(list(cache_keys)).items()}
+        return {cache_key: value for cache_key, value in values.items() if value is not None}
+
+    def add_multi(self, mapping, expires_in=0, namespace=None):
+        values = {self._build_cache_key(*split_cache_key(cache_key, namespace)): value
+                  for cache_key, value in mapping.items()}
+        if not values:
+            return True
+        if expires_in < 0:
+            self.client.delete_many(list(values), noreply=False)
+            return True
+        encoded_values = {}
+        for memcache_key, value in values.items():
+            try:
+                encoded_values[memcache_key] = self.codec.encode(value)
+            except CacheCodecError:
+                logging.warning("Not caching value the codec cannot encode", exc_info=True)
+        if not encoded_values:
+            return False
+        # set_many returns the keys that failed to be set.
+        failed = self.client.set_many(encoded_values, expire=self._expire(expires_in), noreply=False)
+        return not failed and len(encoded_values) == len(values)
+
+    def delete_multi(self, keys, namespace=None):
+        cache_keys = [self._build_cache_key(*split_cache_key(cache_key, namespace)) for cache_key in keys]
+        if cache_keys:
+            self.client.delete_many(cache_keys, noreply=False)
+
+    def _decode(self, memcache_key, value):
+        """Return the decoded value, or None if there is no value or it cannot be decoded."""
+        if value is None:
+            return None
+        try:
+            return self.codec.decode(value)
+        except CacheCodecError:
+            # Treat it as a miss so that it is replaced, e.g. an entry pickled by an older version of Bond.
+            logging.warning("Could not decode cache entry {}".format(memcache_key), exc_info=True)
+            return None
+
+    def _build_cache_key(self, key, namespace):
+        """Create the memcached key for the key and namespace: the prefix and a sha256 of both."""
+        if namespace is not None:
+            unhashed_key = "n:{}:{}".format(quote(namespace, safe=''), quote(key, safe=''))
+        else:
+            unhashed_key = "k:{}".format(quote(key, safe=''))
+        return "{}:{}".format(self.prefix, hashlib.sha256(unhashed_key.encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def _expire(expires_in):
+        """Convert expires_in seconds to memcached's whole seconds, or a unix timestamp beyond 30 days."""
+        if expires_in == 0:
+            return 0
+        expire = max(1, math.ceil(expires_in))
+        if expire > _MAX_RELATIVE_EXPIRATION:
+            return int(time.time()) + expire
+        return expire
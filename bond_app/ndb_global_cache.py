@@ -0,0 +1,46 @@
+# Seconds that entities of each model stay in the ndb global cache by default. Models that are not listed are not
+# cached. CacheEntry is left out because it is already a cache. RefreshToken and FenceServiceAccount are left out
+# because ndb stores entities in the global cache unencrypted, which would put refresh tokens and service account keys
+# in Redis or memcached. Operators can opt in with [cache] NDB_GLOBAL_CACHE_TIMEOUTS.
+DEFAULT_TIMEOUTS = {"OAuth2State": 600}
+
+
+class ModelCachePolicy:
+    """
+    An ndb global cache policy and timeout policy that cache the entities of chosen models, each for its own number of
+    seconds.
+
+    ndb keeps the global cache consistent with Datastore by invalidating entries on every write made through a context
+    that uses the same global cache, and by reading around the cache in transactions. So every process that writes a
+    cached model must use the cache too.
+    """
+
+    def __init__(self, timeouts_by_kind=None):
+        """
+        :param timeouts_by_kind: Dict from the kind of a model to the seconds to cache its entities for.
+        DEFAULT_TIMEOUTS if None.
+        """
+        self.timeouts_by_kind = DEFAULT_TIMEOUTS if timeouts_by_kind is None else timeouts_by_kind
+
+    @classmethod
+    def parse(cls, timeouts):
+        """
+        Create a ModelCachePolicy from a string like "RefreshToken:3600,OAuth2State:600", or the default one if None.
+        """
+        if timeouts is None:
+            return cls()
+        timeouts_by_kind = {}
+        for timeout in timeouts.split(','):
+            if not timeout.strip():
+                continue
+            kind, _, seconds = timeout.partition(':')
+            timeouts_by_kind[kind.strip()] = int(seconds)
+        return cls(timeouts_by_kind)
+
+    def cache(self, key):
+        """:return: True if the entity for the ndb Key should be kept in the global cache."""
+        return key.kind() in self.timeouts_by_kind
+
+    def timeout(self, key):
+        """:return: The seconds to keep the entity for the ndb Key in the global cache."""
+        return self.timeouts_by_kind.get(key.kind(), 0)
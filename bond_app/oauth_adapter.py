@@ -2,19 +2,21 @@ import base64
 from werkzeug import exceptions
 import logging
 
-import requests
 from requests.auth import HTTPBasicAuth
 from requests_oauthlib import OAuth2Session
 
+from .http_client import HttpClient
+
 
 class OauthAdapter:
 
-    def __init__(self, client_id, client_secret, open_id_config, provider_name):
+    def __init__(self, client_id, client_secret, open_id_config, provider_name, http_client=None):
         self.client_id = client_id
         self.client_secret = client_secret
         self.open_id_config = open_id_config
         self.basic_auth = HTTPBasicAuth(self.client_id, self.client_secret)
         self.provider_name = provider_name
+        self.http_client = http_client or HttpClient()
 
     def build_authz_url(self, scopes, redirect_uri, state=None, extra_authz_url_params=None):
         """
@@ -44,9 +46,9 @@ class OauthAdapter:
         :return: A token dict including the access token, refresh token, and token type (amongst other details)
         """
         oauth = OAuth2Session(self.client_id, redirect_uri=redirect_uri)
-        token_dict = oauth.fetch_token(self.open_id_config.get_token_info_url(), code=authz_code, auth=self.basic_auth)
-        oauth.close()
-        return token_dict
+        # The session is not closed, since that would close the shared connection pool.
+        self.http_client.mount(oauth)
+        return oauth.fetch_token(self.open_id_config.get_token_info_url(), code=authz_code, auth=self.basic_auth)
 
     def refresh_access_token(self, refresh_token_str):
         """
@@ -56,9 +58,9 @@ class OauthAdapter:
         """
         token_dict = {'refresh_token': refresh_token_str}
         oauth = OAuth2Session(self.client_id, token=token_dict)
-        token = oauth.refresh_token(self.open_id_config.get_token_info_url(), auth=self.basic_auth)
-        oauth.close()
-        return token
+        # The session is not closed, since that would close the shared connection pool.
+        self.http_client.mount(oauth)
+        return oauth.refresh_token(self.open_id_config.get_token_info_url(), auth=self.basic_auth)
 
     def revoke_refresh_token(self, refresh_token):
         """
@@ -67,10 +69,10 @@ class OauthAdapter:
         :return:
         """
         revoke_url = self.open_id_config.get_revoke_url()
-        result = requests.post(url=revoke_url,
-                               data={"token": refresh_token},
-                               headers={"Authorization": "Basic %s" % base64.b64encode(
-                                   "{}:{}".format(self.client_id, self.client_secret).encode()).decode()})
+        result = self.http_client.post(url=revoke_url,
+                                       data={"token": refresh_token},
+                                       headers={"Authorization": "Basic %s" % base64.b64encode(
+                                           "{}:{}".format(self.client_id, self.client_secret).encode()).decode()})
         logging.info("request: POST {} - status code: {}".format(revoke_url, result.status_code))
         if result.status_code // 100 != 2:
             # If the refresh token has already expired, the auth provider will return a 400 when we try to revoke it.
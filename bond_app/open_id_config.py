@@ -1,21 +1,96 @@
 import json
+import logging
+import threading
+import time
 
 from werkzeug import exceptions
-import requests
 from requests_toolbelt.adapters import appengine
 
+from .http_client import HttpClient
+
+
+logger = logging.getLogger(__name__)
+
 
 class OpenIdConfig:
+    """
+    A provider's OpenID configuration document.
 
-    def __init__(self, provider_name, open_id_config_url, cache_api):
+    The document is held in process memory for `memo_ttl` seconds, so reading it costs no I/O. After that it is
+    reloaded from the shared cache, or the provider if the cache has expired: in the background if an executor is given,
+    serving the old document meanwhile, otherwise on the next read. If reloading fails, the last document loaded keeps
+    being served and reloading is retried after `retry_interval` seconds.
+    """
+
+    def __init__(self, provider_name, open_id_config_url, cache_api, http_client=None, executor=None, memo_ttl=300,
+                 retry_interval=30):
+        """
+        :param provider_name: The name of the provider.
+        :param open_id_config_url: The URL of the provider's OpenID configuration document.
+        :param cache_api: The CacheApi shared across processes to cache the document in.
+        :param http_client: The HttpClient to fetch the document with.
+        :param executor: An optional BackgroundExecutor to reload the document on.
+        :param memo_ttl: Seconds to serve the document from process memory before reloading it. 0 disables the memo.
+        :param retry_interval: Seconds to wait before reloading again after reloading fails.
+        """
         self.provider_name = provider_name
         self.open_id_config_url = open_id_config_url
         self.cache_api = cache_api
+        self.http_client = http_client or HttpClient()
+        self.executor = executor
+        self.memo_ttl = memo_ttl
+        self.retry_interval = retry_interval
+        self._memo = None
+        # When to reload the memo, as a time.monotonic() value.
+        self._reload_at = 0
+        self._reloading = False
+        self._lock = threading.Lock()
 
     def load_dict(self):
+        """:return: The provider's OpenID configuration as a dict."""
+        with self._lock:
+            memo = self._memo
+            if memo is None or self.memo_ttl <= 0:
+                reload_now = True
+            elif time.monotonic() < self._reload_at or self._reloading:
+                return memo
+            else:
+                reload_now = self.executor is None
+                self._reloading = True
+        if reload_now:
+            return self._reload(memo)
+        if not self.executor.submit(self._reload, memo):
+            with self._lock:
+                self._reloading = False
+        return memo
+
+    def _reload(self, memo):
+        """
+        Load the document and memoize it.
+        :param memo: The memoized document, served if loading fails, or None to raise instead.
+        """
+        try:
+            open_id_dict = self._load_shared_dict()
+        except Exception:
+            if memo is None:
+                raise
+            logger.warning("Error reloading the OpenID configuration of {}, serving the last one loaded".format(
+                self.provider_name), exc_info=True)
+            with self._lock:
+                self._reload_at = time.monotonic() + self.retry_interval
+                self._reloading = False
+            return memo
+        with self._lock:
+            self._memo = open_id_dict
+            self._reload_at = time.monotonic() + self.memo_ttl
+            self._reloading = False
+        return open_id_dict
+
+    def _load_shared_dict(self):
+        """Load the document from the shared cache, or from the provider if it is not cached."""
         open_id_dict = self.cache_api.get(namespace="OauthAdapter", key=self.provider_name)
         if not open_id_dict:
-            open_id_config_response = requests.get(self.open_id_config_url)
+            open_id_config_response = self.http_client.get(self.open_id_config_url)
             if open_id_config_response.status_code != 200:
                 raise exceptions.InternalServerError(
                     'open_id_config_url [{}] returned status {}: {}'.format(self.open_id_config_url,
@@ -38,7 +113,7 @@ class OpenIdConfig:
         """
         config = self.load_dict()
         if key in config:
-            return self.load_dict()[key]
+            return config[key]
         elif raise_error:
             raise exceptions.InternalServerError(key + " not found in openid config: " + self.open_id_config_url)
 
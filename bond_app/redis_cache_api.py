@@ -0,0 +1,106 @@
+import logging
+import math
+from urllib.parse import quote
+
+from redis.exceptions import DataError
+
+from .cache_api import CacheApi, split_cache_key
+from .cache_codec import CacheCodecError, JsonCacheCodec
+
+
+class RedisCacheApi(CacheApi):
+    """
+    A CacheApi backed by Redis.
+
+    Values are encoded with a CacheCodec, JsonCacheCodec by default, never pickled, so that whoever can write to Redis
+    cannot run code in Bond. Values that cannot be decoded are read as misses. Expiration uses native Redis TTLs, so
+    expired entries are removed by Redis itself and need no cron. The redis.Redis client pools its connections.
+    """
+
+    def __init__(self, redis_client, prefix="bond:cache", codec=None):
+        """
+        :param redis_client: A redis.Redis client.
+        :param prefix: Prefix for the Redis keys of cache entries.
+        :param codec: The CacheCodec to encode values with.
+        """
+        self.redis_client = redis_client
+        self.prefix = prefix
+        self.codec = codec or JsonCacheCodec()
+
+    def add(self, key, value, expires_in=0, namespace=None):
+        cache_key = self._build_cache_key(key, namespace)
+        try:
+            if expires_in < 0:
+                # Already expired, as DatastoreCacheApi would treat it.
+                self.redis_client.delete(cache_key)
+            elif expires_in == 0:
+                self.redis_client.set(cache_key, self.codec.encode(value))
+            else:
+                self.redis_client.set(cache_key, self.codec.encode(value), px=max(1, math.ceil(expires_in * 1000)))
+            return True
+        except CacheCodecError:
+            logging.warning("Not caching value the codec cannot encode", exc_info=True)
+            return False
+        except DataError:
+            return False
+
+    def get(self, key, namespace=None):
+        cache_key = self._build_cache_key(key, namespace)
+        return self._decode(cache_key, self.redis_client.get(cache_key))
+
+    def delete(self, key, namespace=None):
+        self.redis_client.delete(self._build_cache_key(key, namespace))
+
+    def get_multi(self, keys, namespace=None):
+        keys = list(keys)
+        if not keys:
+            return {}
+        redis_keys = [self._build_cache_key(*split_cache_key(cache_key, namespace)) for cache_key in keys]
+        values = {cache_key: self._decode(redis_key, value)
+                  for cache_key, redis_key, value in zip(keys, redis_keys, self.redis_client.mget(redis_keys))}
+        return {cache_key: value for cache_key, value in values.items() if value is not None}
+
+    def add_multi(self, mapping, expires_in=0, namespace=None):
+        if not mapping:
+            return True
+        cache_keys = [self._build_cache_key(*split_cache_key(cache_key, namespace)) for cache_key in mapping]
+        try:
+            if expires_in < 0:
+                self.redis_client.delete(*cache_keys)
+                return True
+            # A non-transactional pipeline sends every SET in one round trip.
+            pipeline = self.redis_client.pipeline(transaction=False)
+            px = max(1, math.ceil(expires_in * 1000)) if expires_in > 0 else None
+            encoded_all = True
+            for cache_key, value in zip(cache_keys, mapping.values()):
+                try:
+                    pipeline.set(cache_key, self.codec.encode(value), px=px)
+                except CacheCodecError:
+                    logging.warning("Not caching value the codec cannot encode", exc_info=True)
+                    encoded_all = False
+            pipeline.execute()
+            return encoded_all
+        except DataError:
+            return False
+
+    def delete_multi(self, keys, namespace=None):
+        cache_keys = [self._build_cache_key(*split_cache_key(cache_key, namespace)) for cache_key in keys]
+        if cache_keys:
+            self.redis_client.delete(*cache_keys)
+
+    def _decode(self, redis_key, value):
+        """Return the decoded value, or None if there is no value or it cannot be decoded."""
+        if value is None:
+            return None
+        try:
+            return self.codec.decode(value)
+        except CacheCodecError:
+            # Treat it as a miss so that it is replaced, e.g. an entry pickled by an older version of Bond.
+            logging.warning("Could not decode cache entry {}".format(redis_key), exc_info=True)
+            return None
+
+    def _build_cache_key(self, key, namespace):
+        """Create the Redis key for the key and namespace. Both are quoted so that neither can contain the separator."""
+        if namespace is not None:
+            return "{}:n:{}:{}".format(self.prefix, quote(namespace, safe=''), quote(key, safe=''))
+        return "{}:k:{}".format(self.prefix, quote(key, safe=''))
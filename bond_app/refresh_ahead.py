@@ -0,0 +1,174 @@
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _TrackedAccessToken:
+    """A user's cached access token for one provider that has been requested recently."""
+    bond: object
+    sam_user_id: str
+    refresh_threshold: int
+    # When the token expires.
+    expires_at: datetime.datetime
+    # When to refresh the token, ahead of its cache entry expiring.
+    refresh_at: datetime.datetime
+    # When the token was last requested, in seconds since the epoch.
+    last_requested: float
+    # How many times in a row the refresh was deferred because another process held the refresh lease.
+    deferrals: int = 0
+
+
+class RefreshAheadScheduler:
+    """
+    Refreshes recently requested access tokens in the background shortly before their cache entries expire, so that
+    requests for hot tokens are answered from the cache instead of waiting on the provider.
+
+    Tokens are tracked per (provider, user) as they are requested. A scheduler thread checks them every
+    `poll_interval` seconds and hands the ones that are due to a BackgroundExecutor, running at most
+    `max_refreshes_per_provider` refreshes per provider at once. Tokens that are not requested for `idle_time` seconds,
+    or whose refresh fails, stop being tracked. Every worker tracks the same hot tokens, so a token that another worker
+    has already refreshed, as seen in the shared cache, is not refreshed again but rescheduled from the new expiry.
+    """
+
+    def __init__(self, executor, lead_time=60, idle_time=3600, max_tracked=10000, max_refreshes_per_provider=2,
+                 poll_interval=5):
+        """
+        :param executor: The BackgroundExecutor to refresh tokens on.
+        :param lead_time: Seconds before a token's cache entry expires to refresh it.
+        :param idle_time: Seconds after the last request for a token to stop refreshing it.
+        :param max_tracked: The most tokens to track. The least recently requested are dropped beyond this.
+        :param max_refreshes_per_provider: The most refreshes to run at once against each provider.
+        :param poll_interval: Seconds between checks for tokens that are due.
+        """
+        self.executor = executor
+        self.lead_time = lead_time
+        self.idle_time = idle_time
+        self.max_tracked = max_tracked
+        self.max_refreshes_per_provider = max_refreshes_per_provider
+        self.poll_interval = poll_interval
+        # Ordered dict from (provider name, sam user id) to _TrackedAccessToken, least recently requested first.
+        self._tracked = OrderedDict()
+        # Keys of tokens being refreshed, and the number being refreshed per provider name.
+        self._in_flight = set()
+        self._in_flight_per_provider = {}
+        self._counts = {"scheduled": 0, "refreshed": 0, "failed": 0, "dropped": 0, "deferred": 0, "evicted": 0}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def track(self, bond, sam_user_id, expires_at, refresh_threshold):
+        """
+        Record a request for a user's access token.
+        :param bond: The Bond for the token's provider.
+        :param sam_user_id: Id stored in Sam for the user.
+        :param expires_at: datetime when the access token expires.
+        :param refresh_threshold: The refresh_threshold the token was cached with.
+        """
+        self._ensure_started()
+        key = (bond.provider_name, sam_user_id)
+        refresh_at = expires_at - datetime.timedelta(seconds=refresh_threshold + self.lead_time)
+        with self._lock:
+            previous = self._tracked.pop(key, None)
+            tracked = _TrackedAccessToken(bond=bond, sam_user_id=sam_user_id, refresh_threshold=refresh_threshold,
+                                          expires_at=expires_at, refresh_at=refresh_at, last_requested=time.time())
+            if previous is not None and previous.expires_at == expires_at:
+                # Keep the backoff of a deferred refresh of the same token.
+                tracked.refresh_at = max(refresh_at, previous.refresh_at)
+                tracked.deferrals = previous.deferrals
+            self._tracked[key] = tracked
+            while len(self._tracked) > self.max_tracked:
+                self._tracked.popitem(last=False)
+                self._counts["evicted"] += 1
+
+    def run_once(self):
+        """Stop tracking idle tokens and schedule refreshes for the tokens that are due."""
+        now = datetime.datetime.now()
+        idle_before = time.time() - self.idle_time
+        with self._lock:
+            for key in [key for key, tracked in self._tracked.items() if tracked.last_requested < idle_before]:
+                del self._tracked[key]
+            due = [(key, tracked) for key, tracked in self._tracked.items()
+                   if tracked.refresh_at <= now and key not in self._in_flight]
+            for key, tracked in due:
+                provider_name = key[0]
+                if self._in_flight_per_provider.get(provider_name, 0) >= self.max_refreshes_per_provider:
+                    # Leave it for a later pass.
+                    continue
+                self._in_flight.add(key)
+                self._in_flight_per_provider[provider_name] = self._in_flight_per_provider.get(provider_name, 0) + 1
+                if self.executor.submit(self._refresh, key, tracked):
+                    self._counts["scheduled"] += 1
+                else:
+                    self._counts["dropped"] += 1
+                    self._finish(key)
+
+    def stats(self):
+        """
+        :return: dict of counts: "tracked" and "in_flight" tokens now, and "scheduled", "refreshed", "failed",
+        "dropped" (queue full), "deferred" (lease held by another process) refreshes and "evicted" tokens since this
+        scheduler was created.
+        """
+        with self._lock:
+            return {"tracked": len(self._tracked), "in_flight": len(self._in_flight), **self._counts}
+
+    def _refresh(self, key, tracked):
+        try:
+            access_token = tracked.bond.refresh_access_token(tracked.sam_user_id, tracked.refresh_threshold,
+                                                             refreshed_after=tracked.expires_at)
+        except Exception:
+            logger.warning("Error refreshing access token ahead of expiration for {}".format(key), exc_info=True)
+            with self._lock:
+                self._counts["failed"] += 1
+                self._tracked.pop(key, None)
+                self._finish(key)
+            return
+
+        with self._lock:
+            current = self._tracked.get(key)
+            if access_token is None:
+                # Another process holds the refresh lease. Check again once it has likely cached its token, backing
+                # off so that each poll does not take a round trip to the lease.
+                self._counts["deferred"] += 1
+                if current is not None:
+                    current.deferrals += 1
+                    current.refresh_at = datetime.datetime.now() + datetime.timedelta(
+                        seconds=min(self.poll_interval * 2 ** current.deferrals, self.lead_time))
+            else:
+                self._counts["refreshed"] += 1
+                if current is not None:
+                    refresh_at = access_token.expires_at - datetime.timedelta(
+                        seconds=current.refresh_threshold + self.lead_time)
+                    if refresh_at <= datetime.datetime.now():
+                        # The provider's tokens do not live long enough to be refreshed ahead of time.
+                        del self._tracked[key]
+                    else:
+                        current.expires_at = access_token.expires_at
+                        current.refresh_at = refresh_at
+                        current.deferrals = 0
+            self._finish(key)
+
+    def _finish(self, key):
+        """Mark a refresh as done. Must be called holding self._lock."""
+        self._in_flight.discard(key)
+        self._in_flight_per_provider[key[0]] -= 1
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._schedule, daemon=True).start()
+
+    def _schedule(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Error scheduling access token refreshes")
@@ -2,30 +2,47 @@ import logging
 
 from flask import Blueprint, request, redirect
 import configparser
+import datetime
 import os
 from werkzeug import exceptions
 from webargs import fields
 from webargs.flaskparser import FlaskParser
+import redis
+from google.cloud.ndb import global_cache
 
 from protorpc import message_types
 from protorpc import messages
 from protorpc import protojson
 
 from . import authentication
+from .background import BackgroundExecutor
 from .bond import Bond
+from .cache_sweeper import CacheSweeper
 from .datastore_cache_api import DatastoreCacheApi
+from .memcache_api import MemcacheCacheApi
+from .ndb_global_cache import ModelCachePolicy
+from .redis_cache_api import RedisCacheApi
+from .local_cache_api import LocalCacheApi
+from .lock_provider import RedisLockProvider
 from .fence_token_vending import FenceTokenVendingMachine
 from .fence_api import FenceApi
+from .http_client import HttpClient, HttpClientConfig
 from . import fence_token_storage
 from .open_id_config import OpenIdConfig
+from .refresh_ahead import RefreshAheadScheduler
 from .sam_api import SamApi
 from .oauth_adapter import OauthAdapter
+from .stats_reporter import StatsReporter
 from .status import Status, Subsystems
+from .single_flight import CacheLease
+from .tiered_cache_api import TieredCacheApi
 from .token_store import TokenStore
 from .oauth2_state_store import OAuth2StateStore
+from .warmup import Warmup, warm_up_open_id_config
+from .write_behind_cache_api import WriteBehindCacheApi
 import json
 import ast
-from .util import get_provider_secrets
+from .util import get_provider_secrets, is_provider_section
 
 
 class Parser(FlaskParser):
@@ -80,6 +97,12 @@ class LinkNotFoundResponse(messages.Message):
     message = messages.StringField(1)
 
 
+class CacheSweepResponse(messages.Message):
+    deleted = messages.IntegerField(1)
+    batches = messages.IntegerField(2)
+    complete = messages.BooleanField(3)
+
+
 def json_response(message):
     """Given a protorpc message, return a json response tuple understood by flask: (json, status code, headers)"""
     return protojson.encode_message(message), 200, {'Content-Type': 'application/json'}
@@ -90,7 +113,131 @@ config.read("config.ini")
 
 
 def is_provider(section_name):
-    return section_name != 'sam' and section_name != 'bond_accepted'
+    return is_provider_section(section_name)
+
+
+def create_shared_cache_api():
+    """
+    Create the CacheApi shared by every Bond process, chosen by [cache] BACKEND: "datastore" (the default) or
+    "redis", which needs a [redis] section, or "memcache", which needs a [memcache] section.
+    """
+    backend = config.get('cache', 'BACKEND', fallback='datastore')
+    if backend == 'datastore':
+        return DatastoreCacheApi(
+            read_legacy_keys=config.getboolean('cache', 'READ_LEGACY_DATASTORE_KEYS', fallback=False))
+    if backend == 'redis':
+        if redis_client is None:
+            raise ValueError("[cache] BACKEND=redis requires a [redis] section in config.ini")
+        return RedisCacheApi(redis_client)
+    if backend == 'memcache':
+        if not config.has_section('memcache'):
+            raise ValueError("[cache] BACKEND=memcache requires a [memcache] section in config.ini")
+        return MemcacheCacheApi(create_memcache_client())
+    raise ValueError("Unknown [cache] BACKEND: {}".format(backend))
+
+
+def create_cache_api(shared_cache_api):
+    """
+    Create the CacheApi used by Bond for entries that no worker deletes while others may still read them, e.g. Sam user
+    info and OpenID configurations. If [cache] LOCAL_CACHE_SIZE is set, a bounded in-process tier is placed in front of
+    shared_cache_api.
+    """
+    local_cache_size = config.getint('cache', 'LOCAL_CACHE_SIZE', fallback=0)
+    if local_cache_size <= 0:
+        return shared_cache_api
+    local_cache_expires_in = config.getint('cache', 'LOCAL_CACHE_EXPIRES_IN', fallback=60)
+    return TieredCacheApi([LocalCacheApi(local_cache_size, local_cache_expires_in), shared_cache_api],
+                          backfill_expires_in=local_cache_expires_in)
+
+
+def create_http_client(section_name):
+    """Create an HttpClient configured by the HTTP_* options of a config.ini section."""
+    return HttpClient(HttpClientConfig.from_config(config, section_name))
+
+
+def create_refresh_ahead_scheduler():
+    """
+    Create the RefreshAheadScheduler shared by all providers if BOND_REFRESH_AHEAD_LEAD_TIME is set to a positive number
+    of seconds, else None.
+    """
+    lead_time = int(os.environ.get('BOND_REFRESH_AHEAD_LEAD_TIME', 0))
+    if lead_time <= 0:
+        return None
+    return RefreshAheadScheduler(background_executor,
+                                 lead_time=lead_time,
+                                 idle_time=int(os.environ.get('BOND_REFRESH_AHEAD_IDLE_TIME', 3600)),
+                                 max_tracked=int(os.environ.get('BOND_REFRESH_AHEAD_MAX_TRACKED', 10000)),
+                                 max_refreshes_per_provider=int(
+                                     os.environ.get('BOND_REFRESH_AHEAD_MAX_REFRESHES_PER_PROVIDER', 2)))
+
+
+def create_redis_client():
+    """Create a Redis client configured by the [redis] section of config.ini, or None if there is no such section."""
+    if not config.has_section('redis'):
+        return None
+    return redis.Redis(host=config.get('redis', 'HOST'),
+                       port=config.getint('redis', 'PORT', fallback=6379),
+                       db=config.getint('redis', 'DB', fallback=0),
+                       password=config.get('redis', 'PASSWORD', fallback=None),
+                       socket_timeout=config.getfloat('redis', 'SOCKET_TIMEOUT', fallback=1.0),
+                       socket_connect_timeout=config.getfloat('redis', 'SOCKET_TIMEOUT', fallback=1.0),
+                       max_connections=config.getint('redis', 'MAX_CONNECTIONS', fallback=50))
+
+
+def create_memcache_client():
+    """Create a memcached client configured by the [memcache] section of config.ini. It stores bytes."""
+    servers = []
+    for server in config.get('memcache', 'SERVERS').split(','):
+        host, _, port = server.strip().rpartition(':')
+        servers.append((host, int(port)))
+    return MemcacheCacheApi.create_client(servers,
+                                          max_pool_size=config.getint('memcache', 'MAX_POOL_SIZE', fallback=50),
+                                          connect_timeout=config.getfloat('memcache', 'CONNECT_TIMEOUT', fallback=1.0),
+                                          timeout=config.getfloat('memcache', 'TIMEOUT', fallback=1.0))
+
+
+def create_ndb_global_cache():
+    """
+    Create the ndb global cache that Datastore reads go through, chosen by [cache] NDB_GLOBAL_CACHE: "none" (the
+    default), "redis", which needs a [redis] section, or "memcache", which needs a [memcache] section.
+    """
+    backend = config.get('cache', 'NDB_GLOBAL_CACHE', fallback='none')
+    if backend == 'none':
+        return None
+    if backend == 'redis':
+        if redis_client is None:
+            raise ValueError("[cache] NDB_GLOBAL_CACHE=redis requires a [redis] section in config.ini")
+        return global_cache.RedisCache(redis_client)
+    if backend == 'memcache':
+        if not config.has_section('memcache'):
+            raise ValueError("[cache] NDB_GLOBAL_CACHE=memcache requires a [memcache] section in config.ini")
+        # ndb stores its own serialized bytes.
+        return global_cache.MemcacheCache(create_memcache_client())
+    raise ValueError("Unknown [cache] NDB_GLOBAL_CACHE: {}".format(backend))
+
+
+def create_fence_key_lock_provider():
+    """
+    Create the LockProvider for fence service account key updates: Redis if [redis] USE_FOR_LOCKS is true, otherwise
+    None for FenceTokenStorage's Datastore default.
+    """
+    if redis_client is not None and config.getboolean('redis', 'USE_FOR_LOCKS', fallback=False):
+        return RedisLockProvider(redis_client)
+    return None
+
+
+def create_fence_token_storage():
+    """
+    Create a FenceTokenStorage that rotates service account keys in the background if
+    BOND_SERVICE_ACCOUNT_KEY_ROTATION_WINDOW is set to a positive number of seconds before a key expires, and waits at
+    most BOND_SERVICE_ACCOUNT_KEY_WAIT_DEADLINE seconds for another process to fetch a key.
+    """
+    rotation_window = int(os.environ.get('BOND_SERVICE_ACCOUNT_KEY_ROTATION_WINDOW', 0))
+    wait_deadline = int(os.environ.get('BOND_SERVICE_ACCOUNT_KEY_WAIT_DEADLINE', 30))
+    return fence_token_storage.FenceTokenStorage(background_executor if rotation_window > 0 else None,
+                                                 datetime.timedelta(seconds=max(rotation_window, 0)),
+                                                 wait_deadline=wait_deadline,
+                                                 lock_provider=fence_key_lock_provider)
 
 
 def create_provider(provider_name):
@@ -105,21 +252,45 @@ def create_provider(provider_name):
         extra_params_raw = config.get(provider_name, extra_params_key)
         extra_authz_url_params = ast.literal_eval(extra_params_raw)
 
-    open_id_config = OpenIdConfig(provider_name, open_id_config_url, cache_api)
-    oauth_adapter = OauthAdapter(client_id, client_secret, open_id_config, provider_name)
-    fence_api = FenceApi(fence_base_url)
-
-    fence_tvm = FenceTokenVendingMachine(fence_api, cache_api, refresh_token_store, oauth_adapter,
-                                         provider_name, fence_token_storage.FenceTokenStorage())
+    http_client = create_http_client(provider_name)
+    open_id_config = OpenIdConfig(provider_name, open_id_config_url, cache_api, http_client,
+                                  executor=background_executor,
+                                  memo_ttl=int(os.environ.get('BOND_OPEN_ID_CONFIG_MEMO_TTL', 300)))
+    oauth_adapter = OauthAdapter(client_id, client_secret, open_id_config, provider_name, http_client)
+    fence_api = FenceApi(fence_base_url, http_client)
+
+    token_storage = create_fence_token_storage()
+    stats_reporter.register(f"{provider_name} fence key storage", token_storage.stats)
+    # Access tokens are deleted from the cache when a user unlinks, which would only clear the local tier of the worker
+    # handling the unlink, so Bond and the FenceTokenVendingMachine do not use the local tier.
+    fence_tvm = FenceTokenVendingMachine(fence_api, shared_cache_api, refresh_token_store, oauth_adapter,
+                                         provider_name, token_storage, http_client)
+    refresh_lease_life = int(os.environ.get('BOND_ACCESS_TOKEN_REFRESH_LEASE_LIFE', 0))
+    refresh_lease = CacheLease(shared_cache_api, f"{provider_name}:AccessTokenRefreshLease", refresh_lease_life) \
+        if refresh_lease_life > 0 else None
     return BondProvider(fence_tvm, Bond(oauth_adapter,
                                         fence_api,
-                                        cache_api,
+                                        shared_cache_api,
                                         refresh_token_store,
                                         oauth2_state_store,
                                         fence_tvm,
                                         provider_name,
                                         user_name_path_expr,
-                                        extra_authz_url_params))
+                                        extra_authz_url_params,
+                                        refresh_lease,
+                                        refresh_ahead_scheduler))
+
+
+def create_warmup(deadline, context_factory=None):
+    """
+    Create the Warmup main.py runs at startup, which loads every provider's OpenID configuration and opens connections
+    to each provider's token endpoint and to Sam.
+    """
+    warmup = Warmup(deadline, context_factory)
+    for provider_name, provider in bond_providers.items():
+        warmup.add(provider_name, warm_up_open_id_config, provider.bond.oauth_adapter.open_id_config)
+    warmup.add("sam", sam_api.http_client.preconnect, sam_api.base_url)
+    return warmup
 
 
 def _get_provider(provider_name):
@@ -137,17 +308,51 @@ class BondProvider:
 
 routes = Blueprint('bond', __name__)
 
-cache_api = DatastoreCacheApi()
+redis_client = create_redis_client()
+shared_cache_api = create_shared_cache_api()
+# main.py opens every ndb context with these, so that all of Bond's Datastore writes keep the global cache consistent.
+ndb_global_cache = create_ndb_global_cache()
+ndb_global_cache_policy = ModelCachePolicy.parse(config.get('cache', 'NDB_GLOBAL_CACHE_TIMEOUTS', fallback=None))
+cache_api = create_cache_api(shared_cache_api)
+# main.py starts it, logging each worker's counters every BOND_STATS_LOG_INTERVAL seconds. 0 turns it off.
+stats_reporter = StatsReporter(int(os.environ.get('BOND_STATS_LOG_INTERVAL', 300)))
+if isinstance(cache_api, TieredCacheApi):
+    stats_reporter.register("cache tiers", cache_api.stats)
 refresh_token_store = TokenStore()
 oauth2_state_store = OAuth2StateStore()
+fence_key_lock_provider = create_fence_key_lock_provider()
+# Runs work off the request path. main.py sets its context_factory so that background work can use ndb.
+background_executor = BackgroundExecutor(int(os.environ.get('BOND_BACKGROUND_WORKERS', 2)),
+                                         int(os.environ.get('BOND_BACKGROUND_QUEUE_SIZE', 1000)))
+# Runs the cache writes of WriteBehindCacheApi on threads and a queue of their own, so that they are not held up behind
+# slow work on background_executor such as fence key rotations. main.py sets its context_factory too.
+write_behind_executor = BackgroundExecutor(int(os.environ.get('BOND_CACHE_WRITE_BEHIND_WORKERS', 2)),
+                                           int(os.environ.get('BOND_CACHE_WRITE_BEHIND_QUEUE_SIZE', 1000)))
+refresh_ahead_scheduler = create_refresh_ahead_scheduler()
+if refresh_ahead_scheduler is not None:
+    stats_reporter.register("access token refresh-ahead", refresh_ahead_scheduler.stats)
+cache_sweeper = CacheSweeper(batch_size=int(os.environ.get('BOND_CACHE_SWEEP_BATCH_SIZE', 500)),
+                             time_budget=int(os.environ.get('BOND_CACHE_SWEEP_TIME_BUDGET', 30)))
+# App Engine, which sets GAE_APPLICATION, strips X-Appengine-Cron from external requests, so only its cron service can
+# send it. Elsewhere, e.g. in Docker, anyone can, so the header is only trusted where the deployment strips it itself.
+trust_cron_header = os.environ.get('BOND_TRUST_CRON_HEADER',
+                                   'true' if os.environ.get('GAE_APPLICATION') else 'false').lower() == 'true'
 
 bond_providers = {section_name: create_provider(section_name)
                   for section_name in config.sections() if is_provider(section_name)}
 
 sam_base_url = config.get('sam', 'BASE_URL')
-sam_api = SamApi(sam_base_url)
-authentication_config = authentication.AuthenticationConfig(os.environ.get('BOND_MAX_TOKEN_LIFE', 600))
-auth = authentication.Authentication(authentication_config, cache_api, sam_api)
+sam_api = SamApi(sam_base_url, create_http_client('sam'))
+authentication_config = authentication.AuthenticationConfig(int(os.environ.get('BOND_MAX_TOKEN_LIFE', 600)),
+                                                            int(os.environ.get('BOND_NEGATIVE_TOKEN_LIFE', 30)))
+sam_lookup_lease_life = int(os.environ.get('BOND_SAM_LOOKUP_LEASE_LIFE', 0))
+sam_lookup_lease = CacheLease(shared_cache_api, "SamUserInfoLease", sam_lookup_lease_life) \
+    if sam_lookup_lease_life > 0 else None
+# With BOND_CACHE_WRITE_BEHIND=true, Sam user info is cached after responding instead of before. Not used with the Sam
+# lookup lease, whose waiters in other processes need the leaseholder's result cached before it releases the lease.
+auth_cache_api = WriteBehindCacheApi(cache_api, write_behind_executor) \
+    if os.environ.get('BOND_CACHE_WRITE_BEHIND', 'false').lower() == 'true' and sam_lookup_lease is None else cache_api
+auth = authentication.Authentication(authentication_config, auth_cache_api, sam_api, sam_lookup_lease)
 
 api_version = 'v1'
 link_api_routes_base = '/api/link/'
@@ -205,21 +410,27 @@ def accesstoken(provider):
 
 
 @routes.route(v1_link_route_base + '/<provider>/serviceaccount/key', methods=["GET"], strict_slashes=False)
-def service_account_key(provider):
+@use_args({"nonblocking": fields.Bool(missing=False)},
+          locations=("querystring",))
+def service_account_key(args, provider):
     sam_user_id = auth.auth_user(request)
     logging.info(f"Retrieving service account key for user {sam_user_id} for provider {provider}")
     return json_response(ServiceAccountKeyResponse(data=json.loads(
-        _get_provider(provider).fence_tvm.get_service_account_key_json(sam_user_id))))
+        _get_provider(provider).fence_tvm.get_service_account_key_json(sam_user_id, wait=not args['nonblocking']))))
 
 
 @routes.route(v1_link_route_base + '/<provider>/serviceaccount/accesstoken', methods=["GET"], strict_slashes=False)
-@use_args({"scopes": fields.List(fields.Str(), missing=None)},
+@use_args({"scopes": fields.List(fields.Str(), missing=None),
+           "audience": fields.Str(missing=None),
+           "nonblocking": fields.Bool(missing=False)},
           locations=("querystring",))
 def service_account_accesstoken(args, provider):
     sam_user_id = auth.auth_user(request)
     logging.info(f"Retrieving service account access token for user {sam_user_id} for provider {provider}")
     return json_response(ServiceAccountAccessTokenResponse(
-        token=_get_provider(provider).fence_tvm.get_service_account_access_token(sam_user_id, args['scopes'])))
+        token=_get_provider(provider).fence_tvm.get_service_account_access_token(sam_user_id, args['scopes'],
+                                                                                 args['audience'],
+                                                                                 wait=not args['nonblocking'])))
 
 
 @routes.route(v1_link_route_base + '/<provider>/authorization-url', methods=["GET"], strict_slashes=False)
@@ -237,13 +448,10 @@ def authorization_url(args, provider):
 
 @routes.route('/api/status/v1/status', methods=["GET"], strict_slashes=False)
 def get_status():
-    sam_base_url = config.get('sam', 'BASE_URL')
-
     subsystems_to_ignore = os.environ.get('SUBSYSTEMS_TO_IGNORE', '').split(',')
-    providers = {section_name: FenceApi(config.get(section_name, 'FENCE_BASE_URL'))
-                 for section_name in config.sections() if is_provider(section_name) and section_name not in subsystems_to_ignore}
+    providers = {provider_name: bond_provider.bond.fence_api
+                 for provider_name, bond_provider in bond_providers.items() if provider_name not in subsystems_to_ignore}
 
-    sam_api = SamApi(sam_base_url)
     status_service = Status(sam_api, providers, cache_api)
 
     subsystems = status_service.get()
@@ -269,6 +477,16 @@ def get_status():
         raise exceptions.InternalServerError(response[0])
 
 
+@routes.route(v1_link_route_base + '/clear-expired-cache-datastore-entries', methods=["GET"], strict_slashes=False)
+def clear_expired_cache_datastore_entries():
+    if not trust_cron_header:
+        raise exceptions.Forbidden("The cron header is not trusted here, set BOND_TRUST_CRON_HEADER=true to allow it.")
+    if request.headers.get('X-Appengine-Cron') != 'true':
+        raise exceptions.Forbidden("Missing required cron header.")
+    result = cache_sweeper.sweep()
+    return json_response(CacheSweepResponse(deleted=result.deleted, batches=result.batches, complete=result.complete))
+
+
 @routes.route('/', methods=["GET"], strict_slashes=False)
 def redirect_to_swagger():
     return redirect('/api/docs')
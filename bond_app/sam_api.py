@@ -1,13 +1,19 @@
 import json
 import logging
-import requests
 
 from werkzeug import exceptions
 
+from .http_client import HttpClient
+
 
 class SamApi:
-    def __init__(self, base_url):
+    def __init__(self, base_url, http_client=None):
+        """
+        :param base_url: The base url of Sam.
+        :param http_client: The HttpClient to call Sam with. A new one is created if None.
+        """
         self.base_url = base_url
+        self.http_client = http_client or HttpClient()
 
     def user_info(self, access_token):
         """
@@ -16,7 +22,7 @@ class SamApi:
         :return: dict with userSubjectId and userEmail keys or else None if user does not exist in sam
         """
         headers = {'Authorization': 'Bearer ' + access_token}
-        result = requests.get(url=self.base_url + '/register/user/v2/self/info', headers=headers)
+        result = self.http_client.get(url=self.base_url + '/register/user/v2/self/info', headers=headers)
         logging.info('Sam userInfo: status code {}, body {}'.format(result.status_code, result.content))
 
         if result.status_code == 200:
@@ -38,7 +44,7 @@ class SamApi:
         :return: 2 values: boolean ok or not, status message if not ok
         """
         try:
-            result = requests.get(url=self.base_url + "/status")
+            result = self.http_client.get(url=self.base_url + "/status")
             if result.status_code // 100 != 2:
                 return False, "sam status code {}, error body {}".format(result.status_code, result.content)
             else:
@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """An in flight call and its outcome."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key within this process. The first caller for a key runs the function
+    and every caller that arrives while it is running waits for, and shares, its result or exception.
+    """
+
+    def __init__(self):
+        # Dict from key to the _Call currently in flight for that key.
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self, key):
+        """:return: True if a call for key is running in this process."""
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key, fn):
+        """
+        Call fn() unless a call for key is already in flight, in which case wait for that call to finish.
+        :param key: A hashable key identifying calls that can share a result.
+        :param fn: A function of no arguments.
+        :return: The result of fn(). Raises the exception raised by fn(), if any.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class CacheLease:
+    """
+    A short, best effort lease stored in a shared CacheApi, used to keep processes that share the cache from doing the
+    same work at the same time.
+
+    CacheApi has no atomic add-if-absent, so two processes that race to acquire the lease can both believe they hold
+    it. Callers must only use the lease to avoid duplicate work, never for correctness.
+    """
+
+    def __init__(self, cache_api, namespace, expires_in, poll_interval=0.05):
+        """
+        :param cache_api: The shared CacheApi to store leases in.
+        :param namespace: The cache namespace for leases.
+        :param expires_in: The number of seconds a lease is held before it expires on its own.
+        :param poll_interval: The number of seconds between checks in wait_for.
+        """
+        self.cache_api = cache_api
+        self.namespace = namespace
+        self.expires_in = expires_in
+        self.poll_interval = poll_interval
+
+    def acquire(self, key):
+        """
+        Try to take the lease for key.
+        :return: A lease token to pass to release if the lease was taken, else None.
+        """
+        if self.cache_api.get(key, namespace=self.namespace) is not None:
+            return None
+        lease_token = str(uuid.uuid4())
+        if not self.cache_api.add(key, lease_token, expires_in=self.expires_in, namespace=self.namespace):
+            return None
+        # Read the lease back so that the loser of most races finds out it lost.
+        if self.cache_api.get(key, namespace=self.namespace) != lease_token:
+            return None
+        return lease_token
+
+    def release(self, key, lease_token):
+        """Give up the lease for key if lease_token still holds it."""
+        if self.cache_api.get(key, namespace=self.namespace) == lease_token:
+            self.cache_api.delete(key, namespace=self.namespace)
+
+    def wait_for(self, key, result_fn):
+        """
+        Poll result_fn() while someone else holds the lease for key.
+        :param key: The leased key.
+        :param result_fn: A function of no arguments that returns the leaseholder's result, or None if not ready.
+        :return: The first result that is not None, or None if the lease was released or expired without one.
+        """
+        deadline = time.time() + self.expires_in
+        while time.time() < deadline:
+            result = result_fn()
+            if result is not None:
+                return result
+            if self.cache_api.get(key, namespace=self.namespace) is None:
+                # The lease was released or expired. Check one last time for a result written before release.
+                return result_fn()
+            time.sleep(self.poll_interval)
+        logger.info("Gave up waiting for lease on {} in namespace {}".format(key, self.namespace))
+        return None
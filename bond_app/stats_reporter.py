@@ -0,0 +1,59 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StatsReporter:
+    """
+    Logs the counters of Bond's caches and background work every `interval` seconds, so that operators can see them.
+
+    Counters are kept per worker process, so each worker logs its own. The logging thread is started on the first call
+    to start in each process, so a reporter created before a server forks its workers still works in each of them.
+    """
+
+    def __init__(self, interval=300):
+        """
+        :param interval: Seconds between reports. 0 turns reporting off.
+        """
+        self.interval = interval
+        # List of (name, function returning the counters to log).
+        self._sources = []
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def register(self, name, stats):
+        """
+        Log the result of stats() in each report.
+        :param name: The name to log the counters under.
+        :param stats: A function returning the counters, e.g. TieredCacheApi.stats.
+        """
+        with self._lock:
+            self._sources.append((name, stats))
+
+    def report(self):
+        """Log the counters of every registered source now."""
+        with self._lock:
+            sources = list(self._sources)
+        for name, stats in sources:
+            try:
+                logger.info("Stats for {} in process {}: {}".format(name, os.getpid(), stats()))
+            except Exception:
+                logger.exception("Error getting stats for {}".format(name))
+
+    def start(self):
+        """Start reporting in the background, unless already started in this process or reporting is off."""
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.report()
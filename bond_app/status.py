@@ -13,36 +13,45 @@ class Status:
         :return: list of dicts with entries "ok": boolean, "message": string, "subsystem": name
         """
         try:
-            status = self._get_cached_status()
-            if status:
-                return status
-            else:
-                # if we got this far memcache is ok
-                provider_statuses = [(provider_name, provider_api.status())
-                                     for (provider_name, provider_api) in list(self.provider_status_apis_by_name.items())]
-                provider_status_messages = [{"ok": ok, "message": message, "subsystem": provider_name}
-                                            for (provider_name, (ok, message)) in provider_statuses]
-
-                datastore_ok, datastore_message = self._datastore_status()
-                sam_ok, sam_message = self.sam_api.status()
-
-                status = provider_status_messages + [
-                    {"ok": True, "message": "", "subsystem": Subsystems.cache},
-                    {"ok": datastore_ok, "message": datastore_message, "subsystem": Subsystems.datastore},
-                    {"ok": sam_ok, "message": sam_message, "subsystem": Subsystems.sam}
-                ]
-                self._cache_status(status)
-            return status
+            checks = [(provider_name, provider_api.status)
+                      for (provider_name, provider_api) in list(self.provider_status_apis_by_name.items())]
+            checks += [(Subsystems.datastore, self._datastore_status), (Subsystems.sam, self.sam_api.status)]
+            statuses = self._get_cached_statuses([subsystem for (subsystem, _) in checks])
+            # if we got this far memcache is ok. Each subsystem's status is cached on its own, so only the ones
+            # missing from the cache are checked.
+            checked_statuses = {}
+            for (subsystem, check) in checks:
+                if subsystem not in statuses:
+                    ok, message = check()
+                    checked_statuses[subsystem] = {"ok": ok, "message": message, "subsystem": subsystem}
+            if checked_statuses:
+                self._cache_statuses(checked_statuses)
+                statuses.update(checked_statuses)
+
+            return [statuses[provider_name] for provider_name in self.provider_status_apis_by_name] + [
+                {"ok": True, "message": "", "subsystem": Subsystems.cache},
+                statuses[Subsystems.datastore],
+                statuses[Subsystems.sam]
+            ]
         except Exception as e:
             logging.error(e)
             # any exception at this point is the cache
             return [{"ok": False, "message": str(e), "subsystem": Subsystems.cache}]
 
-    def _cache_status(self, status):
-        self.cache_api.add(namespace='bond', key="status", value=status, expires_in=60)
+    def _cache_statuses(self, statuses_by_subsystem):
+        self.cache_api.add_multi({self._status_key(subsystem): status
+                                  for (subsystem, status) in statuses_by_subsystem.items()},
+                                 expires_in=60, namespace='bond')
+
+    def _get_cached_statuses(self, subsystems):
+        """:return: dict from subsystem to its cached status, for the subsystems that have one."""
+        cached = self.cache_api.get_multi([self._status_key(subsystem) for subsystem in subsystems], namespace='bond')
+        return {subsystem: cached[self._status_key(subsystem)] for subsystem in subsystems
+                if self._status_key(subsystem) in cached}
 
-    def _get_cached_status(self):
-        return self.cache_api.get(namespace='bond', key="status")
+    @staticmethod
+    def _status_key(subsystem):
+        return "status:{}".format(subsystem)
 
     @staticmethod
     def _datastore_status():
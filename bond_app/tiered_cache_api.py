@@ -0,0 +1,87 @@
+import threading
+
+from .cache_api import CacheApi
+
+
+class TieredCacheApi(CacheApi):
+    """
+    A CacheApi composed of other CacheApis, ordered from the fastest tier to the authoritative one.
+
+    Reads go through the tiers in order and stop at the first hit. A hit in a slower tier is copied into the faster
+    tiers above it. Writes and deletes go through to every tier, slowest first, so that a faster tier never holds a
+    value that the tiers below it have not seen.
+    """
+
+    def __init__(self, tiers, backfill_expires_in=60):
+        """
+        :param tiers: A list of CacheApis, fastest first.
+        :param backfill_expires_in: The number of seconds to keep a value copied into a faster tier after a hit in a
+        slower tier. The remaining life of the original entry is not known, so this bounds how stale a copy can be.
+        """
+        if not tiers:
+            raise ValueError("TieredCacheApi needs at least one tier")
+        self.tiers = list(tiers)
+        self.backfill_expires_in = backfill_expires_in
+        self._hits = [0] * len(self.tiers)
+        self._misses = [0] * len(self.tiers)
+        self._stats_lock = threading.Lock()
+
+    def add(self, key, value, expires_in=0, namespace=None):
+        results = [tier.add(key, value, expires_in=expires_in, namespace=namespace)
+                   for tier in reversed(self.tiers)]
+        return all(results)
+
+    def get(self, key, namespace=None):
+        for index, tier in enumerate(self.tiers):
+            value = tier.get(key, namespace=namespace)
+            if value is not None:
+                self._record(index, hits=1)
+                for faster_tier in self.tiers[:index]:
+                    faster_tier.add(key, value, expires_in=self.backfill_expires_in, namespace=namespace)
+                return value
+            self._record(index, misses=1)
+        return None
+
+    def delete(self, key, namespace=None):
+        for tier in reversed(self.tiers):
+            tier.delete(key, namespace=namespace)
+
+    def get_multi(self, keys, namespace=None):
+        values = {}
+        missing = list(keys)
+        for index, tier in enumerate(self.tiers):
+            if not missing:
+                break
+            found = tier.get_multi(missing, namespace=namespace)
+            self._record(index, hits=len(found), misses=len(missing) - len(found))
+            if found:
+                for faster_tier in self.tiers[:index]:
+                    faster_tier.add_multi(found, expires_in=self.backfill_expires_in, namespace=namespace)
+                values.update(found)
+                missing = [cache_key for cache_key in missing if cache_key not in found]
+        return values
+
+    def add_multi(self, mapping, expires_in=0, namespace=None):
+        results = [tier.add_multi(mapping, expires_in=expires_in, namespace=namespace)
+                   for tier in reversed(self.tiers)]
+        return all(results)
+
+    def delete_multi(self, keys, namespace=None):
+        keys = list(keys)
+        for tier in reversed(self.tiers):
+            tier.delete_multi(keys, namespace=namespace)
+
+    def stats(self):
+        """
+        Hit and miss counts for each tier since this TieredCacheApi was created. A tier is only consulted on a miss in
+        the tiers above it.
+        :return: list of dicts with entries "tier": the tier class name, "hits": int, "misses": int, fastest tier first
+        """
+        with self._stats_lock:
+            return [{"tier": type(tier).__name__, "hits": hits, "misses": misses}
+                    for (tier, hits, misses) in zip(self.tiers, self._hits, self._misses)]
+
+    def _record(self, index, hits=0, misses=0):
+        with self._stats_lock:
+            self._hits[index] += hits
+            self._misses[index] += misses
@@ -1,5 +1,15 @@
 import os
 
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import ndb
+
+# config.ini sections that configure Bond itself rather than an OAuth provider.
+NON_PROVIDER_SECTIONS = ('sam', 'bond_accepted', 'cache', 'redis', 'memcache')
+
+
+def is_provider_section(section_name):
+    return section_name not in NON_PROVIDER_SECTIONS
+
 
 def get_provider_secrets(config, provider: str):
     if os.environ.get("BOND_ENV_SECRETS"):
@@ -10,3 +20,17 @@ def get_provider_secrets(config, provider: str):
         client_id = config.get(provider, 'CLIENT_ID')
         client_secret = config.get(provider, 'CLIENT_SECRET')
     return client_id, client_secret
+
+
+def create_ndb_client():
+    """Create the ndb Client for the Datastore emulator, DATASTORE_GOOGLE_PROJECT, or the environment's default."""
+    if os.environ.get('DATASTORE_EMULATOR_HOST'):
+        # If we're running the datastore emulator, we should use anonymous credentials to connect to it.
+        # The project should match the project given to the Datastore Emulator.
+        # See tests/datastore_emulator/run_emulator.sh
+        return ndb.Client(project="test", credentials=AnonymousCredentials())
+    elif os.environ.get('DATASTORE_GOOGLE_PROJECT'):
+        return ndb.Client(os.environ.get('DATASTORE_GOOGLE_PROJECT'))
+    else:
+        # Otherwise, create a client grabbing credentials normally from cloud environment variables.
+        return ndb.Client()
@@ -0,0 +1,95 @@
+import contextlib
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WarmupResult:
+    """The names of the tasks of one Warmup.run, by outcome."""
+    succeeded: list
+    failed: list
+    # Tasks still running at the deadline. They carry on in the background.
+    timed_out: list
+
+
+class Warmup:
+    """
+    Prepares a worker for its first requests, e.g. by loading what they would otherwise load and opening connections to
+    the upstreams they call.
+
+    The tasks run concurrently and `run` returns once they are done or `deadline` seconds have passed, whichever is
+    first, so a slow or failing upstream does not block startup. Anything a task did not get to is loaded lazily by
+    the first request that needs it, as it would be without warmup.
+    """
+
+    def __init__(self, deadline=10, context_factory=None):
+        """
+        :param deadline: Seconds to wait for the tasks.
+        :param context_factory: Optional function returning a context manager to run each task in, e.g. an ndb
+        client context.
+        """
+        self.deadline = deadline
+        self.context_factory = context_factory or contextlib.nullcontext
+        # Dict from task name to (fn, args).
+        self._tasks = {}
+
+    def add(self, name, fn, *args):
+        """Add a task running fn(*args) to the warmup."""
+        self._tasks[name] = (fn, args)
+
+    def run(self):
+        """
+        Run the tasks, waiting at most `deadline` seconds.
+        :return: WarmupResult
+        """
+        if not self._tasks:
+            return WarmupResult(succeeded=[], failed=[], timed_out=[])
+        started_at = time.monotonic()
+        deadline = started_at + self.deadline
+        # Dict from task name to the exception it raised, or None, filled in as tasks finish.
+        outcomes = {}
+        # Daemon threads, so that a task stuck on an upstream holds up neither startup nor shutdown.
+        threads = [threading.Thread(target=self._run_task, args=(name, fn, args, outcomes), name="warmup-" + name,
+                                    daemon=True)
+                   for name, (fn, args) in self._tasks.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+        # Copy, so that tasks finishing late do not change the outcomes while they are read.
+        outcomes = dict(outcomes)
+        result = WarmupResult(succeeded=[], failed=[],
+                              timed_out=sorted(name for name in self._tasks if name not in outcomes))
+        for name, exception in outcomes.items():
+            if exception is None:
+                result.succeeded.append(name)
+            else:
+                result.failed.append(name)
+                logger.warning("Warmup of {} failed, it will load lazily: {}".format(name, exception))
+        result.succeeded.sort()
+        result.failed.sort()
+        if result.timed_out:
+            logger.warning("Warmup of {} did not finish within {} seconds, continuing without it".format(
+                ", ".join(result.timed_out), self.deadline))
+        logger.info("Warmed up {} of {} in {:.2f} seconds".format(
+            len(result.succeeded), len(self._tasks), time.monotonic() - started_at))
+        return result
+
+    def _run_task(self, name, fn, args, outcomes):
+        try:
+            with self.context_factory():
+                fn(*args)
+            outcomes[name] = None
+        except Exception as e:
+            outcomes[name] = e
+
+
+def warm_up_open_id_config(open_id_config):
+    """Load a provider's OpenID configuration and open a connection to its token endpoint."""
+    open_id_config.load_dict()
+    open_id_config.http_client.preconnect(open_id_config.get_token_info_url())
@@ -0,0 +1,116 @@
+import threading
+import time
+
+from .cache_api import CacheApi, split_cache_key
+
+# The number of locks that keys are striped across to order background writes with deletes.
+_LOCK_STRIPES = 64
+
+
+class _PendingWrite:
+    """A value added to a WriteBehindCacheApi that has not been written to the underlying CacheApi yet."""
+
+    def __init__(self, value, expires_in):
+        self.value = value
+        self.expires_in = expires_in
+        self.expiration_time = None if expires_in == 0 else time.time() + expires_in
+
+    def get_valid_value(self):
+        """Returns the value if it has not expired, otherwise None."""
+        return self.value if not self.expiration_time or time.time() < self.expiration_time else None
+
+
+class WriteBehindCacheApi(CacheApi):
+    """
+    A CacheApi that adds to another CacheApi on a BackgroundExecutor, so that callers do not wait for cache writes.
+
+    Only suitable for entries whose loss is harmless, since a queued write is lost if the process exits, and for
+    entries that other processes do not wait on, since they only see a value once its write has run. Until then,
+    reads in this process are answered from the queued value. Deletes are not queued, and a delete always wins over a
+    write of the same key queued before it. If the executor's queue is full, adds are written synchronously.
+    """
+
+    def __init__(self, cache_api, executor):
+        """
+        :param cache_api: The CacheApi to write to.
+        :param executor: The BackgroundExecutor to write on.
+        """
+        self.cache_api = cache_api
+        self.executor = executor
+        # Dict from (namespace, key) to the _PendingWrite queued for it.
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+    def add(self, key, value, expires_in=0, namespace=None):
+        cache_key = (namespace, key)
+        pending_write = _PendingWrite(value, expires_in)
+        with self._pending_lock:
+            self._pending[cache_key] = pending_write
+        if self.executor.submit(self._write, cache_key, pending_write):
+            return True
+        return self._write(cache_key, pending_write)
+
+    def get(self, key, namespace=None):
+        with self._pending_lock:
+            pending_write = self._pending.get((namespace, key))
+        if pending_write is not None:
+            return pending_write.get_valid_value()
+        return self.cache_api.get(key, namespace=namespace)
+
+    def delete(self, key, namespace=None):
+        cache_key = (namespace, key)
+        with self._lock_for(cache_key):
+            with self._pending_lock:
+                self._pending.pop(cache_key, None)
+            self.cache_api.delete(key, namespace=namespace)
+
+    def get_multi(self, keys, namespace=None):
+        values = {}
+        unwritten = []
+        with self._pending_lock:
+            for cache_key in keys:
+                key, key_namespace = split_cache_key(cache_key, namespace)
+                pending_write = self._pending.get((key_namespace, key))
+                if pending_write is None:
+                    unwritten.append(cache_key)
+                elif pending_write.get_valid_value() is not None:
+                    values[cache_key] = pending_write.value
+        if unwritten:
+            values.update(self.cache_api.get_multi(unwritten, namespace=namespace))
+        return values
+
+    def pending(self):
+        """:return: The number of adds that have not been written yet."""
+        with self._pending_lock:
+            return len(self._pending)
+
+    def _write(self, cache_key, pending_write):
+        """
+        Write a queued add, unless it has been replaced by a later add or a delete.
+        :return: True if written or replaced, False if the write failed.
+        """
+        namespace, key = cache_key
+        with self._lock_for(cache_key):
+            with self._pending_lock:
+                if self._pending.get(cache_key) is not pending_write:
+                    return True
+            # Write the remaining life of the entry, not the whole of it again.
+            expires_in = pending_write.expires_in
+            if pending_write.expiration_time is not None:
+                expires_in = pending_write.expiration_time - time.time()
+                if expires_in <= 0:
+                    self._forget(cache_key, pending_write)
+                    return True
+            try:
+                return self.cache_api.add(key, pending_write.value, expires_in=expires_in, namespace=namespace)
+            finally:
+                self._forget(cache_key, pending_write)
+
+    def _forget(self, cache_key, pending_write):
+        with self._pending_lock:
+            if self._pending.get(cache_key) is pending_write:
+                del self._pending[cache_key]
+
+    def _lock_for(self, cache_key):
+        return self._locks[hash(cache_key) % _LOCK_STRIPES]
@@ -7,13 +7,12 @@ import google.cloud.logging
 import sentry_sdk
 import yaml
 from flask_cors import CORS
-from google.auth.credentials import AnonymousCredentials
-from google.cloud import ndb
 from sentry_sdk.integrations.flask import FlaskIntegration
 
 from bond_app import routes
 from bond_app.json_exception_handler import JsonExceptionHandler
 from bond_app.swagger_ui import swaggerui_blueprint, SWAGGER_URL
+from bond_app.util import create_ndb_client
 
 SENTRY_DSN = os.environ.get("SENTRY_DSN")
 SENTRY_ENVIRONMENT = os.environ.get("SENTRY_ENVIRONMENT")
@@ -31,29 +30,31 @@ if SENTRY_DSN is not None:
         # release="myapp@1.0.0",
     )
 
-client = None
-if os.environ.get('DATASTORE_EMULATOR_HOST'):
-    # If we're running the datastore emulator, we should use anonymous credentials to connect to it.
-    # The project should match the project given to the Datastore Emulator. See tests/datastore_emulator/run_emulator.sh
-    client = ndb.Client(project="test", credentials=AnonymousCredentials())
-elif os.environ.get('DATASTORE_GOOGLE_PROJECT'):
-    project = os.environ.get('DATASTORE_GOOGLE_PROJECT')
-    client = ndb.Client(project)
-else:
-    # Otherwise, create a client grabbing credentials normally from cloud environment variables.
-    client = ndb.Client()
+client = create_ndb_client()
+
+
+def ndb_context():
+    """Create an NDB client context, reading through the ndb global cache if one is configured."""
+    return client.context(global_cache=routes.ndb_global_cache,
+                          global_cache_policy=routes.ndb_global_cache_policy.cache,
+                          global_cache_timeout_policy=routes.ndb_global_cache_policy.timeout)
 
 
 def ndb_wsgi_middleware(wsgi_app):
     """Wrap an app so that each request gets its own NDB client context."""
 
     def middleware(environ, start_response):
-        with client.context():
+        with ndb_context():
             return wsgi_app(environ, start_response)
 
     return middleware
 
 
+# Background threads do not run inside a request, so give each background task its own NDB client context too.
+routes.background_executor.context_factory = ndb_context
+routes.write_behind_executor.context_factory = ndb_context
+
+
 def setup_logging():
     """
     If we are running as a GAE application, we need to set up Stackdriver logging.
@@ -111,6 +112,13 @@ app = create_app()
 app.wsgi_app = ndb_wsgi_middleware(app.wsgi_app)  # Wrap the app in middleware.
 handler = JsonExceptionHandler(app)
 
+# Load what the first request to each provider needs before serving it. Whatever is not done within
+# BOND_WARMUP_DEADLINE seconds is loaded lazily instead. 0 turns warmup off.
+warmup_deadline = float(os.environ.get('BOND_WARMUP_DEADLINE', 10))
+if warmup_deadline > 0:
+    routes.create_warmup(warmup_deadline, ndb_context).run()
+routes.stats_reporter.start()
+
 
 @app.after_request
 def add_nosniff_content_type_header(response):
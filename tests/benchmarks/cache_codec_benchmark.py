@@ -0,0 +1,81 @@
+"""
+Compares the encode and decode time and stored size of the values Bond caches in Datastore, pickled as by
+ndb.PickleProperty and encoded by JsonCacheCodec.
+
+Run from the root of the project with:
+    python -m tests.benchmarks.cache_codec_benchmark
+"""
+import datetime
+import pickle
+import random
+import string
+import timeit
+
+from bond_app.bond import FenceAccessToken
+from bond_app.cache_codec import JsonCacheCodec
+from bond_app.fence_token_vending import ServiceAccountAccessToken
+
+_NUMBER = 10000
+
+
+def _token(length):
+    """A random token of `length` characters, since real tokens do not compress."""
+    return ''.join(random.Random(length).choices(string.ascii_letters + string.digits + '-_', k=length))
+
+
+_SAMPLE_VALUES = {
+    "sam user info": {"userSubjectId": "123456789012345678901", "userEmail": "someone@example.com",
+                      "enabled": {"ldap": True, "allUsersGroup": True, "google": True}},
+    "fence access token": FenceAccessToken(value=_token(900),
+                                           expires_at=datetime.datetime(2030, 1, 1, 12, 0, 0),
+                                           link_version="0f1e2d3c4b5a69788796a5b4c3d2e1f0"),
+    "service account access tokens": {
+        "https://www.googleapis.com/auth/cloud-platform": ServiceAccountAccessToken(
+            value="ya29." + _token(200), expires_at=datetime.datetime(2030, 1, 1, 12, 0, 0)),
+        "audience=https://example.com": ServiceAccountAccessToken(
+            value=_token(600),
+            expires_at=datetime.datetime(2030, 1, 1, 12, 0, 0)),
+    },
+    "open id config": {
+        "issuer": "https://example.com/user",
+        "authorization_endpoint": "https://example.com/user/oauth2/authorize",
+        "token_endpoint": "https://example.com/user/oauth2/token",
+        "revocation_endpoint": "https://example.com/user/oauth2/revoke",
+        "userinfo_endpoint": "https://example.com/user/user",
+        "jwks_uri": "https://example.com/user/.well-known/jwks",
+        "response_types_supported": ["code", "id_token", "code id_token", "token id_token", "code token id_token"],
+        "subject_types_supported": ["public"],
+        "id_token_signing_alg_values_supported": ["RS256"],
+        "scopes_supported": ["openid", "user", "data", "google_credentials", "google_service_account",
+                             "google_link", "admin", "fence"],
+        "claims_supported": ["aud", "sub", "iss", "exp", "jti", "auth_time", "azp", "nonce", "context"],
+    },
+    "status": [{"ok": True, "message": "", "subsystem": name}
+               for name in ["fence", "dcf-fence", "anvil", "kids-first", "cache", "datastore", "sam"]],
+}
+
+
+def _time_per_call(fn):
+    """:return: The mean microseconds per call of fn."""
+    return timeit.timeit(fn, number=_NUMBER) / _NUMBER * 1e6
+
+
+def main():
+    codec = JsonCacheCodec()
+    print("{:<32}{:>8}{:>12}{:>12}{:>8}{:>12}{:>12}".format(
+        "value", "pickle", "encode us", "decode us", "codec", "encode us", "decode us"))
+    for name, value in _SAMPLE_VALUES.items():
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        encoded = codec.encode(value)
+        print("{:<32}{:>8}{:>12.2f}{:>12.2f}{:>8}{:>12.2f}{:>12.2f}".format(
+            name,
+            len(pickled),
+            _time_per_call(lambda: pickle.dumps(value, pickle.HIGHEST_PROTOCOL)),
+            _time_per_call(lambda: pickle.loads(pickled)),
+            len(encoded),
+            _time_per_call(lambda: codec.encode(value)),
+            _time_per_call(lambda: codec.decode(encoded))))
+
+
+if __name__ == '__main__':
+    main()
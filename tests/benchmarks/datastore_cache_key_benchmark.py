@@ -0,0 +1,69 @@
+"""
+Compares the sustained write throughput of DatastoreCacheApi entries in one namespace under the legacy key layout,
+where the namespace is a shared ancestor, and the current flat layout, where every entry is its own entity group.
+
+Each write is transactional, as concurrent writers in one entity group contend on transactions. Requires a running
+Datastore emulator, see tests/datastore_emulator/README.md. Run from the root of the project with:
+    DATASTORE_EMULATOR_HOST=0.0.0.0:8432 python -m tests.benchmarks.datastore_cache_key_benchmark
+"""
+import argparse
+import threading
+import time
+
+from google.api_core import exceptions
+from google.cloud import ndb
+
+from bond_app.datastore_cache_api import DatastoreCacheApi
+from bond_app.util import create_ndb_client
+
+
+class _LegacyKeyDatastoreCacheApi(DatastoreCacheApi):
+    """Writes entries under the legacy key layout."""
+
+    @staticmethod
+    def _build_cache_key(key, namespace):
+        return DatastoreCacheApi._build_legacy_cache_key(key, namespace)
+
+
+def _run(client, cache, threads, writes_per_thread):
+    """:return: (successful writes per second, failed writes)"""
+    failures = [0]
+    lock = threading.Lock()
+
+    def write(thread_index):
+        with client.context():
+            for i in range(writes_per_thread):
+                entry = cache._create_entry(cache._build_cache_key("user{}-{}".format(thread_index, i), "SamUserInfo"),
+                                            {"userSubjectId": str(i)}, cache._calculate_expiration(600))
+                try:
+                    ndb.transaction(entry.put, retries=0)
+                except exceptions.GoogleAPICallError:
+                    # Typically a transaction aborted by contention.
+                    with lock:
+                        failures[0] += 1
+
+    workers = [threading.Thread(target=write, args=(index,)) for index in range(threads)]
+    start = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - start
+    return (threads * writes_per_thread - failures[0]) / elapsed, failures[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--writes-per-thread", type=int, default=50)
+    args = parser.parse_args()
+
+    client = create_ndb_client()
+    print("{:<10}{:>16}{:>12}".format("layout", "writes/sec", "failed"))
+    for name, cache in [("legacy", _LegacyKeyDatastoreCacheApi()), ("flat", DatastoreCacheApi())]:
+        writes_per_second, failed = _run(client, cache, args.threads, args.writes_per_thread)
+        print("{:<10}{:>16.1f}{:>12}".format(name, writes_per_second, failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import datetime
+import unittest
+
+from google.cloud import ndb
+
+from bond_app.cache_sweeper import CacheSweeper, CacheSweepCheckpoint, _CHECKPOINT_ID
+from bond_app.datastore_cache_api import CacheEntry, DatastoreCacheApi
+from tests.datastore_emulator import datastore_emulator_utils
+
+
+class CacheSweeperTestCase(unittest.TestCase):
+    def setUp(self):
+        datastore_emulator_utils.setUp(self)
+        self.cache = DatastoreCacheApi()
+
+    def add_expired(self, key, namespace=None):
+        CacheEntry(key=DatastoreCacheApi._build_cache_key(key, namespace), value=key,
+                   expires_at=datetime.datetime.now() - datetime.timedelta(minutes=1)).put()
+
+    def test_deletes_only_expired_entries(self):
+        self.add_expired("foo")
+        self.add_expired("bar", namespace="baz")
+        self.cache.add("live", 1, expires_in=600)
+        self.cache.add("forever", 2)
+
+        result = CacheSweeper().sweep()
+
+        self.assertEqual(result.deleted, 2)
+        self.assertTrue(result.complete)
+        self.assertIsNone(DatastoreCacheApi._build_cache_key("foo", None).get())
+        self.assertIsNone(DatastoreCacheApi._build_cache_key("bar", "baz").get())
+        self.assertEqual(self.cache.get("live"), 1)
+        self.assertEqual(self.cache.get("forever"), 2)
+        self.assertIsNone(ndb.Key(CacheSweepCheckpoint, _CHECKPOINT_ID).get())
+
+    def test_resumes_from_checkpoint(self):
+        for i in range(5):
+            self.add_expired("key{}".format(i))
+        # No time budget, so each run deletes a single batch.
+        sweeper = CacheSweeper(batch_size=2, time_budget=0)
+
+        result = sweeper.sweep()
+        self.assertEqual((result.deleted, result.batches, result.complete), (2, 1, False))
+        self.assertIsNotNone(ndb.Key(CacheSweepCheckpoint, _CHECKPOINT_ID).get().cursor)
+
+        result = sweeper.sweep()
+        self.assertEqual((result.deleted, result.batches, result.complete), (2, 1, False))
+
+        result = sweeper.sweep()
+        self.assertEqual((result.deleted, result.complete), (1, True))
+        self.assertIsNone(ndb.Key(CacheSweepCheckpoint, _CHECKPOINT_ID).get())
+
+    def test_time_budget(self):
+        for i in range(5):
+            self.add_expired("key{}".format(i))
+        now = [0]
+
+        def clock():
+            now[0] += 1
+            return now[0]
+
+        # The clock advances a second each time it is read, so the budget allows a second batch but not a third.
+        result = CacheSweeper(batch_size=1, time_budget=1.5, clock=clock).sweep()
+        self.assertEqual(result.batches, 2)
+        self.assertEqual(result.deleted, 2)
+        self.assertFalse(result.complete)
@@ -1,9 +1,10 @@
 from base64 import b64encode
+import datetime
 import os
 import time
 import unittest
 
-from bond_app.datastore_cache_api import DatastoreCacheApi
+from bond_app.datastore_cache_api import CacheEntry, DatastoreCacheApi, _NO_EXPIRATION_DATETIME
 from tests.unit import cache_api_test
 from tests.datastore_emulator import datastore_emulator_utils
 
@@ -22,3 +23,67 @@ class DatstoreCacheApiTestCase(unittest.TestCase, cache_api_test.CacheApiTest):
         self.assertFalse(cache.add(large_key, "value"))
         self.assertIsNone(cache.get(large_key))
         cache.delete(large_key)
+
+    def test_large_keys_multi(self):
+        cache = DatastoreCacheApi()
+
+        large_key = b64encode(os.urandom(1600)).decode('utf-8')
+
+        # An invalid key should not stop the valid keys of a batch from being added or found.
+        self.assertFalse(cache.add_multi({large_key: "value", "foo": "bar"}))
+        self.assertEqual(cache.get_multi([large_key, "foo"]), {"foo": "bar"})
+        cache.delete_multi([large_key, "foo"])
+        self.assertIsNone(cache.get("foo"))
+
+    def test_reads_pickled_entries(self):
+        cache = DatastoreCacheApi()
+
+        # Entries written before values were encoded by a CacheCodec.
+        CacheEntry(key=cache._build_cache_key("foo", "bar"), value={"foo": "bar"},
+                   expires_at=_NO_EXPIRATION_DATETIME).put()
+        self.assertEqual(cache.get("foo", namespace="bar"), {"foo": "bar"})
+
+        CacheEntry(key=cache._build_cache_key("baz", None), value="expired",
+                   expires_at=datetime.datetime.now() - datetime.timedelta(seconds=1)).put()
+        self.assertIsNone(cache.get("baz"))
+
+    def test_encodes_values(self):
+        cache = DatastoreCacheApi()
+
+        self.assertTrue(cache.add("foo", {"foo": "bar"}))
+        entry = cache._build_cache_key("foo", None).get()
+        self.assertIsNone(entry.value)
+        self.assertEqual(cache.codec.decode(entry.encoded_value), {"foo": "bar"})
+
+    def test_pickles_values_codec_cannot_encode(self):
+        cache = DatastoreCacheApi()
+
+        self.assertTrue(cache.add("foo", {"foo"}))
+        self.assertIsNone(cache._build_cache_key("foo", None).get().encoded_value)
+        self.assertEqual(cache.get("foo"), {"foo"})
+
+    def test_keys_spread_across_entity_groups(self):
+        self.assertIsNone(DatastoreCacheApi._build_cache_key("foo", "bar").parent())
+        self.assertNotEqual(DatastoreCacheApi._build_cache_key("b:c", "a"),
+                            DatastoreCacheApi._build_cache_key("c", "a:b"))
+
+    def test_reads_legacy_keys(self):
+        cache = DatastoreCacheApi(read_legacy_keys=True)
+        CacheEntry(key=cache._build_legacy_cache_key("foo", "bar"), encoded_value=cache.codec.encode("legacy"),
+                   expires_at=_NO_EXPIRATION_DATETIME).put()
+        CacheEntry(key=cache._build_legacy_cache_key("baz", None), value="legacy pickle",
+                   expires_at=_NO_EXPIRATION_DATETIME).put()
+
+        self.assertEqual(cache.get("foo", namespace="bar"), "legacy")
+        self.assertEqual(cache.get_multi([("foo", "bar"), "baz"]), {("foo", "bar"): "legacy", "baz": "legacy pickle"})
+        self.assertIsNone(DatastoreCacheApi().get("foo", namespace="bar"))
+
+        # New entries take precedence over legacy ones.
+        self.assertTrue(cache.add("foo", "new", namespace="bar"))
+        self.assertEqual(cache.get("foo", namespace="bar"), "new")
+
+        # Deleting removes both, so that the legacy entry does not reappear.
+        cache.delete("foo", namespace="bar")
+        self.assertIsNone(cache.get("foo", namespace="bar"))
+        cache.delete_multi(["baz"])
+        self.assertIsNone(cache.get("baz"))
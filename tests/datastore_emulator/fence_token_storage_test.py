@@ -1,5 +1,9 @@
 from bond_app.fence_token_storage import ProviderUser, FenceServiceAccount, FenceTokenStorage, \
-    ServiceAccountNotUpdatedException, _FSA_KEY_LIFETIME
+    ServiceAccountNotUpdatedException, ServiceAccountUpdateInProgressException, _FSA_KEY_LIFETIME
+from bond_app.background import BackgroundExecutor
+from bond_app.fence_token_storage import DatastoreLockProvider
+from bond_app.lock_provider import RedisLockProvider
+from tests.unit.fake_redis import FakeRedis
 import datetime
 import threading
 import time
@@ -80,6 +84,78 @@ class FenceTokenStorageTestCase(unittest.TestCase):
         self.assertIsExpectedToken(key_json)
         self.assertEqual(self.fence_fetches, 1)
 
+    def test_key_rotated_in_background_within_rotation_window(self):
+        # Store a key that expires within the rotation window.
+        FenceServiceAccount(key=self.fsa_key, key_json="expiring_key",
+                            expires_at=datetime.datetime.now() + datetime.timedelta(hours=1),
+                            update_lock_timeout=None).put()
+        executor = BackgroundExecutor(context_factory=datastore_emulator_utils.client.context)
+        token_storage = FenceTokenStorage(executor, rotation_window=datetime.timedelta(days=1))
+
+        # The expiring key is still returned while its replacement is fetched.
+        (key_json, _) = token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key,
+                                               fence_fetch_fn=self.fence_fetch)
+        self.assertEqual(key_json, "expiring_key")
+        executor.join()
+
+        (key_json, expires_at) = token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key,
+                                                        fence_fetch_fn=self.fence_fetch)
+        self.assertIsExpectedToken(key_json)
+        self.assertAlmostEqual(expires_at, datetime.datetime.now() + _FSA_KEY_LIFETIME,
+                               delta=datetime.timedelta(seconds=5))
+        self.assertEqual(self.fence_fetches, 1)
+
+    def test_key_not_rotated_outside_rotation_window(self):
+        FenceServiceAccount(key=self.fsa_key, key_json="fresh_key",
+                            expires_at=datetime.datetime.now() + datetime.timedelta(days=3),
+                            update_lock_timeout=None).put()
+        executor = BackgroundExecutor(context_factory=datastore_emulator_utils.client.context)
+        token_storage = FenceTokenStorage(executor, rotation_window=datetime.timedelta(days=1))
+
+        (key_json, _) = token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key,
+                                               fence_fetch_fn=self.fence_fetch)
+        executor.join()
+
+        self.assertEqual(key_json, "fresh_key")
+        self.assertEqual(self.fence_fetches, 0)
+
+    def test_concurrent_retrieves_in_process_share_one_lock_attempt(self):
+        token_storage = FenceTokenStorage()
+        lock_attempts = []
+        acquire = token_storage.lock_provider.acquire
+
+        def counting_acquire(provider_user, lease_seconds):
+            lock_attempts.append(provider_user)
+            return acquire(provider_user, lease_seconds)
+
+        token_storage.lock_provider.acquire = counting_acquire
+        release_fetch = threading.Event()
+
+        def slow_fence_fetch(prepped_key):
+            release_fetch.wait()
+            return self.fence_fetch(prepped_key)
+
+        results = []
+
+        def retrieve():
+            with datastore_emulator_utils.client.context():
+                results.append(token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key,
+                                                      fence_fetch_fn=slow_fence_fetch)[0])
+
+        threads = [threading.Thread(target=retrieve) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+        release_fetch.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(lock_attempts), 1)
+        self.assertEqual(self.fence_fetches, 1)
+        self.assertEqual(len(results), 5)
+        for key_json in results:
+            self.assertIsExpectedToken(key_json)
+
     def test_waits_for_lock_update(self):
         # Store a lock on the key.
         FenceServiceAccount(key=self.fsa_key, key_json=None, expires_at=None,
@@ -100,15 +176,130 @@ class FenceTokenStorageTestCase(unittest.TestCase):
         self.assertEqual(key_json, "updated")
         self.assertEqual(self.fence_fetches, 0)
 
-    def test_waits_for_lock_no_update_throws(self):
+    def test_wait_for_lock_gives_up_at_deadline(self):
+        # Store a lock on the key that outlives the wait deadline.
+        FenceServiceAccount(key=self.fsa_key, key_json=None, expires_at=None,
+                            update_lock_timeout=datetime.datetime.now() + datetime.timedelta(minutes=1)).put()
+
+        token_storage = FenceTokenStorage(wait_deadline=1)
+        start = time.time()
+        with self.assertRaises(ServiceAccountNotUpdatedException):
+            token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key, fence_fetch_fn=self.fence_fetch)
+        self.assertLess(time.time() - start, 5)
+
+    def test_waiter_woken_by_update_in_same_process(self):
+        token_storage = FenceTokenStorage(wait_initial_interval=10, wait_max_interval=10)
+        fetch_started = threading.Event()
+        release_fetch = threading.Event()
+
+        def slow_fence_fetch(prepped_key):
+            fetch_started.set()
+            release_fetch.wait()
+            return self.fence_fetch(prepped_key)
+
+        def holder():
+            with datastore_emulator_utils.client.context():
+                token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key, fence_fetch_fn=slow_fence_fetch)
+
+        holder_thread = threading.Thread(target=holder)
+        holder_thread.start()
+        fetch_started.wait()
+        threading.Timer(0.5, release_fetch.set).start()
+
+        start = time.time()
+        (key_json, _) = token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key,
+                                               fence_fetch_fn=self.fence_fetch)
+        holder_thread.join()
+
+        self.assertIsExpectedToken(key_json)
+        self.assertEqual(self.fence_fetches, 1)
+        # Woken by the holder rather than sleeping through the 10 second backoff.
+        self.assertLess(time.time() - start, 5)
+
+    def test_nonblocking_retrieve_while_locked_throws(self):
+        FenceServiceAccount(key=self.fsa_key, key_json=None, expires_at=None,
+                            update_lock_timeout=datetime.datetime.now() + datetime.timedelta(minutes=1)).put()
+
+        token_storage = FenceTokenStorage()
+        start = time.time()
+        with self.assertRaises(ServiceAccountUpdateInProgressException):
+            token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key, fence_fetch_fn=self.fence_fetch,
+                                   wait=False)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(self.fence_fetches, 0)
+
+    def test_waits_for_lock_no_update_retries(self):
         # Store a lock on the key, but let the lock expire without setting a value.
         FenceServiceAccount(key=self.fsa_key, key_json=None, expires_at=None,
                             update_lock_timeout=datetime.datetime.now() + datetime.timedelta(seconds=1)).put()
 
         token_storage = FenceTokenStorage()
+        (key_json, _) = token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key,
+                                               fence_fetch_fn=self.fence_fetch)
+
+        self.assertIsExpectedToken(key_json)
+        self.assertEqual(self.fence_fetches, 1)
+        self.assertEqual(token_storage.stats()["lock_retries"], 1)
+
+    def test_waits_for_lock_no_update_without_retries_throws(self):
+        # Store a lock on the key, but let the lock expire without setting a value.
+        FenceServiceAccount(key=self.fsa_key, key_json=None, expires_at=None,
+                            update_lock_timeout=datetime.datetime.now() + datetime.timedelta(seconds=1)).put()
+
+        token_storage = FenceTokenStorage(max_lock_retries=0)
         with self.assertRaises(ServiceAccountNotUpdatedException):
-            print(token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key,
-                                         fence_fetch_fn=self.fence_fetch))
+            token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key, fence_fetch_fn=self.fence_fetch)
+
+    def test_lease_extended_during_slow_fetch(self):
+        token_storage = FenceTokenStorage(lock_lease_seconds=0.6)
+
+        def slow_fence_fetch(prepped_key):
+            time.sleep(1.5)
+            self.assertTrue(token_storage.lock_provider.is_locked(self.provider_user))
+            return self.fence_fetch(prepped_key)
+
+        (key_json, _) = token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key,
+                                               fence_fetch_fn=slow_fence_fetch)
+
+        self.assertIsExpectedToken(key_json)
+        self.assertGreater(token_storage.stats()["lease_extensions"], 0)
+        self.assertEqual(token_storage.stats()["lease_extension_failures"], 0)
+
+    def test_create_with_redis_lock_provider(self):
+        lock_provider = RedisLockProvider(FakeRedis())
+        token_storage = FenceTokenStorage(lock_provider=lock_provider)
+
+        (key_json, _) = token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key,
+                                               fence_fetch_fn=self.fence_fetch)
+
+        self.assertIsExpectedToken(key_json)
+        self.assertEqual(self.fence_fetches, 1)
+        self.assertFalse(lock_provider.is_locked(self.provider_user))
+
+    def test_waits_for_redis_lock_no_update_retries(self):
+        lock_provider = RedisLockProvider(FakeRedis())
+        lock_provider.acquire(self.provider_user, 1)
+
+        token_storage = FenceTokenStorage(lock_provider=lock_provider)
+        (key_json, _) = token_storage.retrieve(self.provider_user, prep_key_fn=self.prep_key,
+                                               fence_fetch_fn=self.fence_fetch)
+        self.assertIsExpectedToken(key_json)
+        self.assertEqual(self.fence_fetches, 1)
+
+    def test_datastore_lock_provider(self):
+        lock_provider = DatastoreLockProvider()
+
+        token = lock_provider.acquire(self.provider_user, 30)
+        self.assertIsNotNone(token)
+        self.assertTrue(lock_provider.is_locked(self.provider_user))
+        self.assertIsNone(lock_provider.acquire(self.provider_user, 30))
+        self.assertFalse(lock_provider.extend(self.provider_user, "other_token", 30))
+        self.assertTrue(lock_provider.extend(self.provider_user, token, 60))
+        self.assertFalse(lock_provider.release(self.provider_user, "other_token"))
+
+        self.assertTrue(lock_provider.release(self.provider_user, token))
+        self.assertFalse(lock_provider.is_locked(self.provider_user))
+        self.assertIsNotNone(lock_provider.acquire(self.provider_user, 30))
 
     def test_delete(self):
         token_storage = FenceTokenStorage()
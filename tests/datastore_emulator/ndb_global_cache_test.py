@@ -0,0 +1,70 @@
+import os
+import threading
+import unittest
+import uuid
+from datetime import datetime
+
+import redis
+import requests
+from google.cloud import ndb
+from google.cloud.ndb import global_cache
+
+from bond_app.fence_token_storage import DatastoreLockProvider, ProviderUser
+from bond_app.ndb_global_cache import ModelCachePolicy
+from bond_app.token_store import TokenStore
+from tests.datastore_emulator import datastore_emulator_utils
+
+
+@unittest.skipUnless(os.environ.get('REDIS_HOST'), "set REDIS_HOST to test against a local Redis")
+class NdbGlobalCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        redis_client = redis.Redis(host=os.environ['REDIS_HOST'], port=int(os.environ.get('REDIS_PORT', 6379)))
+        policy = ModelCachePolicy()
+        ndb_context = datastore_emulator_utils.client.context(global_cache=global_cache.RedisCache(redis_client),
+                                                              global_cache_policy=policy.cache,
+                                                              global_cache_timeout_policy=policy.timeout)
+        ndb_context.__enter__()
+        self.addCleanup(ndb_context.__exit__, None, None, None)
+        # Only the global cache, not the per context cache, should answer repeated reads.
+        ndb.get_context().set_cache_policy(False)
+        self.addCleanup(requests.post, 'http://0.0.0.0:8432/reset')
+        # Entities are unique per test so that cache entries left in Redis by earlier runs are not read.
+        self.user_id = str(uuid.uuid4())
+
+    def save_without_global_cache(self, token):
+        """Save a refresh token from a context without the global cache, so the cache is not invalidated."""
+        def save():
+            with datastore_emulator_utils.client.context(global_cache=None):
+                TokenStore().save(self.user_id, token, datetime.now(), "Ralph", "fence")
+
+        thread = threading.Thread(target=save)
+        thread.start()
+        thread.join()
+
+    def test_refresh_token_lookups_cached(self):
+        token_store = TokenStore()
+        token_store.save(self.user_id, "first", datetime.now(), "Ralph", "fence")
+        self.assertEqual(token_store.lookup(self.user_id, "fence").token, "first")
+
+        # A write that bypasses the global cache is not seen, showing the lookup was answered by the cache.
+        self.save_without_global_cache("bypassed")
+        self.assertEqual(token_store.lookup(self.user_id, "fence").token, "first")
+
+        # Writes through the global cache invalidate it.
+        token_store.save(self.user_id, "second", datetime.now(), "Ralph", "fence")
+        self.assertEqual(token_store.lookup(self.user_id, "fence").token, "second")
+        token_store.delete(self.user_id, "fence")
+        self.assertIsNone(token_store.lookup(self.user_id, "fence"))
+
+    def test_fence_key_locks_with_global_cache(self):
+        lock_provider = DatastoreLockProvider()
+        provider_user = ProviderUser(provider_name="fence", user_id=self.user_id)
+
+        token = lock_provider.acquire(provider_user, 30)
+        self.assertIsNotNone(token)
+        self.assertTrue(lock_provider.is_locked(provider_user))
+        self.assertIsNone(lock_provider.acquire(provider_user, 30))
+
+        self.assertTrue(lock_provider.release(provider_user, token))
+        self.assertFalse(lock_provider.is_locked(provider_user))
+        self.assertIsNotNone(lock_provider.acquire(provider_user, 30))
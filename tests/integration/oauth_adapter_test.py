@@ -35,7 +35,7 @@ class OauthAdapterTestCase(unittest.TestCase):
     def init_oauth_adapters(cls, config):
         oauth_adapters = {}
         for section in config.sections():
-            if section != "sam" and section != "bond_accepted":
+            if util.is_provider_section(section):
                 client_id, client_secret = util.get_provider_secrets(config, section)
                 open_id_config_url = config.get(section, 'OPEN_ID_CONFIG_URL')
                 open_id_config = OpenIdConfig(section, open_id_config_url, FakeCacheApi())
@@ -1,4 +1,5 @@
 import hashlib
+import threading
 import unittest
 
 from werkzeug import exceptions
@@ -6,6 +7,7 @@ from mock import MagicMock
 
 from bond_app.authentication import Authentication, AuthenticationConfig, UserInfo
 from bond_app.sam_api import SamApi, SamKeys
+from bond_app.single_flight import CacheLease
 from tests.unit.fake_cache_api import FakeCacheApi
 import time
 
@@ -98,6 +100,125 @@ class AuthenticationTestCase(unittest.TestCase):
             self.auth.auth_user(TestRequestState('bearer ' + token))
 
 
+    def test_sam_unauthorized_cached(self):
+        token = "testtoken"
+        self.sam_api.user_info = MagicMock(side_effect=exceptions.Unauthorized("Could not authenticate with Sam"))
+
+        for _ in range(3):
+            with self.assertRaises(exceptions.Unauthorized):
+                self.auth.auth_user(TestRequestState('bearer ' + token))
+        self.sam_api.user_info.assert_called_once_with(token)
+
+    def test_sam_user_not_found_cached(self):
+        token = "testtoken"
+        self.sam_api.user_info = MagicMock(return_value=None)
+
+        for _ in range(3):
+            with self.assertRaises(exceptions.Unauthorized):
+                self.auth.auth_user(TestRequestState('bearer ' + token))
+        self.sam_api.user_info.assert_called_once_with(token)
+
+    def test_sam_disabled_user_cached(self):
+        token = "testtoken"
+        disabled_user_info = self._generate_sam_user_info("193481341723041", "foo@bar.com", False)
+        self.sam_api.user_info = MagicMock(side_effect=exceptions.Unauthorized(
+            'User is disabled. User info from Sam: {}'.format(disabled_user_info)))
+
+        for _ in range(3):
+            with self.assertRaises(exceptions.Unauthorized):
+                self.auth.auth_user(TestRequestState('bearer ' + token))
+        self.sam_api.user_info.assert_called_once_with(token)
+
+    def test_sam_failure_cache_expires(self):
+        token = "testtoken"
+        sam_user_info = self._generate_sam_user_info("193481341723041", "foo@bar.com", True)
+        auth = Authentication(AuthenticationConfig(600, negative_token_life=1), self.cache_api, self.sam_api)
+        self.sam_api.user_info = MagicMock(side_effect=exceptions.Unauthorized("Sam error!"))
+        with self.assertRaises(exceptions.Unauthorized):
+            auth.auth_user(TestRequestState('bearer ' + token))
+
+        # After the negative entry expires, Sam is asked again.
+        time.sleep(2)
+        self.sam_api.user_info = MagicMock(return_value=sam_user_info)
+        self.assertEqual("193481341723041", auth.auth_user(TestRequestState('bearer ' + token)))
+
+    def test_sam_failure_not_cached_when_disabled(self):
+        token = "testtoken"
+        auth = Authentication(AuthenticationConfig(600, negative_token_life=0), self.cache_api, self.sam_api)
+        self.sam_api.user_info = MagicMock(side_effect=exceptions.Unauthorized("Sam error!"))
+
+        for _ in range(2):
+            with self.assertRaises(exceptions.Unauthorized):
+                auth.auth_user(TestRequestState('bearer ' + token))
+        self.assertEqual(self.sam_api.user_info.call_count, 2)
+
+    def test_sam_server_error_not_cached(self):
+        token = "testtoken"
+        self.sam_api.user_info = MagicMock(side_effect=exceptions.InternalServerError("Sam down"))
+
+        for _ in range(2):
+            with self.assertRaises(exceptions.InternalServerError):
+                self.auth.auth_user(TestRequestState('bearer ' + token))
+        self.assertEqual(self.sam_api.user_info.call_count, 2)
+
+    def test_concurrent_misses_share_sam_lookup(self):
+        token = "testtoken"
+        sam_user_info = self._generate_sam_user_info("193481341723041", "foo@bar.com", True)
+        release = threading.Event()
+
+        def slow_user_info(_):
+            release.wait()
+            return sam_user_info
+
+        self.sam_api.user_info = MagicMock(side_effect=slow_user_info)
+
+        sam_user_ids = []
+        threads = [threading.Thread(target=lambda: sam_user_ids.append(
+            self.auth.auth_user(TestRequestState('bearer ' + token)))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sam_user_ids, ["193481341723041"] * 5)
+        self.sam_api.user_info.assert_called_once_with(token)
+
+    def test_waits_for_sam_lookup_lease_holder(self):
+        token = "testtoken"
+        cache_key = hashlib.sha256(str.encode(token)).hexdigest()
+        sam_user_info = self._generate_sam_user_info("193481341723041", "foo@bar.com", True)
+        lease = CacheLease(self.cache_api, "SamUserInfoLease", expires_in=5, poll_interval=0.01)
+        auth = Authentication(AuthenticationConfig(600), self.cache_api, self.sam_api, lease)
+        self.sam_api.user_info = MagicMock(side_effect=Exception("shouldn't be called"))
+
+        # Another process holds the lease and caches the result shortly after.
+        lease_token = lease.acquire(cache_key)
+
+        def other_process_lookup():
+            time.sleep(0.2)
+            self.cache_api.add(namespace="SamUserInfo", key=cache_key, value=sam_user_info, expires_in=600)
+            lease.release(cache_key, lease_token)
+
+        threading.Thread(target=other_process_lookup).start()
+
+        self.assertEqual("193481341723041", auth.auth_user(TestRequestState('bearer ' + token)))
+
+    def test_looks_up_sam_after_lease_expires(self):
+        token = "testtoken"
+        cache_key = hashlib.sha256(str.encode(token)).hexdigest()
+        sam_user_info = self._generate_sam_user_info("193481341723041", "foo@bar.com", True)
+        lease = CacheLease(self.cache_api, "SamUserInfoLease", expires_in=0.5, poll_interval=0.01)
+        auth = Authentication(AuthenticationConfig(600), self.cache_api, self.sam_api, lease)
+        self.sam_api.user_info = MagicMock(return_value=sam_user_info)
+
+        # Another process took the lease but never caches a result.
+        lease.acquire(cache_key)
+
+        self.assertEqual("193481341723041", auth.auth_user(TestRequestState('bearer ' + token)))
+        self.sam_api.user_info.assert_called_once_with(token)
+
     def test_missing_auth_header(self):
         # request should return 401 for no auth token
         with self.assertRaises(exceptions.Unauthorized):
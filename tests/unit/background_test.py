@@ -0,0 +1,62 @@
+import threading
+import unittest
+
+from bond_app.background import BackgroundExecutor
+
+
+class BackgroundExecutorTestCase(unittest.TestCase):
+
+    def test_submit_runs_function(self):
+        executor = BackgroundExecutor(max_workers=2)
+        results = []
+
+        self.assertTrue(executor.submit(results.append, "done"))
+        executor.join()
+
+        self.assertEqual(["done"], results)
+
+    def test_exception_does_not_stop_worker(self):
+        executor = BackgroundExecutor(max_workers=1)
+        results = []
+
+        def fail():
+            raise Exception("boom")
+
+        executor.submit(fail)
+        executor.submit(results.append, "done")
+        executor.join()
+
+        self.assertEqual(["done"], results)
+
+    def test_submit_dropped_when_queue_full(self):
+        executor = BackgroundExecutor(max_workers=1, max_queue_size=1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        executor.submit(block)
+        started.wait()
+        self.assertTrue(executor.submit(lambda: None))
+        self.assertFalse(executor.submit(lambda: None))
+        self.assertEqual(1, executor.dropped)
+        release.set()
+        executor.join()
+
+    def test_runs_in_context(self):
+        entered = []
+
+        class Context:
+            def __enter__(self):
+                entered.append(True)
+
+            def __exit__(self, *args):
+                return False
+
+        executor = BackgroundExecutor(context_factory=Context)
+        executor.submit(lambda: None)
+        executor.join()
+
+        self.assertEqual([True], entered)
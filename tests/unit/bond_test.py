@@ -1,18 +1,23 @@
 import base64
 import json
+import threading
+import time
 import unittest
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import jwt
 from urllib.parse import urlparse, parse_qs
 from mock import MagicMock
 from werkzeug import exceptions
 
-from bond_app.bond import Bond, FenceKeys
+from bond_app.bond import Bond, FenceKeys, FenceAccessToken
 from bond_app.fence_api import FenceApi
 from bond_app.fence_token_vending import FenceTokenVendingMachine
+from bond_app.local_cache_api import LocalCacheApi
 from bond_app.oauth_adapter import OauthAdapter
+from bond_app.single_flight import CacheLease
+from bond_app.tiered_cache_api import TieredCacheApi
 from tests.unit.fake_oauth2_state_store import FakeOAuth2StateStore
 from tests.unit.fake_token_store import FakeTokenStore
 from tests.unit.fake_cache_api import FakeCacheApi
@@ -363,6 +368,240 @@ class BondTestCase(unittest.TestCase):
         access_token, expires_at = bond.get_access_token(self.user_id)
         self.assertEqual(access_token_renewed, access_token)
 
+    def test_unlink_seen_by_other_workers_with_local_tier(self):
+        shared_cache_api = FakeCacheApi()
+        worker_cache_apis = [TieredCacheApi([LocalCacheApi(), shared_cache_api]) for _ in range(2)]
+        # As in routes.create_provider, Bond is given the shared cache, not the worker's tiered one.
+        unlinking_bond, reading_bond = [self._bond_with_cache(shared_cache_api) for _ in worker_cache_apis]
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+        unlinking_bond.oauth_adapter.refresh_access_token = MagicMock(return_value={
+            FenceKeys.ACCESS_TOKEN: self.fake_access_token,
+            FenceKeys.EXPIRES_AT: datetime.now().timestamp() + 3600})
+        unlinking_bond.get_access_token(self.user_id)
+        self.assertEqual(self.fake_access_token, reading_bond.get_access_token(self.user_id)[0])
+        # Had it been read through the reading worker's tiered cache, the token would now be in its local tier.
+        access_tokens_namespace = f"{provider_name}:AccessTokens"
+        self.assertIsNotNone(worker_cache_apis[1].get(self.user_id, namespace=access_tokens_namespace))
+
+        unlinking_bond.unlink_account(self.user_id)
+
+        self.assertIsNotNone(worker_cache_apis[1].tiers[0].get(self.user_id, namespace=access_tokens_namespace))
+        with self.assertRaises(exceptions.NotFound):
+            reading_bond.get_access_token(self.user_id)
+
+    def test_unlink_deletes_cached_tokens_in_one_call(self):
+        cache_api = MagicMock(wraps=FakeCacheApi())
+        bond = self._bond_with_cache(cache_api)
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+        access_tokens_namespace = f"{provider_name}:AccessTokens"
+        service_account_tokens_namespace = f"{provider_name}:ServiceAccountAccessTokens"
+        cache_api.add(self.user_id, "access_token", namespace=access_tokens_namespace)
+        cache_api.add(self.user_id, {"scopes": "sa_token"}, namespace=service_account_tokens_namespace)
+
+        bond.unlink_account(self.user_id)
+
+        cache_api.delete.assert_not_called()
+        cache_api.delete_multi.assert_called_once()
+        self.assertIsNone(cache_api.get(self.user_id, namespace=access_tokens_namespace))
+        self.assertIsNone(cache_api.get(self.user_id, namespace=service_account_tokens_namespace))
+
+    def _bond_with_cache(self, cache_api):
+        return Bond(self.bond.oauth_adapter, self.bond.fence_api, cache_api, self.refresh_token_store,
+                    self.oauth2_state_store,
+                    FenceTokenVendingMachine(self.bond.fence_api, cache_api, self.refresh_token_store,
+                                             self.bond.oauth_adapter, provider_name, FakeFenceTokenStorage()),
+                    provider_name, "/context/user/name", {})
+
+    def test_get_access_token_from_cache_skips_token_store(self):
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+        self.bond.oauth_adapter.refresh_access_token = MagicMock(return_value={
+            FenceKeys.ACCESS_TOKEN: self.fake_access_token,
+            FenceKeys.EXPIRES_AT: datetime.now().timestamp() + 3600})
+        self.bond.get_access_token(self.user_id)
+
+        self.refresh_token_store.lookup = MagicMock(side_effect=Exception("shouldn't be called"))
+        access_token, _ = self.bond.get_access_token(self.user_id)
+        self.assertEqual(self.fake_access_token, access_token)
+        self.bond.oauth_adapter.refresh_access_token.assert_called_once()
+
+    def test_get_access_token_not_cached_when_unlinked_during_refresh(self):
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+
+        def refresh_and_unlink(_):
+            # Another request unlinks the account while this one is refreshing the access token.
+            self.bond.unlink_account(self.user_id)
+            return {FenceKeys.ACCESS_TOKEN: self.fake_access_token,
+                    FenceKeys.EXPIRES_AT: datetime.now().timestamp() + 3600}
+
+        self.bond.oauth_adapter.refresh_access_token = MagicMock(side_effect=refresh_and_unlink)
+        self.bond.get_access_token(self.user_id)
+
+        self.assertIsNone(self.bond.cache_api.get(self.user_id, namespace=f"{provider_name}:AccessTokens"))
+        with self.assertRaises(exceptions.NotFound):
+            self.bond.get_access_token(self.user_id)
+
+    def test_get_access_token_cached_after_relink(self):
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+        self.bond.unlink_account(self.user_id)
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+        self.bond.oauth_adapter.refresh_access_token = MagicMock(return_value={
+            FenceKeys.ACCESS_TOKEN: self.fake_access_token,
+            FenceKeys.EXPIRES_AT: datetime.now().timestamp() + 3600})
+
+        self.bond.get_access_token(self.user_id)
+
+        cached_access_token = self.bond.cache_api.get(self.user_id, namespace=f"{provider_name}:AccessTokens")
+        self.assertEqual(self.fake_access_token, cached_access_token.value)
+
+    def test_concurrent_get_access_token_shares_refresh(self):
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+        release = threading.Event()
+
+        def slow_refresh(_):
+            release.wait()
+            return {FenceKeys.ACCESS_TOKEN: self.fake_access_token,
+                    FenceKeys.EXPIRES_AT: datetime.now().timestamp() + 3600}
+
+        self.bond.oauth_adapter.refresh_access_token = MagicMock(side_effect=slow_refresh)
+        access_tokens = []
+        threads = [threading.Thread(target=lambda: access_tokens.append(self.bond.get_access_token(self.user_id)[0]))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(access_tokens, [self.fake_access_token] * 5)
+        self.bond.oauth_adapter.refresh_access_token.assert_called_once()
+
+    def test_get_access_token_waits_for_refresh_lease_holder(self):
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+        self.bond.refresh_lease = CacheLease(self.bond.cache_api, "lease", expires_in=5, poll_interval=0.01)
+        self.bond.oauth_adapter.refresh_access_token = MagicMock(side_effect=Exception("shouldn't be called"))
+
+        # Another process holds the lease and caches its token shortly after.
+        lease_token = self.bond.refresh_lease.acquire(self.user_id)
+        expires_at = datetime.fromtimestamp(datetime.now().timestamp() + 3600)
+
+        def other_process_refresh():
+            time.sleep(0.2)
+            self.bond.cache_api.add(self.user_id, FenceAccessToken("other_token", expires_at), expires_in=3000,
+                                    namespace=f"{provider_name}:AccessTokens")
+            self.bond.refresh_lease.release(self.user_id, lease_token)
+
+        threading.Thread(target=other_process_refresh).start()
+
+        self.assertEqual(("other_token", expires_at), self.bond.get_access_token(self.user_id))
+
+    def test_get_access_token_refreshes_after_lease_expires(self):
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+        self.bond.refresh_lease = CacheLease(self.bond.cache_api, "lease", expires_in=0.5, poll_interval=0.01)
+        self.bond.oauth_adapter.refresh_access_token = MagicMock(return_value={
+            FenceKeys.ACCESS_TOKEN: self.fake_access_token,
+            FenceKeys.EXPIRES_AT: datetime.now().timestamp() + 3600})
+
+        # Another process took the lease but never caches a token.
+        self.bond.refresh_lease.acquire(self.user_id)
+
+        access_token, _ = self.bond.get_access_token(self.user_id)
+        self.assertEqual(self.fake_access_token, access_token)
+        self.bond.oauth_adapter.refresh_access_token.assert_called_once()
+
+    def test_get_access_token_missed_during_background_refresh(self):
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+        self.bond.refresh_lease = CacheLease(self.bond.cache_api, "lease", expires_in=5, poll_interval=0.01)
+        expires_at = datetime.fromtimestamp(datetime.now().timestamp() + 3600)
+        # Another process holds the lease.
+        lease_token = self.bond.refresh_lease.acquire(self.user_id)
+        acquire = self.bond.refresh_lease.acquire
+        background_acquiring = threading.Event()
+        request_joined = threading.Event()
+
+        def slow_first_acquire(sam_user_id):
+            if not background_acquiring.is_set():
+                background_acquiring.set()
+                request_joined.wait(5)
+            return acquire(sam_user_id)
+
+        self.bond.refresh_lease.acquire = MagicMock(side_effect=slow_first_acquire)
+        background_results = []
+        background = threading.Thread(target=lambda: background_results.append(
+            self.bond.refresh_access_token(self.user_id, refreshed_after=datetime.now())))
+        background.start()
+        background_acquiring.wait(5)
+
+        request_results = []
+        request = threading.Thread(target=lambda: request_results.append(self.bond.get_access_token(self.user_id)))
+        request.start()
+        # Give the request time to miss the cache and join the background refresh.
+        time.sleep(0.1)
+        request_joined.set()
+        background.join(5)
+        self.bond.cache_api.add(self.user_id, FenceAccessToken("other_token", expires_at), expires_in=3000,
+                                namespace=f"{provider_name}:AccessTokens")
+        self.bond.refresh_lease.release(self.user_id, lease_token)
+        request.join(5)
+
+        self.assertEqual([None], background_results)
+        self.assertEqual([("other_token", expires_at)], request_results)
+
+    def test_refresh_access_token_replaces_cached_token(self):
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+        self.bond.oauth_adapter.refresh_access_token = MagicMock(side_effect=[
+            {FenceKeys.ACCESS_TOKEN: "first_token", FenceKeys.EXPIRES_AT: datetime.now().timestamp() + 3600},
+            {FenceKeys.ACCESS_TOKEN: "second_token", FenceKeys.EXPIRES_AT: datetime.now().timestamp() + 3600}])
+        self.bond.get_access_token(self.user_id)
+
+        access_token = self.bond.refresh_access_token(self.user_id)
+
+        self.assertEqual("second_token", access_token.value)
+        self.assertEqual("second_token", self.bond.get_access_token(self.user_id)[0])
+
+    def test_refresh_access_token_skipped_while_lease_held(self):
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+        self.bond.refresh_lease = CacheLease(self.bond.cache_api, "lease", expires_in=5)
+        self.bond.oauth_adapter.refresh_access_token = MagicMock(side_effect=Exception("shouldn't be called"))
+        self.bond.refresh_lease.acquire(self.user_id)
+
+        self.assertIsNone(self.bond.refresh_access_token(self.user_id))
+
+    def test_refresh_access_token_skipped_if_refreshed_before_lease_taken(self):
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+        self.bond.oauth_adapter.refresh_access_token = MagicMock(side_effect=Exception("shouldn't be called"))
+        old_expires_at = datetime.now() + timedelta(seconds=30)
+        refreshed_token = FenceAccessToken("refreshed_token", datetime.now() + timedelta(hours=1))
+        lease = CacheLease(self.bond.cache_api, "lease", expires_in=5)
+        self.bond.refresh_lease = MagicMock()
+
+        def acquire(sam_user_id):
+            # The previous leaseholder caches its token just before releasing the lease to us.
+            self.bond.cache_api.add(sam_user_id, refreshed_token, expires_in=3600,
+                                    namespace=f"{provider_name}:AccessTokens")
+            return lease.acquire(sam_user_id)
+
+        self.bond.refresh_lease.acquire = MagicMock(side_effect=acquire)
+
+        access_token = self.bond.refresh_access_token(self.user_id, 0, refreshed_after=old_expires_at)
+
+        self.assertEqual("refreshed_token", access_token.value)
+        self.bond.refresh_lease.release.assert_called_once()
+
+    def test_get_access_token_tracked_for_refresh_ahead(self):
+        self.refresh_token_store.save(self.user_id, str(uuid.uuid4()), datetime.now(), self.name, provider_name)
+        expires_at_epoch = datetime.now().timestamp() + 3600
+        self.bond.oauth_adapter.refresh_access_token = MagicMock(return_value={
+            FenceKeys.ACCESS_TOKEN: self.fake_access_token, FenceKeys.EXPIRES_AT: expires_at_epoch})
+        self.bond.refresh_ahead_scheduler = MagicMock()
+
+        self.bond.get_access_token(self.user_id, refresh_threshold=300)
+        self.bond.get_access_token(self.user_id, refresh_threshold=300)
+
+        self.bond.refresh_ahead_scheduler.track.assert_called_with(
+            self.bond, self.user_id, datetime.fromtimestamp(expires_at_epoch), 300)
+        self.assertEqual(2, self.bond.refresh_ahead_scheduler.track.call_count)
+
     def test_revoke_link_does_not_exists(self):
         self.bond.unlink_account(self.user_id)
 
@@ -58,7 +58,50 @@ class CacheApiTest(object):
         self.assertIsNone(self.cache.delete('foo'))
         self.assertIsNone(self.cache.delete('foo', namespace='bar'))
 
+    def test_multi_values_retrieved(self):
+        self.assertEqual(self.cache.get_multi(['foo', 'bar']), {})
+
+        self.assertTrue(self.cache.add_multi({'foo': 42, 'bar': 24}))
+        self.assertTrue(self.cache.add_multi({'foo': 11, ('bar', 'qat'): 12}, namespace='baz'))
+
+        self.assertEqual(self.cache.get_multi(['foo', 'bar', 'abc']), {'foo': 42, 'bar': 24})
+        self.assertEqual(self.cache.get_multi(['foo', 'bar'], namespace='baz'), {'foo': 11})
+        self.assertEqual(self.cache.get_multi(['foo', ('bar', 'qat'), ('foo', None)], namespace='baz'),
+                         {'foo': 11, ('bar', 'qat'): 12, ('foo', None): 42})
+        self.assertEqual(self.cache.get('bar', namespace='qat'), 12)
+
+    def test_multi_empty(self):
+        self.assertEqual(self.cache.get_multi([]), {})
+        self.assertTrue(self.cache.add_multi({}))
+        self.assertIsNone(self.cache.delete_multi([]))
+
+    def test_multi_expiration(self):
+        self.assertTrue(self.cache.add_multi({'foo': 42, ('foo', 'bar'): 24}, expires_in=0.5))
+
+        self.assertEqual(self.cache.get_multi(['foo', ('foo', 'bar')]), {'foo': 42, ('foo', 'bar'): 24})
+        time.sleep(1)
+        self.assertEqual(self.cache.get_multi(['foo', ('foo', 'bar')]), {})
+
+    def test_multi_delete(self):
+        self.assertTrue(self.cache.add_multi({'foo': 42, 'bar': 24, ('foo', 'baz'): 11}))
+        self.assertIsNone(self.cache.delete_multi(['foo', ('foo', 'baz'), 'missing']))
+        self.assertEqual(self.cache.get_multi(['foo', 'bar', ('foo', 'baz')]), {'bar': 24})
+
 
 class FakeCacheApiTestCase(unittest.TestCase, CacheApiTest):
     def setUp(self):
         self.setUpCache(FakeCacheApi())
+
+
+class PickleBomb:
+    """Records being unpickled, standing in for a payload that runs code when it is."""
+    loaded = False
+
+    def __reduce__(self):
+        return _load_pickle_bomb, ()
+
+
+def _load_pickle_bomb():
+    PickleBomb.loaded = True
+    return PickleBomb()
+
@@ -0,0 +1,91 @@
+import datetime
+import pickle
+import unittest
+from dataclasses import dataclass
+
+from bond_app import cache_codec
+from bond_app.bond import FenceAccessToken
+from bond_app.cache_codec import CacheCodecError, JsonCacheCodec
+from bond_app.fence_token_vending import ServiceAccountAccessToken
+
+
+@dataclass
+class _Unregistered:
+    value: str
+
+
+@cache_codec.register("CacheCodecTest.Versioned", version=2,
+                      upgrade=lambda fields, version: {"name": fields["old_name"], "count": 0})
+@dataclass
+class _Versioned:
+    name: str
+    count: int
+
+
+class JsonCacheCodecTestCase(unittest.TestCase):
+    def setUp(self):
+        self.codec = JsonCacheCodec()
+
+    def assertRoundTrips(self, value):
+        self.assertEqual(self.codec.decode(self.codec.encode(value)), value)
+
+    def test_json_values(self):
+        self.assertRoundTrips(None)
+        self.assertRoundTrips("foo")
+        self.assertRoundTrips(42)
+        self.assertRoundTrips(1.5)
+        self.assertRoundTrips(True)
+        self.assertRoundTrips({"userSubjectId": "123", "userEmail": "foo@bar.com", "enabled": {"google": True}})
+        self.assertRoundTrips([{"ok": True, "message": "", "subsystem": "sam"}])
+
+    def test_tagged_values(self):
+        self.assertRoundTrips(("foo", 1))
+        self.assertRoundTrips(b"\x00\xffbytes")
+        self.assertRoundTrips(datetime.datetime(2020, 1, 2, 3, 4, 5, 6))
+        self.assertRoundTrips(datetime.datetime(2020, 1, 2, tzinfo=datetime.timezone.utc))
+        self.assertRoundTrips({1: "int key", ("a", "b"): "tuple key"})
+        self.assertRoundTrips({"__t": "datetime", "v": "not a datetime"})
+
+    def test_registered_dataclasses(self):
+        expires_at = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        self.assertRoundTrips(FenceAccessToken("token", expires_at, "link version"))
+        self.assertRoundTrips({"scope": ServiceAccountAccessToken("token", expires_at)})
+
+    def test_unregistered_type_not_encoded(self):
+        with self.assertRaises(CacheCodecError):
+            self.codec.encode(_Unregistered("foo"))
+        with self.assertRaises(CacheCodecError):
+            self.codec.encode({"foo": object()})
+
+    def test_old_schema_version_upgraded(self):
+        encoded = self.codec.encode(_Versioned("foo", 1)).replace(b'"s":2', b'"s":1').replace(b'"name"', b'"old_name"')
+        self.assertEqual(self.codec.decode(encoded), _Versioned("foo", 0))
+
+    def test_newer_schema_version_not_decoded(self):
+        encoded = self.codec.encode(_Versioned("foo", 1)).replace(b'"s":2', b'"s":3')
+        with self.assertRaises(CacheCodecError):
+            self.codec.decode(encoded)
+
+    def test_unknown_format_not_decoded(self):
+        with self.assertRaises(CacheCodecError):
+            self.codec.decode(b"")
+        with self.assertRaises(CacheCodecError):
+            self.codec.decode(bytes((99, 0)) + b"{}")
+        with self.assertRaises(CacheCodecError):
+            self.codec.decode(pickle.dumps({"foo": "bar"}))
+
+    def test_large_values_compressed(self):
+        value = {"key": "x" * 10000}
+        compressed = self.codec.encode(value)
+        uncompressed = JsonCacheCodec(compression_threshold=None).encode(value)
+
+        self.assertLess(len(compressed), len(uncompressed))
+        self.assertEqual(self.codec.decode(compressed), value)
+        self.assertEqual(self.codec.decode(uncompressed), value)
+
+    def test_small_values_not_compressed(self):
+        self.assertEqual(self.codec.encode("foo"), bytes((1, 0)) + b'"foo"')
+
+    def test_tag_registered_once(self):
+        with self.assertRaises(ValueError):
+            cache_codec.register("FenceAccessToken")(_Unregistered)
@@ -0,0 +1,17 @@
+class FakeExecutor:
+    """A BackgroundExecutor stand-in that runs submitted functions when told to, or rejects them when full."""
+
+    def __init__(self, full=False):
+        self.full = full
+        self.submitted = []
+
+    def submit(self, fn, *args, **kwargs):
+        if self.full:
+            return False
+        self.submitted.append((fn, args, kwargs))
+        return True
+
+    def run(self):
+        submitted, self.submitted = self.submitted, []
+        for fn, args, kwargs in submitted:
+            fn(*args, **kwargs)
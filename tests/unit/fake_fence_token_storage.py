@@ -28,7 +28,7 @@ class FakeFenceTokenStorage:
         account = self.accounts.pop(provider_user)
         return account.key_json
 
-    def retrieve(self, provider_user, prep_key_fn, fence_fetch_fn):
+    def retrieve(self, provider_user, prep_key_fn, fence_fetch_fn, wait=True):
         account_info = None
         if provider_user in self.accounts:
             account_info = self.accounts[provider_user]
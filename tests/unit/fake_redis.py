@@ -0,0 +1,117 @@
+import threading
+import time
+
+from bond_app import lock_provider
+
+
+class FakeRedis:
+    """
+    An in-memory stand-in for the parts of redis.Redis that Bond uses, for testing. Values are stored as bytes, as
+    Redis returns them. Lua scripts cannot be run, so register_script only supports the scripts Bond registers, which
+    are emulated in Python.
+    """
+
+    def __init__(self):
+        # Dict from key to (bytes value, expiration time in seconds since the epoch or None).
+        self.data = {}
+        self._lock = threading.Lock()
+        self._scripts = {
+            lock_provider._RELEASE_SCRIPT: self._release_script,
+            lock_provider._EXTEND_SCRIPT: self._extend_script,
+        }
+
+    def set(self, name, value, ex=None, px=None, nx=False):
+        with self._lock:
+            if nx and self._get(name) is not None:
+                return None
+            expires_at = time.time() + px / 1000 if px else time.time() + ex if ex else None
+            self.data[name] = (self._encode(value), expires_at)
+            return True
+
+    def get(self, name):
+        with self._lock:
+            return self._get(name)
+
+    def mget(self, keys):
+        with self._lock:
+            return [self._get(name) for name in keys]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def delete(self, *names):
+        with self._lock:
+            deleted = 0
+            for name in names:
+                if self._get(name) is not None:
+                    deleted += 1
+                self.data.pop(name, None)
+            return deleted
+
+    def exists(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self._get(name) is not None)
+
+    def pexpire(self, name, time_ms):
+        with self._lock:
+            value = self._get(name)
+            if value is None:
+                return False
+            self.data[name] = (value, time.time() + int(time_ms) / 1000)
+            return True
+
+    def register_script(self, script):
+        script_fn = self._scripts[script]
+
+        def run(keys=(), args=()):
+            with self._lock:
+                return script_fn(keys, args)
+
+        return run
+
+    def _get(self, name):
+        value, expires_at = self.data.get(name, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self.data[name]
+            return None
+        return value
+
+    def _release_script(self, keys, args):
+        if self._get(keys[0]) == self._encode(args[0]):
+            del self.data[keys[0]]
+            return 1
+        return 0
+
+    def _extend_script(self, keys, args):
+        value = self._get(keys[0])
+        if value == self._encode(args[0]):
+            self.data[keys[0]] = (value, time.time() + int(args[1]) / 1000)
+            return 1
+        return 0
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode('utf-8')
+
+
+class FakePipeline:
+    """Buffers the commands of a FakeRedis pipeline and runs them on execute, as redis.client.Pipeline does."""
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self._commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis_client, name)
+
+        def buffer(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+
+        return buffer
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        return [command(*args, **kwargs) for command, args, kwargs in commands]
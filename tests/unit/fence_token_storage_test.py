@@ -0,0 +1,85 @@
+import datetime
+import time
+import unittest
+
+from mock import MagicMock, patch
+
+from bond_app.fence_token_storage import FenceTokenStorage, ProviderUser, ServiceAccountNotUpdatedException, \
+    ServiceAccountUpdateInProgressException
+
+
+class FenceTokenStorageHeartbeatTestCase(unittest.TestCase):
+    """Tests of extending the update lock while fetching from fence, which does not touch Datastore."""
+
+    def setUp(self):
+        self.lock_provider = MagicMock()
+        self.storage = FenceTokenStorage(lock_provider=self.lock_provider, lock_lease_seconds=0.15)
+        self.provider_user = ProviderUser(provider_name="fence", user_id="user")
+
+    def slow_fetch(self, prepped_key):
+        # Long enough for two extensions.
+        time.sleep(0.12)
+        return "key_json"
+
+    def test_extends_lock_while_fetching(self):
+        self.lock_provider.extend = MagicMock(return_value=True)
+
+        key_json = self.storage._fetch_with_heartbeat(self.provider_user, "token", "prepped", self.slow_fetch)
+
+        self.assertEqual("key_json", key_json)
+        self.assertGreaterEqual(self.storage.stats()["lease_extensions"], 1)
+        self.assertEqual(0, self.storage.stats()["lease_extension_failures"])
+
+    @patch("bond_app.fence_token_storage.FenceServiceAccount")
+    def test_discards_key_when_lock_lost(self, fence_service_account):
+        # Another process took the lock after the lease lapsed.
+        self.lock_provider.extend = MagicMock(return_value=False)
+
+        with self.assertRaises(ServiceAccountNotUpdatedException):
+            self.storage._fetch_and_store_service_account(self.provider_user, "token", "prepped", self.slow_fetch)
+
+        fence_service_account.assert_not_called()
+        self.lock_provider.release.assert_called_once_with(self.provider_user, "token")
+        self.assertEqual(1, self.storage.stats()["lost_lock_discards"])
+
+    def test_keeps_key_when_lock_still_held_after_failed_extension(self):
+        # A transient error extending the lease, while the lock is still held.
+        self.lock_provider.extend = MagicMock(side_effect=[Exception("timeout")] + [True] * 10)
+
+        key_json = self.storage._fetch_with_heartbeat(self.provider_user, "token", "prepped", self.slow_fetch)
+
+        self.assertEqual("key_json", key_json)
+        self.assertEqual(1, self.storage.stats()["lease_extension_failures"])
+        self.assertEqual(0, self.storage.stats()["lost_lock_discards"])
+
+
+@patch.object(FenceTokenStorage, "_build_fence_service_account_key")
+class FenceTokenStorageLockedTestCase(unittest.TestCase):
+    """Tests that a request that will not wait for the update lock does not prep a key while someone else holds it."""
+
+    def setUp(self):
+        self.lock_provider = MagicMock()
+        self.lock_provider.is_locked = MagicMock(return_value=True)
+        self.lock_provider.acquire = MagicMock(return_value=None)
+        self.storage = FenceTokenStorage(lock_provider=self.lock_provider,
+                                         rotation_window=datetime.timedelta(minutes=10))
+        self.provider_user = ProviderUser(provider_name="fence", user_id="user")
+        self.prep_key_fn = MagicMock(return_value="prepped")
+        self.fence_fetch_fn = MagicMock(return_value="key_json")
+
+    def test_no_wait_does_not_prep_key_while_locked(self, build_key):
+        with self.assertRaises(ServiceAccountUpdateInProgressException):
+            self.storage._fetch_and_cache_service_account(self.provider_user, self.prep_key_fn, self.fence_fetch_fn,
+                                                          wait=False)
+
+        self.prep_key_fn.assert_not_called()
+        self.fence_fetch_fn.assert_not_called()
+
+    def test_rotate_does_not_prep_key_while_locked(self, build_key):
+        build_key.return_value.get.return_value = MagicMock(
+            expires_at=datetime.datetime.now() + datetime.timedelta(minutes=1))
+
+        self.storage._rotate(self.provider_user, self.prep_key_fn, self.fence_fetch_fn)
+
+        self.prep_key_fn.assert_not_called()
+        self.fence_fetch_fn.assert_not_called()
@@ -1,8 +1,13 @@
+import json
 import unittest
 from bond_app.fence_token_vending import FenceTokenVendingMachine
+from bond_app.fence_token_storage import ServiceAccountUpdateInProgressException
 from werkzeug import exceptions
 
-from mock import MagicMock
+import jwt
+import rsa
+from google.oauth2 import service_account
+from mock import MagicMock, patch
 from bond_app.fence_api import FenceApi
 from bond_app.oauth_adapter import OauthAdapter
 from tests.unit.fake_token_store import FakeTokenStore
@@ -45,6 +50,20 @@ class FenceTokenVendingMachineTestCase(unittest.TestCase):
         with self.assertRaises(exceptions.NotFound):
             ftvm.get_service_account_key_json(real_user_id)
 
+    def test_nonblocking_key_fetch_in_progress(self):
+        real_user_id = self._random_subject_id()
+        self.fence_token_storage.retrieve = MagicMock(
+            side_effect=ServiceAccountUpdateInProgressException("lock is held"))
+        ftvm = FenceTokenVendingMachine(self._mock_fence_api(None), self.cache_api, self.refresh_token_store,
+                                        self._mock_oauth_adapter("fake_token"), provider_name,
+                                        self.fence_token_storage)
+
+        with self.assertRaises(exceptions.ServiceUnavailable) as context:
+            ftvm.get_service_account_access_token(real_user_id, wait=False)
+
+        self.assertIn(('Retry-After', '5'), context.exception.get_headers())
+        self.assertFalse(self.fence_token_storage.retrieve.call_args[1]["wait"])
+
     def test_expired_refresh_token(self):
         real_user_id = self._random_subject_id()
         mock_oauth_adapter = OauthAdapter("", "", "", "")
@@ -58,6 +77,100 @@ class FenceTokenVendingMachineTestCase(unittest.TestCase):
                                       "foo@bar.com", provider_name)
         ftvm.remove_service_account(real_user_id)
 
+    def test_service_account_access_token_cached(self):
+        real_user_id = self._random_subject_id()
+        ftvm = self._linked_ftvm(real_user_id)
+
+        with patch.object(service_account.Credentials, "refresh", autospec=True,
+                          side_effect=self._fake_refresh) as refresh:
+            first_token = ftvm.get_service_account_access_token(real_user_id, ["profile", "email"])
+            # The same scopes in a different order are served from the cache.
+            second_token = ftvm.get_service_account_access_token(real_user_id, ["email", "profile", "email"])
+            other_scopes_token = ftvm.get_service_account_access_token(real_user_id, ["email"])
+
+        self.assertEqual(first_token, second_token)
+        self.assertNotEqual(first_token, other_scopes_token)
+        self.assertEqual(2, refresh.call_count)
+        self.assertEqual(1, len(ftvm._credentials_cache))
+
+    def test_service_account_access_token_not_cached_near_expiry(self):
+        real_user_id = self._random_subject_id()
+        ftvm = self._linked_ftvm(real_user_id)
+
+        def refresh_near_expiry(credentials, request):
+            self._fake_refresh(credentials, request)
+            credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=60)
+
+        with patch.object(service_account.Credentials, "refresh", autospec=True,
+                          side_effect=refresh_near_expiry) as refresh:
+            ftvm.get_service_account_access_token(real_user_id)
+            ftvm.get_service_account_access_token(real_user_id)
+
+        self.assertEqual(2, refresh.call_count)
+
+    def test_remove_service_account_clears_cached_access_tokens(self):
+        real_user_id = self._random_subject_id()
+        ftvm = self._linked_ftvm(real_user_id)
+
+        with patch.object(service_account.Credentials, "refresh", autospec=True,
+                          side_effect=self._fake_refresh) as refresh:
+            ftvm.get_service_account_access_token(real_user_id)
+            ftvm.remove_service_account(real_user_id)
+            ftvm.get_service_account_access_token(real_user_id)
+
+        self.assertEqual(2, refresh.call_count)
+
+    def test_self_signed_jwt_for_audience(self):
+        real_user_id = self._random_subject_id()
+        ftvm = self._linked_ftvm(real_user_id)
+        audience = "https://storage.googleapis.com/"
+
+        with patch.object(service_account.Credentials, "refresh", autospec=True) as refresh:
+            token = ftvm.get_service_account_access_token(real_user_id, audience=audience)
+            cached_token = ftvm.get_service_account_access_token(real_user_id, audience=audience)
+
+        self.assertEqual(0, refresh.call_count)
+        self.assertEqual(token, cached_token)
+        claims = jwt.decode(token, options={"verify_signature": False})
+        self.assertEqual(audience, claims["aud"])
+        self.assertEqual("fake@example.iam.gserviceaccount.com", claims["sub"])
+
+    def test_self_signed_jwt_falls_back_to_access_token(self):
+        real_user_id = self._random_subject_id()
+        ftvm = self._linked_ftvm(real_user_id)
+
+        with patch("google.auth.jwt.Credentials.from_signing_credentials", side_effect=Exception("can't sign")), \
+                patch.object(service_account.Credentials, "refresh", autospec=True,
+                             side_effect=self._fake_refresh) as refresh:
+            token = ftvm.get_service_account_access_token(real_user_id, audience="https://storage.googleapis.com/")
+
+        self.assertEqual(1, refresh.call_count)
+        self.assertTrue(token.startswith("token-"))
+
+    def _linked_ftvm(self, user_id):
+        ftvm = FenceTokenVendingMachine(self._mock_fence_api(self._service_account_key_json()),
+                                        self.cache_api, self.refresh_token_store,
+                                        self._mock_oauth_adapter("fake_token"), provider_name,
+                                        self.fence_token_storage)
+        ftvm.fence_api.delete_credentials_google = MagicMock()
+        self.refresh_token_store.save(user_id, "fake_refresh_token", datetime.datetime.now(), "foo@bar.com",
+                                      provider_name)
+        return ftvm
+
+    @staticmethod
+    def _fake_refresh(credentials, request):
+        credentials.token = "token-" + ''.join(random.choice(string.ascii_letters) for _ in range(10))
+        credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+    @staticmethod
+    def _service_account_key_json():
+        _, private_key = rsa.newkeys(512)
+        return json.dumps({"type": "service_account",
+                           "private_key_id": "fake_key_id",
+                           "private_key": private_key.save_pkcs1().decode("utf-8"),
+                           "client_email": "fake@example.iam.gserviceaccount.com",
+                           "token_uri": "https://oauth2.googleapis.com/token"})
+
     @staticmethod
     def _mock_fence_api(service_account_json):
         fence_api = FenceApi("")
@@ -0,0 +1,130 @@
+import configparser
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+
+import requests
+
+from bond_app.http_client import HttpClient, HttpClientConfig, _JitteredRetry
+
+
+class _FlakyHandler(BaseHTTPRequestHandler):
+    """Answers 503 to the first `failures` requests and 200 after that."""
+    failures = 0
+    requests_seen = 0
+
+    def _respond(self):
+        type(self).requests_seen += 1
+        status = 503 if type(self).requests_seen <= type(self).failures else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_GET = _respond
+    do_POST = _respond
+    do_HEAD = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    """Keeps connections open, sets a cookie and records the client port and Cookie header of each request."""
+    protocol_version = "HTTP/1.1"
+    requests_seen = []
+
+    def _respond(self):
+        type(self).requests_seen.append((self.command, self.client_address[1], self.headers.get("Cookie")))
+        self.send_response(200)
+        self.send_header("Set-Cookie", "affinity=user1")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_GET = _respond
+    do_HEAD = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        _FlakyHandler.failures = 0
+        _FlakyHandler.requests_seen = 0
+        self.server = HTTPServer(("127.0.0.1", 0), _FlakyHandler)
+        threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_port)
+        self.client = HttpClient(HttpClientConfig(max_retries=2, backoff_factor=0))
+
+    def test_config_from_section(self):
+        config = configparser.ConfigParser()
+        config.read_string("[sam]\nHTTP_POOL_SIZE=3\nHTTP_READ_TIMEOUT=7.5\n")
+        http_client_config = HttpClientConfig.from_config(config, "sam")
+        self.assertEqual(http_client_config.pool_size, 3)
+        self.assertEqual(http_client_config.read_timeout, 7.5)
+        self.assertEqual(http_client_config.connect_timeout, HttpClientConfig().connect_timeout)
+
+    def test_config_from_missing_section(self):
+        http_client_config = HttpClientConfig.from_config(configparser.ConfigParser(), "missing")
+        self.assertEqual(http_client_config.max_retries, HttpClientConfig().max_retries)
+
+    def test_default_timeout(self):
+        client = HttpClient(HttpClientConfig(connect_timeout=1, read_timeout=2))
+        self.assertEqual(client.adapter.timeout, (1, 2))
+
+    def test_retries_idempotent_requests(self):
+        _FlakyHandler.failures = 2
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(_FlakyHandler.requests_seen, 3)
+
+    def test_retry_budget_is_bounded(self):
+        _FlakyHandler.failures = 10
+        self.assertEqual(self.client.get(self.url).status_code, 503)
+        self.assertEqual(_FlakyHandler.requests_seen, 3)
+
+    def test_does_not_retry_post_responses(self):
+        _FlakyHandler.failures = 1
+        self.assertEqual(self.client.post(self.url).status_code, 503)
+        self.assertEqual(_FlakyHandler.requests_seen, 1)
+
+    def test_mounted_session_shares_adapter(self):
+        session = requests.Session()
+        self.client.mount(session)
+        self.assertIs(session.get_adapter(self.url), self.client.adapter)
+        self.assertEqual(session.get(self.url).status_code, 200)
+
+    def test_preconnect_opens_reused_connection(self):
+        url = self._start_keep_alive_server()
+        self.client.preconnect(url)
+        self.client.get(url)
+        (head_method, head_port, _), (get_method, get_port, _) = _KeepAliveHandler.requests_seen
+        self.assertEqual(("HEAD", "GET"), (head_method, get_method))
+        self.assertEqual(head_port, get_port)
+
+    def test_cookies_not_sent_on_later_requests(self):
+        url = self._start_keep_alive_server()
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual([None, None], [cookie for _, _, cookie in _KeepAliveHandler.requests_seen])
+        self.assertEqual(0, len(self.client.session.cookies))
+
+    def _start_keep_alive_server(self):
+        _KeepAliveHandler.requests_seen = []
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        # Close the client's connections before the server, whose threads would otherwise wait on them.
+        self.addCleanup(self.client.session.close)
+        return "http://127.0.0.1:{}/".format(server.server_port)
+
+    def test_backoff_is_jittered(self):
+        retry = _JitteredRetry(total=5, backoff_factor=1)
+        for _ in range(3):
+            retry = retry.increment(method="GET", url="/")
+        for _ in range(20):
+            self.assertTrue(0 <= retry.get_backoff_time() <= 4)
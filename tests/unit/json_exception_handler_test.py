@@ -0,0 +1,39 @@
+import unittest
+
+import flask
+from werkzeug import exceptions
+
+from bond_app.json_exception_handler import JsonExceptionHandler
+
+
+class JsonExceptionHandlerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(JsonExceptionHandlerTestCase, self).setUp()
+        app = flask.Flask(__name__)
+
+        @app.route('/not_found')
+        def not_found():
+            raise exceptions.NotFound("no such thing")
+
+        @app.route('/unavailable')
+        def unavailable():
+            raise exceptions.ServiceUnavailable("busy", retry_after=5)
+
+        JsonExceptionHandler(app)
+        self.client = app.test_client()
+
+    def test_http_exception_as_json(self):
+        response = self.client.get('/not_found')
+
+        self.assertEqual(404, response.status_code)
+        self.assertEqual('application/json', response.content_type)
+        self.assertEqual("no such thing", response.get_json()["error"]["message"])
+        self.assertEqual("notFound", response.get_json()["error"]["errors"][0]["reason"])
+
+    def test_http_exception_headers_kept(self):
+        response = self.client.get('/unavailable')
+
+        self.assertEqual(503, response.status_code)
+        self.assertEqual('application/json', response.content_type)
+        self.assertEqual('5', response.headers['Retry-After'])
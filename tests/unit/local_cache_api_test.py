@@ -0,0 +1,45 @@
+import time
+import unittest
+
+from bond_app.local_cache_api import LocalCacheApi
+from tests.unit.cache_api_test import CacheApiTest
+
+
+class LocalCacheApiTestCase(unittest.TestCase, CacheApiTest):
+    def setUp(self):
+        self.setUpCache(LocalCacheApi())
+
+    def test_evicts_least_recently_used(self):
+        cache = LocalCacheApi(max_size=2)
+        cache.add('foo', 1)
+        cache.add('bar', 2)
+        # Reading 'foo' makes 'bar' the least recently used entry.
+        self.assertEqual(cache.get('foo'), 1)
+        cache.add('baz', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('foo'), 1)
+        self.assertIsNone(cache.get('bar'))
+        self.assertEqual(cache.get('baz'), 3)
+
+    def test_namespaces_share_bound(self):
+        cache = LocalCacheApi(max_size=1)
+        cache.add('foo', 1, namespace='bar')
+        cache.add('foo', 2, namespace='baz')
+        self.assertIsNone(cache.get('foo', namespace='bar'))
+        self.assertEqual(cache.get('foo', namespace='baz'), 2)
+
+    def test_max_expires_in_caps_expiration(self):
+        cache = LocalCacheApi(max_expires_in=0.5)
+        cache.add('foo', 42)
+        cache.add('bar', 24, expires_in=60)
+        self.assertEqual(cache.get('foo'), 42)
+        time.sleep(1)
+        self.assertIsNone(cache.get('foo'))
+        self.assertIsNone(cache.get('bar'))
+
+    def test_invalid_bounds(self):
+        with self.assertRaises(ValueError):
+            LocalCacheApi(max_size=0)
+        with self.assertRaises(ValueError):
+            LocalCacheApi(max_expires_in=0)
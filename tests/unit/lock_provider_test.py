@@ -0,0 +1,56 @@
+import time
+import unittest
+
+from bond_app.fence_token_storage import ProviderUser
+from bond_app.lock_provider import RedisLockProvider
+from tests.unit.fake_redis import FakeRedis
+
+
+class RedisLockProviderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(RedisLockProviderTestCase, self).setUp()
+        self.lock_provider = RedisLockProvider(FakeRedis())
+        self.provider_user = ProviderUser(provider_name="fence", user_id="user")
+
+    def test_acquire_and_release(self):
+        token = self.lock_provider.acquire(self.provider_user, 30)
+
+        self.assertIsNotNone(token)
+        self.assertTrue(self.lock_provider.is_locked(self.provider_user))
+        self.assertTrue(self.lock_provider.release(self.provider_user, token))
+        self.assertFalse(self.lock_provider.is_locked(self.provider_user))
+
+    def test_acquire_held_lock_fails(self):
+        self.lock_provider.acquire(self.provider_user, 30)
+
+        self.assertIsNone(self.lock_provider.acquire(self.provider_user, 30))
+
+    def test_locks_are_per_provider_user(self):
+        self.lock_provider.acquire(self.provider_user, 30)
+
+        self.assertIsNotNone(self.lock_provider.acquire(ProviderUser(provider_name="other", user_id="user"), 30))
+        self.assertIsNotNone(self.lock_provider.acquire(ProviderUser(provider_name="fence", user_id="other"), 30))
+
+    def test_lock_expires(self):
+        self.lock_provider.acquire(self.provider_user, 0.1)
+        time.sleep(0.2)
+
+        self.assertFalse(self.lock_provider.is_locked(self.provider_user))
+        self.assertIsNotNone(self.lock_provider.acquire(self.provider_user, 30))
+
+    def test_release_with_stale_token_keeps_lock(self):
+        stale_token = self.lock_provider.acquire(self.provider_user, 0.1)
+        time.sleep(0.2)
+        self.lock_provider.acquire(self.provider_user, 30)
+
+        self.assertFalse(self.lock_provider.release(self.provider_user, stale_token))
+        self.assertTrue(self.lock_provider.is_locked(self.provider_user))
+
+    def test_extend(self):
+        token = self.lock_provider.acquire(self.provider_user, 0.2)
+
+        self.assertTrue(self.lock_provider.extend(self.provider_user, token, 30))
+        time.sleep(0.3)
+        self.assertTrue(self.lock_provider.is_locked(self.provider_user))
+        self.assertFalse(self.lock_provider.extend(self.provider_user, "other_token", 30))
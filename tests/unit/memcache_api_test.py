@@ -0,0 +1,65 @@
+import os
+import pickle
+import unittest
+
+from pymemcache.test.utils import MockMemcacheClient
+
+from bond_app.memcache_api import MemcacheCacheApi
+from tests.unit.cache_api_test import CacheApiTest, PickleBomb
+
+
+class MemcacheCacheApiTestCase(unittest.TestCase, CacheApiTest):
+    def setUp(self):
+        self.client = MockMemcacheClient()
+        self.setUpCache(MemcacheCacheApi(self.client))
+
+    def test_long_keys_hashed(self):
+        long_key = "x" * 1000
+        self.assertTrue(self.cache.add(long_key, 42, namespace="with spaces"))
+        self.assertEqual(self.cache.get(long_key, namespace="with spaces"), 42)
+
+    def test_namespace_cannot_collide_with_key(self):
+        self.assertTrue(self.cache.add('b:c', 1, namespace='a'))
+        self.assertTrue(self.cache.add('c', 2, namespace='a:b'))
+        self.assertTrue(self.cache.add('n:a:c', 3))
+
+        self.assertEqual(self.cache.get('b:c', namespace='a'), 1)
+        self.assertEqual(self.cache.get('c', namespace='a:b'), 2)
+        self.assertEqual(self.cache.get('n:a:c'), 3)
+
+    def test_negative_expiration_deletes(self):
+        self.assertTrue(self.cache.add('foo', 42))
+        self.assertTrue(self.cache.add('foo', 24, expires_in=-1))
+        self.assertIsNone(self.cache.get('foo'))
+
+    def test_unencodable_value_not_cached(self):
+        self.assertFalse(self.cache.add('foo', object()))
+        self.assertIsNone(self.cache.get('foo'))
+        self.assertFalse(self.cache.add_multi({'foo': object(), 'bar': 1}))
+        self.assertEqual(self.cache.get_multi(['foo', 'bar']), {'bar': 1})
+
+    def test_pickled_value_not_loaded(self):
+        PickleBomb.loaded = False
+        self.client.set(self.cache._build_cache_key('foo', None), pickle.dumps(PickleBomb()))
+
+        self.assertIsNone(self.cache.get('foo'))
+        self.assertEqual(self.cache.get_multi(['foo']), {})
+        self.assertFalse(PickleBomb.loaded)
+
+    def test_expire_conversion(self):
+        self.assertEqual(MemcacheCacheApi._expire(0), 0)
+        self.assertEqual(MemcacheCacheApi._expire(0.5), 1)
+        self.assertEqual(MemcacheCacheApi._expire(600), 600)
+        # Beyond 30 days memcached needs an absolute timestamp.
+        self.assertGreater(MemcacheCacheApi._expire(60 * 60 * 24 * 31), 60 * 60 * 24 * 365)
+
+
+@unittest.skipUnless(os.environ.get('MEMCACHE_SERVERS'),
+                     "set MEMCACHE_SERVERS=host:port[,host:port] to test against local memcached")
+class LocalMemcacheCacheApiTestCase(unittest.TestCase, CacheApiTest):
+    def setUp(self):
+        servers = [(host, int(port)) for host, port in
+                   (server.split(':') for server in os.environ['MEMCACHE_SERVERS'].split(','))]
+        # Use a unique prefix per test so that tests do not see each other's entries.
+        self.setUpCache(MemcacheCacheApi(MemcacheCacheApi.create_client(servers, timeout=1),
+                                         prefix="bond-test-{}".format(os.urandom(8).hex())))
@@ -0,0 +1,37 @@
+import unittest
+
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import ndb
+
+from bond_app.ndb_global_cache import DEFAULT_TIMEOUTS, ModelCachePolicy
+
+
+class ModelCachePolicyTestCase(unittest.TestCase):
+    def setUp(self):
+        # Keys need a context, but no calls are made to Datastore.
+        context = ndb.Client(project="test", credentials=AnonymousCredentials()).context()
+        context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+
+    def test_default_policy(self):
+        policy = ModelCachePolicy()
+        oauth2_state_key = ndb.Key("OAuth2State", "abc")
+        cache_entry_key = ndb.Key("CacheEntry", "k:foo")
+
+        self.assertTrue(policy.cache(oauth2_state_key))
+        self.assertEqual(policy.timeout(oauth2_state_key), DEFAULT_TIMEOUTS["OAuth2State"])
+        self.assertFalse(policy.cache(cache_entry_key))
+
+    def test_default_policy_does_not_cache_secrets(self):
+        policy = ModelCachePolicy()
+
+        self.assertFalse(policy.cache(ndb.Key("User", "abc", "RefreshToken", "fence")))
+        self.assertFalse(policy.cache(ndb.Key("FenceServiceAccount", "fence")))
+
+    def test_parse(self):
+        policy = ModelCachePolicy.parse("RefreshToken:60, OAuth2State:10,")
+        self.assertEqual(policy.timeouts_by_kind, {"RefreshToken": 60, "OAuth2State": 10})
+        self.assertFalse(policy.cache(ndb.Key("FenceServiceAccount", "fence")))
+
+        self.assertEqual(ModelCachePolicy.parse(None).timeouts_by_kind, DEFAULT_TIMEOUTS)
+        self.assertEqual(ModelCachePolicy.parse("").timeouts_by_kind, {})
@@ -1,7 +1,9 @@
+import json
 import unittest
 
 from tests.unit.fake_cache_api import FakeCacheApi
-from mock import MagicMock
+from tests.unit.fake_executor import FakeExecutor
+from mock import MagicMock, patch
 from werkzeug import exceptions
 
 from bond_app.open_id_config import OpenIdConfig
@@ -40,3 +42,87 @@ class OpenIdConfigTestCase(unittest.TestCase):
     def test_get_revoke_url(self):
         url_regex = "^http(s)?:\/\/.+?revoke"
         self.assertRegex(self.open_id_config.get_revoke_url(), url_regex)
+
+
+class OpenIdConfigMemoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000
+        patcher = patch("bond_app.open_id_config.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.http_client = MagicMock()
+        self.respond_with({"token_endpoint": "https://fake.domain/token"})
+        self.cache_api = FakeCacheApi()
+        self.executor = FakeExecutor()
+        self.open_id_config = OpenIdConfig("fake_provider", "https://fake.domain/config", self.cache_api,
+                                           self.http_client, executor=self.executor, memo_ttl=300, retry_interval=30)
+
+    def respond_with(self, config, status_code=200):
+        self.http_client.get.return_value = MagicMock(status_code=status_code, content=json.dumps(config))
+
+    def test_memoizes_config(self):
+        self.assertEqual("https://fake.domain/token", self.open_id_config.get_token_info_url())
+        self.cache_api.delete("fake_provider", namespace="OauthAdapter")
+        self.now += 299
+        self.assertEqual("https://fake.domain/token", self.open_id_config.get_token_info_url())
+        self.assertEqual(1, self.http_client.get.call_count)
+        self.assertEqual([], self.executor.submitted)
+
+    def test_reloads_expired_config_in_background(self):
+        self.open_id_config.load_dict()
+        self.respond_with({"token_endpoint": "https://fake.domain/new-token"})
+        self.cache_api.delete("fake_provider", namespace="OauthAdapter")
+        self.now += 300
+        self.assertEqual("https://fake.domain/token", self.open_id_config.get_token_info_url())
+        self.assertEqual("https://fake.domain/token", self.open_id_config.get_token_info_url())
+        self.assertEqual(1, len(self.executor.submitted))
+        self.executor.run()
+        self.assertEqual("https://fake.domain/new-token", self.open_id_config.get_token_info_url())
+        self.assertEqual(2, self.http_client.get.call_count)
+
+    def test_reloads_from_shared_cache(self):
+        self.open_id_config.load_dict()
+        self.cache_api.add("fake_provider", {"token_endpoint": "https://fake.domain/shared-token"},
+                           namespace="OauthAdapter")
+        self.now += 300
+        self.open_id_config.load_dict()
+        self.executor.run()
+        self.assertEqual("https://fake.domain/shared-token", self.open_id_config.get_token_info_url())
+        self.assertEqual(1, self.http_client.get.call_count)
+
+    def test_serves_last_config_when_reload_fails(self):
+        self.open_id_config.load_dict()
+        self.respond_with({}, status_code=503)
+        self.cache_api.delete("fake_provider", namespace="OauthAdapter")
+        self.now += 300
+        self.open_id_config.load_dict()
+        self.executor.run()
+        self.assertEqual("https://fake.domain/token", self.open_id_config.get_token_info_url())
+        self.assertEqual([], self.executor.submitted)
+        self.now += 30
+        self.open_id_config.load_dict()
+        self.assertEqual(1, len(self.executor.submitted))
+
+    def test_first_load_failure_raises(self):
+        self.respond_with({}, status_code=503)
+        with self.assertRaises(exceptions.InternalServerError):
+            self.open_id_config.load_dict()
+
+    def test_reloads_inline_without_executor(self):
+        open_id_config = OpenIdConfig("fake_provider", "https://fake.domain/config", self.cache_api,
+                                      self.http_client, memo_ttl=300)
+        open_id_config.load_dict()
+        self.respond_with({"token_endpoint": "https://fake.domain/new-token"})
+        self.cache_api.delete("fake_provider", namespace="OauthAdapter")
+        self.now += 300
+        self.assertEqual("https://fake.domain/new-token", open_id_config.get_token_info_url())
+
+    def test_resubmits_reload_when_queue_full(self):
+        self.open_id_config.load_dict()
+        self.executor.full = True
+        self.now += 300
+        self.open_id_config.load_dict()
+        self.executor.full = False
+        self.open_id_config.load_dict()
+        self.assertEqual(1, len(self.executor.submitted))
@@ -0,0 +1,57 @@
+import os
+import pickle
+import unittest
+
+import redis
+
+from bond_app.redis_cache_api import RedisCacheApi
+from tests.unit.cache_api_test import CacheApiTest, PickleBomb
+from tests.unit.fake_redis import FakeRedis
+
+
+class RedisCacheApiTestCase(unittest.TestCase, CacheApiTest):
+    def setUp(self):
+        self.redis_client = FakeRedis()
+        self.setUpCache(RedisCacheApi(self.redis_client))
+
+    def test_negative_expiration_deletes(self):
+        self.assertTrue(self.cache.add('foo', 42))
+        self.assertTrue(self.cache.add('foo', 24, expires_in=-1))
+        self.assertIsNone(self.cache.get('foo'))
+
+    def test_namespace_cannot_collide_with_key(self):
+        self.assertTrue(self.cache.add('b:c', 1, namespace='a'))
+        self.assertTrue(self.cache.add('c', 2, namespace='a:b'))
+        self.assertTrue(self.cache.add('n:a:c', 3))
+
+        self.assertEqual(self.cache.get('b:c', namespace='a'), 1)
+        self.assertEqual(self.cache.get('c', namespace='a:b'), 2)
+        self.assertEqual(self.cache.get('n:a:c'), 3)
+
+    def test_values_encoded(self):
+        self.cache.add('foo', {"a": (1, 2)}, namespace='bar')
+        self.assertEqual(self.cache.get('foo', namespace='bar'), {"a": (1, 2)})
+
+    def test_unencodable_value_not_cached(self):
+        self.assertFalse(self.cache.add('foo', object()))
+        self.assertIsNone(self.cache.get('foo'))
+        self.assertFalse(self.cache.add_multi({'foo': object(), 'bar': 1}))
+        self.assertEqual(self.cache.get_multi(['foo', 'bar']), {'bar': 1})
+
+    def test_pickled_value_not_loaded(self):
+        PickleBomb.loaded = False
+        self.redis_client.set(self.cache._build_cache_key('foo', None), pickle.dumps(PickleBomb()))
+
+        self.assertIsNone(self.cache.get('foo'))
+        self.assertEqual(self.cache.get_multi(['foo']), {})
+        self.assertFalse(PickleBomb.loaded)
+
+
+@unittest.skipUnless(os.environ.get('REDIS_HOST'), "set REDIS_HOST to test against a local Redis")
+class LocalRedisCacheApiTestCase(unittest.TestCase, CacheApiTest):
+    def setUp(self):
+        redis_client = redis.Redis(host=os.environ['REDIS_HOST'], port=int(os.environ.get('REDIS_PORT', 6379)))
+        # Use a unique prefix per test so that tests do not see each other's entries.
+        prefix = "bond:test:{}".format(self.id())
+        self.setUpCache(RedisCacheApi(redis_client, prefix=prefix))
+        self.addCleanup(lambda: [redis_client.delete(key) for key in redis_client.scan_iter(prefix + ":*")])
@@ -0,0 +1,198 @@
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+from mock import MagicMock
+
+from bond_app.background import BackgroundExecutor
+from bond_app.bond import Bond, FenceAccessToken, FenceKeys
+from bond_app.refresh_ahead import RefreshAheadScheduler
+from tests.unit.fake_cache_api import FakeCacheApi
+from tests.unit.fake_oauth2_state_store import FakeOAuth2StateStore
+from tests.unit.fake_token_store import FakeTokenStore
+
+
+def fake_bond(provider_name="test", refresh_access_token=None):
+    bond = MagicMock()
+    bond.provider_name = provider_name
+    bond.refresh_access_token = refresh_access_token or MagicMock(
+        return_value=FenceAccessToken("new_token", datetime.now() + timedelta(hours=1)))
+    return bond
+
+
+class RefreshAheadSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(RefreshAheadSchedulerTestCase, self).setUp()
+        self.executor = BackgroundExecutor()
+        # A long poll interval so that only explicit run_once calls schedule refreshes.
+        self.scheduler = RefreshAheadScheduler(self.executor, lead_time=60, poll_interval=3600)
+
+    def test_due_token_is_refreshed(self):
+        bond = fake_bond()
+        self.scheduler.track(bond, "user", datetime.now() + timedelta(seconds=30), refresh_threshold=0)
+
+        self.scheduler.run_once()
+        self.executor.join()
+
+        args, kwargs = bond.refresh_access_token.call_args
+        self.assertEqual(("user", 0), args)
+        stats = self.scheduler.stats()
+        self.assertEqual(1, stats["refreshed"])
+        self.assertEqual(0, stats["in_flight"])
+
+    def test_token_not_due_is_not_refreshed(self):
+        bond = fake_bond()
+        self.scheduler.track(bond, "user", datetime.now() + timedelta(hours=1), refresh_threshold=600)
+
+        self.scheduler.run_once()
+        self.executor.join()
+
+        bond.refresh_access_token.assert_not_called()
+        self.assertEqual(1, self.scheduler.stats()["tracked"])
+
+    def test_refreshed_token_is_scheduled_from_new_expiry(self):
+        bond = fake_bond()
+        self.scheduler.track(bond, "user", datetime.now(), refresh_threshold=0)
+
+        self.scheduler.run_once()
+        self.executor.join()
+        self.scheduler.run_once()
+        self.executor.join()
+
+        bond.refresh_access_token.assert_called_once()
+
+    def test_refresh_deferred_while_lease_held_backs_off(self):
+        bond = fake_bond(refresh_access_token=MagicMock(return_value=None))
+        expires_at = datetime.now() + timedelta(seconds=30)
+        self.scheduler.poll_interval = 5
+        self.scheduler.track(bond, "user", expires_at, refresh_threshold=0)
+
+        self.scheduler.run_once()
+        self.executor.join()
+        # Requests for the same token do not undo the backoff.
+        self.scheduler.track(bond, "user", expires_at, refresh_threshold=0)
+        self.scheduler.run_once()
+        self.executor.join()
+
+        bond.refresh_access_token.assert_called_once()
+        stats = self.scheduler.stats()
+        self.assertEqual(1, stats["deferred"])
+        self.assertEqual(0, stats["refreshed"])
+        self.assertEqual(1, stats["tracked"])
+
+    def test_deferred_refresh_retried_after_backoff(self):
+        bond = fake_bond(refresh_access_token=MagicMock(side_effect=[
+            None, FenceAccessToken("new_token", datetime.now() + timedelta(hours=1))]))
+        self.scheduler.poll_interval = 0
+        self.scheduler.track(bond, "user", datetime.now(), refresh_threshold=0)
+
+        for _ in range(2):
+            self.scheduler.run_once()
+            self.executor.join()
+
+        self.assertEqual(2, bond.refresh_access_token.call_count)
+        self.assertEqual(1, self.scheduler.stats()["refreshed"])
+
+    def test_idle_token_is_dropped(self):
+        self.scheduler.idle_time = -1
+        bond = fake_bond()
+        self.scheduler.track(bond, "user", datetime.now(), refresh_threshold=0)
+
+        self.scheduler.run_once()
+        self.executor.join()
+
+        bond.refresh_access_token.assert_not_called()
+        self.assertEqual(0, self.scheduler.stats()["tracked"])
+
+    def test_failed_refresh_stops_tracking(self):
+        bond = fake_bond(refresh_access_token=MagicMock(side_effect=Exception("boom")))
+        self.scheduler.track(bond, "user", datetime.now(), refresh_threshold=0)
+
+        self.scheduler.run_once()
+        self.executor.join()
+
+        stats = self.scheduler.stats()
+        self.assertEqual(1, stats["failed"])
+        self.assertEqual(0, stats["tracked"])
+
+    def test_max_tracked_evicts_least_recently_requested(self):
+        self.scheduler.max_tracked = 2
+        bond = fake_bond()
+        for user in ["user1", "user2", "user3"]:
+            self.scheduler.track(bond, user, datetime.now(), refresh_threshold=0)
+
+        self.scheduler.run_once()
+        self.executor.join()
+
+        refreshed_users = sorted(args[0] for args, _ in bond.refresh_access_token.call_args_list)
+        self.assertEqual(["user2", "user3"], refreshed_users)
+        self.assertEqual(1, self.scheduler.stats()["evicted"])
+
+    def test_refreshes_limited_per_provider(self):
+        self.scheduler.max_refreshes_per_provider = 1
+        release = threading.Event()
+
+        def slow_refresh(sam_user_id, refresh_threshold, refreshed_after):
+            release.wait()
+            return FenceAccessToken("new_token", datetime.now() + timedelta(hours=1))
+
+        bond = fake_bond(refresh_access_token=MagicMock(side_effect=slow_refresh))
+        other_bond = fake_bond(provider_name="other")
+        for user in ["user1", "user2"]:
+            self.scheduler.track(bond, user, datetime.now(), refresh_threshold=0)
+        self.scheduler.track(other_bond, "user1", datetime.now(), refresh_threshold=0)
+
+        self.scheduler.run_once()
+        self.assertEqual(2, self.scheduler.stats()["scheduled"])
+        release.set()
+        self.executor.join()
+
+        # The second user of the limited provider is refreshed on the next pass.
+        self.scheduler.run_once()
+        self.executor.join()
+        self.assertEqual(2, bond.refresh_access_token.call_count)
+        other_bond.refresh_access_token.assert_called_once()
+
+    def test_refresh_dropped_when_queue_full(self):
+        executor = MagicMock()
+        executor.submit = MagicMock(return_value=False)
+        scheduler = RefreshAheadScheduler(executor, poll_interval=3600)
+        scheduler.track(fake_bond(), "user", datetime.now(), refresh_threshold=0)
+
+        scheduler.run_once()
+
+        stats = scheduler.stats()
+        self.assertEqual(1, stats["dropped"])
+        self.assertEqual(0, stats["in_flight"])
+        self.assertEqual(1, stats["tracked"])
+
+    def test_token_refreshed_by_other_scheduler_is_not_refreshed_again(self):
+        shared_cache_api = FakeCacheApi()
+        refresh_token_store = FakeTokenStore()
+        refresh_token_store.save("user", "refresh_token", datetime.now(), "name", "test")
+        oauth_adapter = MagicMock()
+        oauth_adapter.refresh_access_token = MagicMock(side_effect=lambda refresh_token: {
+            FenceKeys.ACCESS_TOKEN: "new_token",
+            FenceKeys.EXPIRES_AT: (datetime.now() + timedelta(hours=1)).timestamp()})
+        expires_at = datetime.now() + timedelta(seconds=30)
+        schedulers = []
+        # One scheduler and Bond per worker, sharing the cache.
+        for _ in range(2):
+            scheduler = RefreshAheadScheduler(self.executor, lead_time=60, poll_interval=3600)
+            bond = Bond(oauth_adapter, None, shared_cache_api, refresh_token_store, FakeOAuth2StateStore(), None,
+                        "test", "/context/user/name", {})
+            scheduler.track(bond, "user", expires_at, refresh_threshold=0)
+            schedulers.append(scheduler)
+
+        for scheduler in schedulers:
+            scheduler.run_once()
+            self.executor.join()
+
+        oauth_adapter.refresh_access_token.assert_called_once()
+        for scheduler in schedulers:
+            self.assertEqual(1, scheduler.stats()["tracked"])
+            # Both are rescheduled from the new token's expiry.
+            scheduler.run_once()
+            self.executor.join()
+        oauth_adapter.refresh_access_token.assert_called_once()
@@ -0,0 +1,112 @@
+import threading
+import time
+import unittest
+
+from bond_app.single_flight import SingleFlight, CacheLease
+from tests.unit.fake_cache_api import FakeCacheApi
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def test_concurrent_calls_share_result(self):
+        single_flight = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def slow_fn():
+            calls.append(1)
+            release.wait()
+            return "result"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(single_flight.do("key", slow_fn)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        # Give the followers time to start waiting on the leader.
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["result"] * 5)
+
+    def test_in_flight(self):
+        single_flight = SingleFlight()
+        in_flight = []
+
+        single_flight.do("key", lambda: in_flight.append(single_flight.in_flight("key")))
+
+        self.assertEqual([True], in_flight)
+        self.assertFalse(single_flight.in_flight("key"))
+
+    def test_concurrent_calls_share_exception(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+
+        def failing_fn():
+            release.wait()
+            raise ValueError("boom")
+
+        errors = []
+
+        def call():
+            try:
+                single_flight.do("key", failing_fn)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 3)
+
+    def test_sequential_calls_are_not_shared(self):
+        single_flight = SingleFlight()
+        self.assertEqual(single_flight.do("key", lambda: 1), 1)
+        self.assertEqual(single_flight.do("key", lambda: 2), 2)
+
+    def test_different_keys_are_not_shared(self):
+        single_flight = SingleFlight()
+        self.assertEqual(single_flight.do("foo", lambda: single_flight.do("bar", lambda: "bar")), "bar")
+
+
+class CacheLeaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_api = FakeCacheApi()
+        self.lease = CacheLease(self.cache_api, "lease", expires_in=1, poll_interval=0.01)
+
+    def test_acquire_and_release(self):
+        lease_token = self.lease.acquire("key")
+        self.assertIsNotNone(lease_token)
+        self.assertIsNone(self.lease.acquire("key"))
+
+        self.lease.release("key", lease_token)
+        self.assertIsNotNone(self.lease.acquire("key"))
+
+    def test_release_ignores_other_holders(self):
+        self.lease.acquire("key")
+        self.lease.release("key", "not the lease token")
+        self.assertIsNone(self.lease.acquire("key"))
+
+    def test_lease_expires(self):
+        self.assertIsNotNone(self.lease.acquire("key"))
+        time.sleep(1.1)
+        self.assertIsNotNone(self.lease.acquire("key"))
+
+    def test_wait_for_result(self):
+        self.lease.acquire("key")
+        results = iter([None, None, "result"])
+        self.assertEqual(self.lease.wait_for("key", lambda: next(results)), "result")
+
+    def test_wait_for_released_lease_without_result(self):
+        lease_token = self.lease.acquire("key")
+        self.lease.release("key", lease_token)
+        self.assertIsNone(self.lease.wait_for("key", lambda: None))
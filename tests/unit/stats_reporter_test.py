@@ -0,0 +1,41 @@
+import unittest
+
+from mock import patch
+
+from bond_app.stats_reporter import StatsReporter
+
+
+class StatsReporterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.reporter = StatsReporter(interval=300)
+
+    def test_report_logs_registered_stats(self):
+        self.reporter.register("cache tiers", lambda: [{"tier": "LocalCacheApi", "hits": 3, "misses": 1}])
+        with self.assertLogs("bond_app.stats_reporter", level="INFO") as logs:
+            self.reporter.report()
+        self.assertEqual(1, len(logs.output))
+        self.assertIn("cache tiers", logs.output[0])
+        self.assertIn("'hits': 3", logs.output[0])
+
+    def test_report_continues_after_failing_source(self):
+        def broken():
+            raise ValueError("broken")
+
+        self.reporter.register("broken", broken)
+        self.reporter.register("working", lambda: {"refreshed": 1})
+        with self.assertLogs("bond_app.stats_reporter", level="INFO") as logs:
+            self.reporter.report()
+        self.assertIn("Error getting stats for broken", logs.output[0])
+        self.assertIn("working", logs.output[1])
+
+    @patch("bond_app.stats_reporter.threading.Thread")
+    def test_start_once_per_process(self, thread):
+        self.reporter.start()
+        self.reporter.start()
+        self.assertEqual(1, thread.call_count)
+
+    @patch("bond_app.stats_reporter.threading.Thread")
+    def test_start_disabled(self, thread):
+        StatsReporter(interval=0).start()
+        self.assertEqual(0, thread.call_count)
@@ -20,7 +20,7 @@ class StatusTestCase(unittest.TestCase):
         status = Status(self._mock_sam_api(True), {"fence": self._mock_fence_api(True)}, self.cache_api)
         self._mock_datastore(status, True)
         message = "cache down"
-        status._get_cached_status = MagicMock(side_effect=Exception(message))
+        status._get_cached_statuses = MagicMock(side_effect=Exception(message))
         self.assertEqual(status.get(), [{"ok": False, "message": message, "subsystem": Subsystems.cache}])
 
     def test_datastore_error(self):
@@ -53,6 +53,39 @@ class StatusTestCase(unittest.TestCase):
             {"ok": False, "message": "sam down", "subsystem": Subsystems.sam},
         ])
 
+    def test_cached_status_read_and_written_in_one_call(self):
+        cache_api = MagicMock(wraps=self.cache_api)
+        fence_api = self._mock_fence_api(True)
+        status = Status(self._mock_sam_api(True), {"fence": fence_api}, cache_api)
+        self._mock_datastore(status, True)
+
+        self.assertEqual(status.get(), status.get())
+
+        self.assertEqual(2, cache_api.get_multi.call_count)
+        cache_api.add_multi.assert_called_once()
+        cache_api.get.assert_not_called()
+        cache_api.add.assert_not_called()
+        fence_api.status.assert_called_once()
+        status._datastore_status.assert_called_once()
+
+    def test_only_uncached_subsystems_checked(self):
+        fence_api = self._mock_fence_api(True)
+        sam_api = self._mock_sam_api(True)
+        status = Status(sam_api, {"fence": fence_api}, self.cache_api)
+        self._mock_datastore(status, True)
+        status.get()
+        self.cache_api.delete("status:fence", namespace="bond")
+        fence_api.status = MagicMock(return_value=(False, "fence down"))
+
+        self.assertEqual(status.get(), [
+            {"ok": False, "message": "fence down", "subsystem": "fence"},
+            {"ok": True, "message": "", "subsystem": Subsystems.cache},
+            {"ok": True, "message": "", "subsystem": Subsystems.datastore},
+            {"ok": True, "message": "", "subsystem": Subsystems.sam},
+        ])
+        sam_api.status.assert_called_once()
+        status._datastore_status.assert_called_once()
+
     @staticmethod
     def _mock_fence_api(ok):
         fence_api = FenceApi("")
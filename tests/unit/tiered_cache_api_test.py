@@ -0,0 +1,61 @@
+import unittest
+
+from mock import patch
+
+from bond_app.local_cache_api import LocalCacheApi
+from bond_app.tiered_cache_api import TieredCacheApi
+from tests.unit.cache_api_test import CacheApiTest
+from tests.unit.fake_cache_api import FakeCacheApi
+
+
+class TieredCacheApiTestCase(unittest.TestCase, CacheApiTest):
+    def setUp(self):
+        self.local_cache = LocalCacheApi()
+        self.shared_cache = FakeCacheApi()
+        self.setUpCache(TieredCacheApi([self.local_cache, self.shared_cache]))
+
+    def test_writes_through_to_all_tiers(self):
+        self.assertTrue(self.cache.add('foo', 42, namespace='bar'))
+        self.assertEqual(self.local_cache.get('foo', namespace='bar'), 42)
+        self.assertEqual(self.shared_cache.get('foo', namespace='bar'), 42)
+
+    def test_reads_through_and_backfills(self):
+        self.shared_cache.add('foo', 42, namespace='bar')
+        self.assertIsNone(self.local_cache.get('foo', namespace='bar'))
+
+        self.assertEqual(self.cache.get('foo', namespace='bar'), 42)
+        self.assertEqual(self.local_cache.get('foo', namespace='bar'), 42)
+
+    def test_delete_from_all_tiers(self):
+        self.cache.add('foo', 42)
+        self.cache.delete('foo')
+        self.assertIsNone(self.local_cache.get('foo'))
+        self.assertIsNone(self.shared_cache.get('foo'))
+
+    def test_stats(self):
+        self.shared_cache.add('foo', 42)
+        self.cache.get('foo')  # local miss, shared hit
+        self.cache.get('foo')  # local hit
+        self.cache.get('bar')  # miss in both
+
+        self.assertEqual(self.cache.stats(), [
+            {"tier": "LocalCacheApi", "hits": 1, "misses": 2},
+            {"tier": "FakeCacheApi", "hits": 1, "misses": 1},
+        ])
+
+    def test_get_multi_reads_only_misses_from_slower_tiers(self):
+        self.cache.add('foo', 42)
+        self.shared_cache.add('bar', 24, namespace='baz')
+
+        with patch.object(self.shared_cache, 'get_multi', wraps=self.shared_cache.get_multi) as shared_get_multi:
+            self.assertEqual(self.cache.get_multi(['foo', ('bar', 'baz'), 'qat']), {'foo': 42, ('bar', 'baz'): 24})
+            shared_get_multi.assert_called_once_with([('bar', 'baz'), 'qat'], namespace=None)
+        self.assertEqual(self.local_cache.get('bar', namespace='baz'), 24)
+        self.assertEqual(self.cache.stats(), [
+            {"tier": "LocalCacheApi", "hits": 1, "misses": 2},
+            {"tier": "FakeCacheApi", "hits": 1, "misses": 1},
+        ])
+
+    def test_requires_a_tier(self):
+        with self.assertRaises(ValueError):
+            TieredCacheApi([])
@@ -0,0 +1,64 @@
+import contextlib
+import threading
+import unittest
+
+from mock import MagicMock
+
+from bond_app.warmup import Warmup, warm_up_open_id_config
+
+
+class WarmupTestCase(unittest.TestCase):
+
+    def test_runs_tasks_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+        warmup = Warmup(deadline=5)
+        for name in ("a", "b", "c"):
+            warmup.add(name, barrier.wait)
+        result = warmup.run()
+        self.assertEqual(["a", "b", "c"], result.succeeded)
+        self.assertEqual([], result.failed)
+        self.assertEqual([], result.timed_out)
+
+    def test_failed_task_does_not_stop_others(self):
+        warmup = Warmup(deadline=5)
+        warmup.add("ok", lambda: None)
+        warmup.add("broken", MagicMock(side_effect=IOError("connection refused")))
+        result = warmup.run()
+        self.assertEqual(["ok"], result.succeeded)
+        self.assertEqual(["broken"], result.failed)
+
+    def test_stops_waiting_at_deadline(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        warmup = Warmup(deadline=0.1)
+        warmup.add("slow", release.wait)
+        warmup.add("fast", lambda: None)
+        result = warmup.run()
+        self.assertEqual(["fast"], result.succeeded)
+        self.assertEqual(["slow"], result.timed_out)
+
+    def test_runs_tasks_in_context(self):
+        contexts = []
+
+        @contextlib.contextmanager
+        def context_factory():
+            contexts.append(threading.current_thread())
+            yield
+
+        task = MagicMock()
+        warmup = Warmup(deadline=5, context_factory=context_factory)
+        warmup.add("task", task, "arg")
+        warmup.run()
+        task.assert_called_once_with("arg")
+        self.assertEqual(1, len(contexts))
+
+    def test_no_tasks(self):
+        result = Warmup().run()
+        self.assertEqual([], result.succeeded)
+
+    def test_warm_up_open_id_config(self):
+        open_id_config = MagicMock()
+        open_id_config.get_token_info_url.return_value = "https://fake.domain/token"
+        warm_up_open_id_config(open_id_config)
+        open_id_config.load_dict.assert_called_once_with()
+        open_id_config.http_client.preconnect.assert_called_once_with("https://fake.domain/token")
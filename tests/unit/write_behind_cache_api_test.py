@@ -0,0 +1,73 @@
+import time
+import unittest
+
+from mock import patch
+
+from bond_app.background import BackgroundExecutor
+from bond_app.write_behind_cache_api import WriteBehindCacheApi
+from tests.unit.cache_api_test import CacheApiTest
+from tests.unit.fake_cache_api import FakeCacheApi
+from tests.unit.fake_executor import FakeExecutor
+
+
+class WriteBehindCacheApiTestCase(unittest.TestCase, CacheApiTest):
+    def setUp(self):
+        self.setUpCache(WriteBehindCacheApi(FakeCacheApi(), BackgroundExecutor(max_workers=2)))
+
+
+class WriteBehindCacheApiQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.executor = FakeExecutor()
+        self.shared_cache = FakeCacheApi()
+        self.cache = WriteBehindCacheApi(self.shared_cache, self.executor)
+
+    def test_writes_in_background(self):
+        self.assertTrue(self.cache.add('foo', 42, namespace='bar'))
+        self.assertIsNone(self.shared_cache.get('foo', namespace='bar'))
+        self.assertEqual(self.cache.pending(), 1)
+
+        self.executor.run()
+        self.assertEqual(self.shared_cache.get('foo', namespace='bar'), 42)
+        self.assertEqual(self.cache.pending(), 0)
+
+    def test_reads_queued_writes(self):
+        self.shared_cache.add('bar', 24)
+        self.cache.add('foo', 42)
+
+        self.assertEqual(self.cache.get('foo'), 42)
+        self.assertEqual(self.cache.get_multi(['foo', 'bar', 'baz']), {'foo': 42, 'bar': 24})
+
+    def test_delete_wins_over_queued_write(self):
+        self.shared_cache.add('foo', 1)
+        self.cache.add('foo', 42)
+        self.cache.delete('foo')
+        self.assertIsNone(self.cache.get('foo'))
+
+        self.executor.run()
+        self.assertIsNone(self.shared_cache.get('foo'))
+
+    def test_later_write_wins(self):
+        self.cache.add('foo', 1)
+        self.cache.add('foo', 2)
+        self.executor.run()
+        self.assertEqual(self.shared_cache.get('foo'), 2)
+
+    def test_writes_remaining_life(self):
+        self.cache.add('foo', 42, expires_in=0.5)
+        time.sleep(0.2)
+        with patch.object(self.shared_cache, 'add', wraps=self.shared_cache.add) as shared_add:
+            self.executor.run()
+            _, kwargs = shared_add.call_args
+        self.assertLessEqual(kwargs['expires_in'], 0.3)
+
+    def test_expired_write_dropped(self):
+        self.cache.add('foo', 42, expires_in=0.01)
+        time.sleep(0.05)
+        self.executor.run()
+        self.assertNotIn('foo', self.shared_cache.cache)
+
+    def test_writes_synchronously_when_queue_full(self):
+        self.executor.full = True
+        self.assertTrue(self.cache.add('foo', 42))
+        self.assertEqual(self.shared_cache.get('foo'), 42)
+        self.assertEqual(self.cache.pending(), 0)